@@ -4,4 +4,5 @@ sleep 2
 
 alembic upgrade head
 
-python3 ./src/main.py
+# exec, чтобы SIGTERM от docker доходил до uvicorn и воркеры останавливались плавно
+exec python3 ./src/main.py
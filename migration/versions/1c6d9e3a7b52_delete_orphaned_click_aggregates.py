@@ -0,0 +1,32 @@
+"""Delete orphaned click aggregates
+
+Revision ID: 1c6d9e3a7b52
+Revises: f3b8d2a61c74
+Create Date: 2026-10-18 17:10:42.531906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c6d9e3a7b52'
+down_revision: Union[str, None] = 'f3b8d2a61c74'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Агрегаты переходов удаленных ссылок, которые раньше оставались в таблицах
+    # и доставались новой ссылке с тем же алиасом
+    for table in ('link_click_rollup', 'link_click_breakdown'):
+        op.execute(sa.text(f'DELETE FROM {table} AS aggregate '
+                           'WHERE NOT EXISTS (SELECT 1 FROM link WHERE link.alias = aggregate.alias)'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    pass
@@ -0,0 +1,29 @@
+"""Add link alias sequence
+
+Revision ID: 3c8e5f1a9b27
+Revises: a153129b6a2c
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c8e5f1a9b27'
+down_revision: Union[str, None] = 'a153129b6a2c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Каждый вызов nextval резервирует блок из 1000 идентификаторов для алиасов
+    op.execute(sa.schema.CreateSequence(sa.Sequence('link_alias_seq', start=1, increment=1000)))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.schema.DropSequence(sa.Sequence('link_alias_seq')))
@@ -0,0 +1,33 @@
+"""Add click_flush_batch
+
+Revision ID: 4a7e1f9c2d38
+Revises: 8f4b2d7c1e69
+Create Date: 2026-10-18 18:02:51.770314
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a7e1f9c2d38'
+down_revision: Union[str, None] = '8f4b2d7c1e69'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # id пачек переходов, записанных из Redis в БД (повторная запись пачки пропускается)
+    op.create_table('click_flush_batch',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('applied_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('click_flush_batch')
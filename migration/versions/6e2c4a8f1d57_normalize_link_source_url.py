@@ -0,0 +1,84 @@
+"""Normalize link source_url
+
+Revision ID: 6e2c4a8f1d57
+Revises: 4a7e1f9c2d38
+Create Date: 2026-10-18 19:24:37.615092
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from links.urls import normalize_url, InvalidUrlError
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6e2c4a8f1d57'
+down_revision: Union[str, None] = '4a7e1f9c2d38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Количество ссылок, которые читаются и обновляются за один запрос
+BATCH_SIZE = 1000
+
+link = sa.table('link', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                sa.column('source_url', sa.String), sa.column('expires_at', sa.DateTime),
+                sa.column('dedup_key', sa.String))
+
+
+def get_dedup_key(source_url: str, expires_at) -> str:
+    # Ключ дедупликации в том виде, в котором его вычисляет links.utils.get_dedup_key
+    expires = expires_at.isoformat() if expires_at else ''
+    return hashlib.sha256(f'{source_url}\n{expires}'.encode()).hexdigest()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Ссылки, созданные до перехода на normalize_url, хранят url в исходной форме и ключи
+    # дедупликации от другой нормализации, поэтому не находятся в /links/search и не
+    # дедуплицируются. url, которые normalize_url не принимает, остаются как есть.
+    # Ключи сначала сбрасываются, чтобы пересчет не упирался в уникальный индекс,
+    # а из ссылок с совпавшим после нормализации ключом ключ остается у первой
+    connection = op.get_bind()
+    deduplicated_ids = set(connection.execute(sa.select(link.c.id).where(link.c.dedup_key.is_not(None))).scalars())
+    connection.execute(sa.update(link).where(link.c.dedup_key.is_not(None)).values(dedup_key=None))
+
+    update_query = (sa.update(link).where(link.c.id == sa.bindparam('link_id'))
+                    .values(source_url=sa.bindparam('new_source_url'), dedup_key=sa.bindparam('new_dedup_key')))
+    dedup_keys = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(link.c.id, link.c.user_id, link.c.source_url, link.c.expires_at)
+                                  .where(link.c.id > last_id).order_by(link.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        params = []
+        for row in rows:
+            try:
+                source_url = normalize_url(row.source_url)
+            except InvalidUrlError:
+                source_url = row.source_url
+
+            dedup_key = None
+            if row.id in deduplicated_ids:
+                dedup_key = get_dedup_key(source_url, row.expires_at)
+                if (row.user_id, dedup_key) in dedup_keys:
+                    dedup_key = None
+                else:
+                    dedup_keys.add((row.user_id, dedup_key))
+
+            if source_url != row.source_url or row.id in deduplicated_ids:
+                params.append({'link_id': row.id, 'new_source_url': source_url, 'new_dedup_key': dedup_key})
+
+        if params:
+            connection.execute(update_query, params)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    pass
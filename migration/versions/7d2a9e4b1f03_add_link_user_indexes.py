@@ -0,0 +1,37 @@
+"""Add link user indexes
+
+Revision ID: 7d2a9e4b1f03
+Revises: 3c8e5f1a9b27
+Create Date: 2026-10-18 11:02:17.841265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2a9e4b1f03'
+down_revision: Union[str, None] = '3c8e5f1a9b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индексы создаются без блокировки записи в таблицу link
+    with op.get_context().autocommit_block():
+        op.create_index('ix_link_user_id_source_url_md5', 'link', ['user_id', sa.text('md5(source_url)')],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_link_user_id_id', 'link', ['user_id', 'id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_link_user_id_id', table_name='link',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_link_user_id_source_url_md5', table_name='link',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,32 @@
+"""Add click_event stream_id
+
+Revision ID: 8f4b2d7c1e69
+Revises: 1c6d9e3a7b52
+Create Date: 2026-10-18 17:31:08.904215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f4b2d7c1e69'
+down_revision: Union[str, None] = '1c6d9e3a7b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # id события в потоке Redis для идемпотентной обработки (у старых событий NULL),
+    # индекс создается на всех секциях click_event
+    op.add_column('click_event', sa.Column('stream_id', sa.String(), nullable=True))
+    op.create_index('ux_click_event_stream_id', 'click_event', ['stream_id', 'clicked_at'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_click_event_stream_id', table_name='click_event')
+    op.drop_column('click_event', 'stream_id')
@@ -0,0 +1,34 @@
+"""Add link expires_at index
+
+Revision ID: b41f6c2e8d95
+Revises: 7d2a9e4b1f03
+Create Date: 2026-10-18 12:24:05.119832
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41f6c2e8d95'
+down_revision: Union[str, None] = '7d2a9e4b1f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Частичный индекс только по ссылкам с временем удаления
+    with op.get_context().autocommit_block():
+        op.create_index('ix_link_expires_at', 'link', ['expires_at'], unique=False,
+                        postgresql_where=sa.text('expires_at IS NOT NULL'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_link_expires_at', table_name='link',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,57 @@
+"""Add click analytics tables
+
+Revision ID: e5a7c3d19f42
+Revises: b41f6c2e8d95
+Create Date: 2026-10-18 14:02:37.284610
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c3d19f42'
+down_revision: Union[str, None] = 'b41f6c2e8d95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Сырые события переходов, секционированные по месяцам (секции создает обработчик событий)
+    op.create_table('click_event',
+    sa.Column('alias', sa.String(), nullable=False),
+    sa.Column('clicked_at', sa.DateTime(), nullable=False),
+    sa.Column('referrer', sa.String(), nullable=True),
+    sa.Column('user_agent', sa.String(), nullable=True),
+    postgresql_partition_by='RANGE (clicked_at)'
+    )
+    op.create_index('ix_click_event_alias_clicked_at', 'click_event', ['alias', 'clicked_at'], unique=False)
+
+    # Агрегаты переходов по интервалам и по источникам / браузерам
+    op.create_table('link_click_rollup',
+    sa.Column('alias', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(length=6), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('alias', 'granularity', 'bucket_start')
+    )
+    op.create_table('link_click_breakdown',
+    sa.Column('alias', sa.String(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('dimension', sa.String(length=10), nullable=False),
+    sa.Column('value', sa.String(), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('alias', 'day', 'dimension', 'value')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('link_click_breakdown')
+    op.drop_table('link_click_rollup')
+    # Удаление родительской таблицы удаляет и все ее секции
+    op.drop_index('ix_click_event_alias_clicked_at', table_name='click_event')
+    op.drop_table('click_event')
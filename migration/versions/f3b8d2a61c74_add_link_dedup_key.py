@@ -0,0 +1,37 @@
+"""Add link dedup_key
+
+Revision ID: f3b8d2a61c74
+Revises: e5a7c3d19f42
+Create Date: 2026-10-18 16:02:37.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d2a61c74'
+down_revision: Union[str, None] = 'e5a7c3d19f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Колонка без значения по умолчанию добавляется без перезаписи таблицы
+    op.add_column('link', sa.Column('dedup_key', sa.String(length=64), nullable=True))
+    # Частичный уникальный индекс только по ссылкам, созданным в идемпотентном режиме
+    with op.get_context().autocommit_block():
+        op.create_index('ux_link_user_id_dedup_key', 'link', ['user_id', 'dedup_key'], unique=True,
+                        postgresql_where=sa.text('dedup_key IS NOT NULL'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ux_link_user_id_dedup_key', table_name='link',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('link', 'dedup_key')
@@ -0,0 +1,122 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from broadcast import worker_events
+from config import IDENTITY_CACHE_MAX_SIZE, IDENTITY_CACHE_TTL
+
+
+
+def get_token_hash(token: str) -> str:
+    '''
+        Функция get_token_hash - возвращает sha256 хэш JWT токена, который
+            используется как ключ кэша вместо самого токена.
+    '''
+
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+
+class IdentityCache:
+    '''
+        Класс IdentityCache - ограниченный по размеру in-process кэш данных
+            пользователя по хэшу JWT токена. Запись живет не дольше ttl секунд
+            и не дольше, чем действует сам токен.
+        Аргументы:
+            max_size (int) - максимальное количество записей в кэше.
+            ttl (float) - максимальное время жизни записи в секундах.
+    '''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._user_tokens: dict[int, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token_hash: str) -> dict | None:
+        '''
+            Возвращает закэшированные данные пользователя или None.
+        '''
+
+        entry = self._data.get(token_hash)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(token_hash)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(token_hash)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, token_hash: str, user: dict, token_exp: float) -> None:
+        '''
+            Сохраняет данные пользователя до истечения ttl или срока действия токена.
+            Аргументы:
+                token_hash (str) - хэш JWT токена.
+                user (dict) - данные пользователя.
+                token_exp (float) - время истечения токена (unix timestamp).
+        '''
+
+        ttl = min(self.ttl, token_exp - time.time())
+        if ttl <= 0 or self.max_size <= 0:
+            return None
+
+        self._remove(token_hash)
+        self._data[token_hash] = (time.monotonic() + ttl, user)
+        self._user_tokens.setdefault(user.get('id'), set()).add(token_hash)
+        while len(self._data) > self.max_size:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def invalidate_token(self, token_hash: str) -> None:
+        self._remove(token_hash)
+
+    def invalidate_user(self, user_id: int) -> None:
+        '''
+            Удаляет из кэша все токены пользователя.
+        '''
+
+        for token_hash in list(self._user_tokens.get(user_id, ())):
+            self._remove(token_hash)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._user_tokens.clear()
+
+    def _remove(self, token_hash: str) -> None:
+        entry = self._data.pop(token_hash, None)
+        if entry is None:
+            return None
+
+        user_id = entry[1].get('id')
+        tokens = self._user_tokens.get(user_id)
+        if tokens is not None:
+            tokens.discard(token_hash)
+            if not tokens:
+                del self._user_tokens[user_id]
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self._data), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+
+identity_cache = IdentityCache(IDENTITY_CACHE_MAX_SIZE, IDENTITY_CACHE_TTL)
+
+
+
+def register_identity_cache() -> None:
+    '''
+        Функция register_identity_cache - подключает кэш к событиям воркеров: отзыв
+            токена или всех токенов пользователя в любом воркере удаляет их из кэшей
+            всех воркеров, а при потере подписки кэш очищается (события могли не прийти).
+    '''
+
+    worker_events.on('revoke_token', identity_cache.invalidate_token)
+    worker_events.on('revoke_user', identity_cache.invalidate_user)
+    worker_events.on_subscribe(identity_cache.clear)
+    worker_events.on_disconnect(identity_cache.clear)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT
+from metrics import timed
+
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+
+class PasswordHasher:
+    '''
+        Класс PasswordHasher - выполняет хэширование и проверку паролей bcrypt
+            в ограниченном пуле потоков, чтобы они не блокировали event loop
+            (bcrypt отпускает GIL на время вычисления хэша).
+        Если все потоки заняты и очередь заполнена, то новые запросы сразу
+            получают ошибку 429.
+        Аргументы:
+            workers (int) - количество потоков в пуле.
+            queue_limit (int) - максимальное количество ожидающих в очереди задач.
+    '''
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def _run(self, func, *args):
+        '''
+            Выполняет func в пуле потоков с учетом ограничения очереди и
+                собирает метрики времени выполнения.
+            Задача учитывается в очереди до тех пор, пока занимает поток пула: при отмене
+                запроса уже запущенное вычисление хэша не прерывается, поэтому счетчик
+                уменьшается по завершении задачи в пуле, а не ожидающей ее корутины.
+        '''
+
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail='Слишком много запросов, повторите попытку позже',
+                                headers={'Retry-After': '1'})
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        started = time.perf_counter()
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._call_in_loop(loop, self._finish, started))
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    def _call_in_loop(loop: asyncio.AbstractEventLoop, callback, *args) -> None:
+        # Колбэк future вызывается в потоке пула, а счетчики меняются только в event loop
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass
+
+    def _finish(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.in_flight -= 1
+        self.completed += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+    @timed('bcrypt_hash')
+    async def hash(self, password: str) -> str:
+        '''
+            Возвращает bcrypt хэш пароля.
+        '''
+
+        return await self._run(pwd_context.hash, password)
+
+    @timed('bcrypt_verify')
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        '''
+            Возвращает True, если пароль совпадает с хэшем, в противном случае False.
+        '''
+
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    def stats(self) -> dict[str, int | float]:
+        '''
+            Возвращает размер очереди, количество выполненных и отклоненных задач
+                и время выполнения (среднее и максимальное, с учетом ожидания в очереди).
+        '''
+
+        return {'workers': self.workers, 'in_flight': self.in_flight,
+                'queue_depth': max(self.in_flight - self.workers, 0),
+                'queue_limit': self.queue_limit, 'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_seconds': self.total_seconds / self.completed if self.completed else 0.0,
+                'max_seconds': self.max_seconds}
+
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
@@ -2,12 +2,16 @@ import asyncio
 from datetime import datetime
 from typing import List
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, select
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, select, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from base import Base
 from links.models import Link
-from database import get_session
+
+
+# Ключ advisory lock, под которым воркеры по очереди проверяют и создают анонимного пользователя
+ANONIMOUS_USER_LOCK_ID = 7_101_001
 
 
 
@@ -25,24 +29,28 @@ class User(Base):
 
 
 
-def create_anonimous_user():
+async def create_anonimous_user(session: AsyncSession):
     '''
         Функция create_anonimous_user проверяет, есть ли в базе данных запись о
             пользователе с id 1 и email default@default.default. Если такой
             записи нет, то создает ее и сохраняет в БД.
+        Проверка выполняется под транзакционным advisory lock, поэтому воркеры,
+            запускаемые одновременно, не создают пользователя дважды.
         Это лютый костыль, чтобы ссылки, которые создают неавторизованные пользователи
             числились за этим (типо анонимным) пользователем.
     '''
 
-    session = get_session()
-    query = select(User).filter((User.id == 1) & (User.email == 'default@default.default'))
-    result = session.execute(query)
+    await session.execute(select(func.pg_advisory_xact_lock(ANONIMOUS_USER_LOCK_ID)))
+    query = select(User.id).filter((User.id == 1) & (User.email == 'default@default.default'))
+    result = await session.execute(query)
     result = result.scalar()
 
     if not result:
         new_user = User(email='default@default.default', hashed_password=None, created_at=datetime.now(),
                     last_login_at=None, is_active=True)
         session.add(new_user)
-        session.commit()
+
+    # Коммит в любом случае, чтобы снять advisory lock
+    await session.commit()
 
     return None
@@ -2,22 +2,19 @@ from typing import Annotated
 from datetime import timedelta, datetime
 from fastapi import Depends, APIRouter, HTTPException, status, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from passlib.hash import bcrypt
 from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from email_validator import validate_email, EmailNotValidError
 
 from .dependencies import coockie_scheme, credentials_exception
-from .utils import authenticate_user, create_access_token, get_user, get_current_user
-from .models import User, create_anonimous_user
+from .utils import (authenticate_user, create_access_token, get_user, get_current_user, revoke_token,
+                    deactivate_user)
+from .models import User
+from .hashing import password_hasher
 from config import ACCESS_TOKEN_EXPIRE_MINUTES
 from database import get_async_session
 
 
-# Инициализация анонимного пользователя, если такой еще не создан
-create_anonimous_user()
-
-
 auth_router = APIRouter(prefix='/auth', tags=['auth'])
 
 
@@ -51,8 +48,8 @@ async def signup(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail='Пользователь с переданным email уже существует')
 
-    # Хеширование пароля (без соли)
-    hashed_password = bcrypt.hash(password)
+    # Хеширование пароля в пуле потоков, чтобы не блокировать event loop
+    hashed_password = await password_hasher.hash(password)
 
     # Создание информации о пользователе для заполнения дополнительных полей в БД
     created_at = datetime.now()
@@ -88,13 +85,16 @@ async def login_for_access_token(response: Response,
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Генерация JWT токена, установка времени его протухания
+    # Генерация JWT токена, установка времени его протухания. В токен кладутся id пользователя
+    # и время логина, чтобы на последующих запросах не обращаться к БД
+    login_at = datetime.now()
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.get('email')}, 
+    access_token = create_access_token(data={"sub": user.get('email'), "uid": user.get('id'),
+                                             "lla": str(login_at)}, 
                                        expires_delta=access_token_expires)
 
     # Обновление записи в БД о дате и времени последнего залогинивания пользователя
-    query = update(User).filter(User.email == user.get('email')).values(last_login_at=datetime.now())
+    query = update(User).filter(User.email == user.get('email')).values(last_login_at=login_at)
     await session.execute(query)
     await session.commit()
 
@@ -121,13 +121,35 @@ async def logout(response: Response, session: AsyncSession = Depends(get_async_s
     if not user:
         raise credentials_exception
 
-    # Удаление JWT токена из кук
+    # Отзыв токена и удаление JWT токена из кук
+    await revoke_token(token)
     response.delete_cookie(key='tinyurl_access_token')
 
     return {'message': f'Пользователь {user.get('email')} успешно разлогинился'}
 
 
 
+@auth_router.post('/deactivate')
+async def deactivate(response: Response, session: AsyncSession = Depends(get_async_session),
+                     token: str = Depends(coockie_scheme)) -> dict[str, str]:
+    '''
+        Деактивирует учетную запись текущего пользователя: все его JWT токены
+            отзываются во всех воркерах, а залогиниться снова он больше не сможет.
+    '''
+
+    # Получение данных пользователя по токену
+    user = await get_current_user(User, token, session)
+    if not user:
+        raise credentials_exception
+
+    # Деактивация пользователя, отзыв всех его токенов и удаление JWT токена из кук
+    await deactivate_user(User, session, user.get('id'))
+    response.delete_cookie(key='tinyurl_access_token')
+
+    return {'message': f'Пользователь {user.get('email')} деактивирован'}
+
+
+
 @auth_router.get('/current-user')
 async def get_current_user_data(token: Annotated[str, Depends(coockie_scheme)], 
                            session: AsyncSession = Depends(get_async_session)) -> dict[str, str]:
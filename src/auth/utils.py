@@ -1,32 +1,42 @@
+import logging
+import time
 from datetime import datetime, timedelta, timezone
 
 import jwt
 from jwt.exceptions import InvalidTokenError
 from fastapi import HTTPException, status
-from passlib.context import CryptContext
-from sqlalchemy import select
+from redis.exceptions import RedisError
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_cache.decorator import cache
 
+from .cache import identity_cache, get_token_hash
+from .hashing import password_hasher
 from .schemas import UserInDB, TokenData
-from config import SECRET_KEY, ALGORITHM
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from broadcast import worker_events
+from metrics import timed
+from redis_client import get_redis
 
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+logger = logging.getLogger(__name__)
 
+# Ключи Redis с отозванными токенами (logout) и пользователями (деактивация)
+REVOKED_TOKEN_KEY = 'tinyurl:revoked:token:{}'
+REVOKED_USER_KEY = 'tinyurl:revoked:user:{}'
 
-def verify_password(plain_password, hashed_password) -> bool:
+
+async def verify_password(plain_password, hashed_password) -> bool:
     '''
         Функция verify_password - принимает пароль и хеш пароля 
-            и сравнивает их, возвращает True, если пароль и его 
-            хэш совпали, в противном случае False.
+            и сравнивает их в пуле потоков password_hasher, возвращает True,
+            если пароль и его хэш совпали, в противном случае False.
         Аргументы:
             plain_password (str) - пароль.
             hashed_password (str) - хэш пароля.
         
     '''
 
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
 
@@ -85,7 +95,11 @@ async def authenticate_user(user_table, username: str, password: str,
         return False
 
     # Проверка совпадения пароля и хэша пароля
-    if not verify_password(password, user.get('hashed_password')):
+    if not await verify_password(password, user.get('hashed_password')):
+        return False
+
+    # Деактивированный пользователь не может залогиниться
+    if not user.get('is_active'):
         return False
 
     return user
@@ -107,10 +121,11 @@ def create_access_token(data: dict, expires_delta: timedelta | None
     # Создение копии данных для кодирования в JWT
     to_encode = data.copy()
 
-    # Установка даты и времени протухания JWT токена
-    # и ее добавление к данным для кодирования
-    expire = datetime.now(timezone.utc) + expires_delta
-    to_encode.update({'exp': expire})
+    # Установка даты и времени выпуска и протухания JWT токена
+    # и их добавление к данным для кодирования
+    issued_at = datetime.now(timezone.utc)
+    expire = issued_at + expires_delta
+    to_encode.update({'iat': issued_at, 'exp': expire})
 
     # Генерация JWT токена
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -119,11 +134,12 @@ def create_access_token(data: dict, expires_delta: timedelta | None
 
 
 
-def validate_access_token(token: str) -> str:
+@timed('jwt_decode')
+def decode_access_token(token: str) -> dict | bool:
     '''
-        Функция validate_access_token - принимает JWT токен, декодирует 
-            и валидирует его, возвращает имя пользователя, которому 
-            принадлежит JWT токен.
+        Функция decode_access_token - принимает JWT токен, декодирует 
+            и валидирует его, возвращает словарь с данными токена
+            или False, если токен не валиден.
         Аргументы:
             token (str) - JWT токен.
     '''
@@ -134,34 +150,176 @@ def validate_access_token(token: str) -> str:
     except InvalidTokenError:
         return False 
 
+    return payload
+
+
+
+def validate_access_token(token: str) -> str:
+    '''
+        Функция validate_access_token - принимает JWT токен, декодирует 
+            и валидирует его, возвращает имя пользователя, которому 
+            принадлежит JWT токен.
+        Аргументы:
+            token (str) - JWT токен.
+    '''
+
+    # Расшифровка и проверка токена
+    payload = decode_access_token(token)
+    if not payload:
+        return False
+
     # Получение username пользователя
     username = payload.get("sub")
 
     return username
 
 
-@cache(expire=60*15)
+
+async def is_token_revoked(token_hash: str, payload: dict) -> bool:
+    '''
+        Функция is_token_revoked - проверяет, был ли токен отозван при логауте
+            или все токены пользователя при его деактивации. Если Redis недоступен,
+            то токен считается действующим.
+        Аргументы:
+            token_hash (str) - хэш JWT токена.
+            payload (dict) - данные JWT токена.
+    '''
+
+    try:
+        # Ключи могут лежать в разных слотах Redis Cluster, поэтому pipeline вместо MGET
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.get(REVOKED_TOKEN_KEY.format(token_hash))
+            pipe.get(REVOKED_USER_KEY.format(payload.get('uid')))
+            token_revoked, user_revoked_at = await pipe.execute()
+    except RedisError:
+        logger.warning('Redis недоступен, проверка отзыва токена пропущена')
+        return False
+
+    if token_revoked:
+        return True
+
+    return bool(user_revoked_at) and payload.get('iat', 0) <= float(user_revoked_at)
+
+
+
+async def revoke_token(token: str) -> None:
+    '''
+        Функция revoke_token - отзывает JWT токен (при логауте): удаляет его из
+            кэшей всех воркеров и сохраняет в Redis до истечения срока его действия.
+        Аргументы:
+            token (str) - JWT токен.
+    '''
+
+    token_hash = get_token_hash(token)
+    identity_cache.invalidate_token(token_hash)
+
+    payload = decode_access_token(token)
+    if not payload:
+        return None
+
+    try:
+        redis = get_redis()
+        await redis.set(REVOKED_TOKEN_KEY.format(token_hash), 1,
+                        ex=max(int(payload.get('exp') - time.time()), 1))
+    except RedisError:
+        logger.warning('Redis недоступен, токен отозван только в текущем воркере')
+        return None
+
+    await worker_events.publish('revoke_token', token_hash)
+
+
+
+async def revoke_user_tokens(user_id: int) -> None:
+    '''
+        Функция revoke_user_tokens - отзывает все выпущенные ранее JWT токены пользователя
+            и удаляет их из кэшей всех воркеров.
+        Аргументы:
+            user_id (int) - идентификатор пользователя.
+    '''
+
+    identity_cache.invalidate_user(user_id)
+
+    try:
+        redis = get_redis()
+        await redis.set(REVOKED_USER_KEY.format(user_id), time.time(),
+                        ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    except RedisError:
+        logger.warning('Redis недоступен, токены пользователя %s отозваны только в текущем воркере', user_id)
+        return None
+
+    await worker_events.publish('revoke_user', user_id)
+
+
+
+async def deactivate_user(user_table, session: AsyncSession, user_id: int) -> None:
+    '''
+        Функция deactivate_user - деактивирует пользователя и отзывает все его токены.
+        Аргументы:
+            user_table - объект таблицы (sqlalchemy) с данными пользователей.
+            session (AsyncSession) - сессия подключения к БД.
+            user_id (int) - идентификатор пользователя.
+    '''
+
+    query = update(user_table).filter(user_table.id == user_id).values(is_active=False)
+    await session.execute(query)
+    await session.commit()
+
+    await revoke_user_tokens(user_id)
+
+
+
+@timed('get_current_user')
 async def get_current_user(user_table, token: str, session: AsyncSession) -> dict | bool:
     '''
         Функция get_current_user - принимает объект таблицы (sqlalchemy) в БД,
             JWT токен пользователя и объект сессии подключения к БД. 
-            Проверяет и декодирует JWT токен, проверяет существование 
-            соответствующего пользователя и возвращает объект данных о пользователе.
+            Проверяет и декодирует JWT токен и возвращает объект данных о пользователе.
+        Данные пользователя кэшируются по хэшу токена (не дольше IDENTITY_CACHE_TTL),
+            а id пользователя берется из claim uid, поэтому при попадании в кэш запрос
+            к БД не выполняется. При промахе из БД читается только is_active
+            по первичному ключу, так что пользователь, деактивированный напрямую
+            в БД, теряет доступ не позже чем через IDENTITY_CACHE_TTL. Отзыв токенов
+            через API (logout, деактивация) удаляет их из кэшей всех воркеров сразу.
+            Полностью данные пользователя читаются из БД только для токенов,
+            выпущенных без claim uid.
         Аргументы:
             user_table - объект таблицы (sqlalchemy) с данными пользователей.
             token (str) - JWT токен.
             session (AsyncSession) - сессия подключения к БД.
     '''
 
-    # Получение и проверка username
-    username = validate_access_token(token)
-    if not username:
+    if not token:
         return False
-    token_data = TokenData(username=username)
-    
-    # Получение и проверка объекта с данными пользователя из БД
-    user = await get_user(user_table, session=session, username=token_data.username)
-    if not user:
-        raise False
+
+    # Поиск пользователя в кэше по хэшу токена
+    token_hash = get_token_hash(token)
+    user = identity_cache.get(token_hash)
+    if user:
+        return user
+
+    # Декодирование и проверка токена
+    payload = decode_access_token(token)
+    if not payload or not payload.get('sub'):
+        return False
+    if await is_token_revoked(token_hash, payload):
+        return False
+
+    if payload.get('uid') is not None:
+        # Проверка, что пользователь не деактивирован, остальные данные - из claims токена
+        query = select(user_table.is_active).filter(user_table.id == payload.get('uid'))
+        if not (await session.execute(query)).scalar():
+            return False
+        user = {'id': payload.get('uid'), 'email': payload.get('sub'),
+                'last_login_at': payload.get('lla')}
+    else:
+        # Получение и проверка объекта с данными пользователя из БД
+        token_data = TokenData(username=payload.get('sub'))
+        user = await get_user(user_table, session=session, username=token_data.username)
+        if not user or not user.get('is_active'):
+            return False
+        user = {'id': user.get('id'), 'email': user.get('email'),
+                'last_login_at': user.get('last_login_at')}
+
+    identity_cache.set(token_hash, user, payload.get('exp'))
 
     return user
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections.abc import Callable
+
+import orjson
+from redis.exceptions import RedisError
+
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+# Канал Redis, через который воркеры рассылают друг другу события (массив orjson [событие, аргументы...])
+WORKER_EVENTS_CHANNEL = 'tinyurl:worker_events'
+# Время ожидания сообщения из канала и пауза перед повтором после ошибки в секундах
+WORKER_EVENTS_POLL_TIMEOUT = 1.0
+WORKER_EVENTS_RETRY_INTERVAL = 10
+
+
+
+class WorkerEvents:
+    '''
+        Класс WorkerEvents - рассылка событий всем воркерам всех процессов и серверов
+            через pub/sub канал Redis: новые алиасы для фильтров алиасов, сброс
+            записей in-process кэшей алиасов и пользователей. Событие получает
+            и воркер, который его отправил.
+        Pub/sub не хранит сообщения, поэтому при потере подписки вызываются
+            обработчики on_disconnect, а после каждой (повторной) подписки -
+            обработчики on_subscribe: состояние, которое могло устареть за время
+            переподключения, нужно сбросить или построить заново.
+        Аргументы:
+            channel (str) - канал Redis.
+    '''
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self._handlers: dict[str, Callable[..., None]] = {}
+        self._subscribe_handlers: list[Callable[[], None]] = []
+        self._disconnect_handlers: list[Callable[[], None]] = []
+        self._subscribed = asyncio.Event()
+
+    def on(self, event: str, handler: Callable[..., None]) -> None:
+        '''
+            Регистрирует обработчик события, который вызывается с аргументами события.
+        '''
+
+        self._handlers[event] = handler
+
+    def on_subscribe(self, handler: Callable[[], None]) -> None:
+        self._subscribe_handlers.append(handler)
+
+    def on_disconnect(self, handler: Callable[[], None]) -> None:
+        self._disconnect_handlers.append(handler)
+
+    async def publish(self, event: str, *args) -> bool:
+        '''
+            Рассылает событие всем воркерам, возвращает False, если Redis недоступен.
+        '''
+
+        try:
+            await get_redis().publish(self.channel, orjson.dumps([event, *args]))
+        except RedisError:
+            return False
+
+        self.published += 1
+        return True
+
+    def dispatch(self, data: bytes) -> None:
+        event, *args = orjson.loads(data)
+        handler = self._handlers.get(event)
+        if handler is not None:
+            handler(*args)
+
+    async def wait_subscribed(self, timeout: float) -> bool:
+        '''
+            Ждет подписки на канал не дольше timeout секунд, возвращает False, если ее нет.
+        '''
+
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    def disconnect(self) -> None:
+        self.connected = False
+        self._subscribed.clear()
+        for handler in self._disconnect_handlers:
+            handler()
+
+    async def run(self) -> None:
+        '''
+            Подписывается на канал и вызывает обработчики пришедших событий,
+                переподключается при ошибках.
+        '''
+
+        redis = get_redis()
+        if not hasattr(redis, 'pubsub'):
+            logger.warning('Клиент Redis не поддерживает pub/sub, события между воркерами не рассылаются')
+            # Подписки не будет, ждать ее не нужно
+            self._subscribed.set()
+            return None
+
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    while True:
+                        message = await pubsub.get_message(timeout=WORKER_EVENTS_POLL_TIMEOUT)
+                        if message is None:
+                            continue
+                        if message['type'] == 'message':
+                            self.received += 1
+                            try:
+                                self.dispatch(message['data'])
+                            except Exception:
+                                logger.exception('Не удалось обработать событие %r', message['data'])
+                        elif message['type'] == 'subscribe':
+                            # Повторная подписка после переподключения тоже приходит сюда
+                            self.connected = True
+                            for handler in self._subscribe_handlers:
+                                handler()
+                            self._subscribed.set()
+            except asyncio.CancelledError:
+                self.disconnect()
+                raise
+            except Exception:
+                logger.exception('Подписка на события воркеров прервана')
+                self.disconnect()
+                await asyncio.sleep(WORKER_EVENTS_RETRY_INTERVAL)
+
+    def stats(self) -> dict[str, int]:
+        return {'connected': int(self.connected), 'published': self.published, 'received': self.received}
+
+
+
+worker_events = WorkerEvents(WORKER_EVENTS_CHANNEL)
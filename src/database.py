@@ -1,28 +1,278 @@
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
 from typing import Generator, AsyncGenerator
-from sqlalchemy import create_engine
+from uuid import uuid4
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import (AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker,
+                                    create_async_engine)
 from config import POSTGRES_PASSWORD, POSTGRES_USER, POSTGRES_DB, POSTGRES_EXTERNAL_PORT, POSTGRES_INTERNAL_PORT
+from config import (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+                    SYNC_DB_POOL_SIZE, SYNC_DB_MAX_OVERFLOW, DB_STATEMENT_CACHE_SIZE, DB_PGBOUNCER_MODE)
+from config import DB_REPLICA_URLS, DB_REPLICA_EJECT_SECONDS, READ_YOUR_WRITES_SECONDS
+from metrics import observe_stage, stage_timer
 
 DB_URL = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:{POSTGRES_INTERNAL_PORT}/{POSTGRES_DB}'
 ASYNC_DB_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:{POSTGRES_INTERNAL_PORT}/{POSTGRES_DB}'
 
+# Кука с временем (unix timestamp), до которого чтения пользователя идут в primary
+READ_YOUR_WRITES_COOKIE = 'tinyurl_recent_write'
 
+logger = logging.getLogger(__name__)
 
-engine = create_engine(DB_URL)
+
+
+class PoolWaitStatsMixin:
+    '''
+        Примесь PoolWaitStatsMixin - считает время ожидания свободного соединения
+            в пуле (checkout) и количество таймаутов ожидания.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += elapsed
+            self.wait_seconds_max = max(self.wait_seconds_max, elapsed)
+
+    def stats(self) -> dict[str, int | float]:
+        '''
+            Возвращает размер пула, количество выданных соединений и соединений
+                сверх размера пула, а также время ожидания соединения.
+        '''
+
+        return {'pool_size': self.size(), 'max_overflow': self._max_overflow,
+                'checked_in': self.checkedin(), 'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0), 'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_seconds': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                'max_wait_seconds': self.wait_seconds_max}
+
+
+class InstrumentedQueuePool(PoolWaitStatsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(PoolWaitStatsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+
+class InstrumentedAsyncSession(AsyncSession):
+    '''
+        Асинхронная сессия, которая измеряет время commit (этап db_commit в метриках).
+    '''
+
+    async def commit(self) -> None:
+        with stage_timer('db_commit'):
+            await super().commit()
+
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время выполнения запроса в БД (этап db_execute в метриках) для всех движков
+    observe_stage('db_execute', time.perf_counter() - conn.info['query_started'].pop())
+
+
+
+def get_async_connect_args() -> dict:
+    '''
+        Функция get_async_connect_args - возвращает параметры подключения asyncpg.
+        В режиме PgBouncer (transaction pooling) кэш подготовленных выражений
+            отключается, а их имена делаются уникальными, так как соседние
+            запросы могут попасть в разные серверные соединения.
+    '''
+
+    if DB_PGBOUNCER_MODE:
+        return {'statement_cache_size': 0, 'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__'}
+
+    return {'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE}
+
+
+
+engine = create_engine(DB_URL, poolclass=InstrumentedQueuePool, pool_size=SYNC_DB_POOL_SIZE,
+                       max_overflow=SYNC_DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                       pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING)
 session_maker = sessionmaker(engine, expire_on_commit=False)
 
 
 def get_session() -> Generator[Session, None, None]:
     with session_maker() as session:
-        return session
+        yield session
+
+
 
+def create_pooled_async_engine(url: str) -> AsyncEngine:
+    return create_async_engine(url, poolclass=InstrumentedAsyncQueuePool,
+                               pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                               pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE,
+                               pool_pre_ping=DB_POOL_PRE_PING,
+                               connect_args=get_async_connect_args())
 
 
-async_engine = create_async_engine(ASYNC_DB_URL)
-async_session_maker = async_sessionmaker(async_engine, expire_on_commit=False)
+async_engine = create_pooled_async_engine(ASYNC_DB_URL)
+async_session_maker = async_sessionmaker(async_engine, class_=InstrumentedAsyncSession, expire_on_commit=False)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
+
+
+
+class ReplicaPool:
+    '''
+        Класс ReplicaPool - набор движков реплик БД, которые выдаются по кругу
+            (round robin). Реплика, к которой не удалось подключиться, исключается
+            из ротации на eject_seconds секунд.
+        Аргументы:
+            urls (list) - адреса реплик.
+            eject_seconds (float) - время исключения реплики из ротации в секундах.
+    '''
+
+    def __init__(self, urls: list[str], eject_seconds: float):
+        self.engines = [create_pooled_async_engine(url) for url in urls]
+        self.eject_seconds = eject_seconds
+        self._ejected_until = [0.0] * len(self.engines)
+        self._cursor = itertools.count()
+        self.ejections = 0
+
+    def iter_healthy(self):
+        '''
+            Возвращает реплики, не исключенные из ротации, начиная со следующей по кругу.
+        '''
+
+        if not self.engines:
+            return
+
+        start = next(self._cursor) % len(self.engines)
+        now = time.monotonic()
+        for i in range(len(self.engines)):
+            index = (start + i) % len(self.engines)
+            if self._ejected_until[index] <= now:
+                yield self.engines[index]
+
+    def eject(self, engine: AsyncEngine) -> None:
+        index = self.engines.index(engine)
+        self._ejected_until[index] = time.monotonic() + self.eject_seconds
+        self.ejections += 1
+        logger.warning('Реплика %s недоступна, исключена из ротации на %s с',
+                       engine.url.render_as_string(hide_password=True), self.eject_seconds)
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [{'url': engine.url.render_as_string(hide_password=True),
+                 'healthy': self._ejected_until[index] <= now, **engine.pool.stats()}
+                for index, engine in enumerate(self.engines)]
+
+
+
+replica_pool = ReplicaPool(DB_REPLICA_URLS, DB_REPLICA_EJECT_SECONDS)
+
+
+@asynccontextmanager
+async def read_connection(use_primary: bool = False) -> AsyncGenerator[AsyncConnection, None]:
+    '''
+        Функция read_connection - выдает соединение для запросов только на чтение:
+            с очередной доступной реплики, а если реплик нет, все они недоступны
+            или передан use_primary, то с primary.
+    '''
+
+    if not use_primary:
+        for replica_engine in replica_pool.iter_healthy():
+            try:
+                connection = await replica_engine.connect()
+            except (SQLAlchemyError, OSError):
+                replica_pool.eject(replica_engine)
+                continue
+
+            async with connection:
+                yield connection
+            return
+
+    async with async_engine.connect() as connection:
+        yield connection
+
+
+def has_recent_write(request: Request) -> bool:
+    '''
+        Функция has_recent_write - возвращает True, если пользователь недавно изменял
+            данные и его чтения должны идти в primary (реплика может еще отставать).
+    '''
+
+    recent_write = request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    try:
+        return recent_write is not None and float(recent_write) > time.time()
+    except ValueError:
+        return False
+
+
+def mark_recent_write(response: Response) -> None:
+    '''
+        Функция mark_recent_write - устанавливает куку, по которой чтения пользователя
+            в течение READ_YOUR_WRITES_SECONDS секунд идут в primary.
+    '''
+
+    if replica_pool.engines:
+        response.set_cookie(key=READ_YOUR_WRITES_COOKIE, value=str(time.time() + READ_YOUR_WRITES_SECONDS),
+                            max_age=READ_YOUR_WRITES_SECONDS, httponly=True)
+
+
+async def get_read_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    '''
+        Функция get_read_session - зависимость для эндпоинтов, которые только читают
+            данные: сессия на очередной доступной реплике или на primary, если
+            пользователь недавно изменял данные. Соединение берется из пула только
+            при первом запросе к БД (ответы из кэша не обращаются к БД вовсе).
+            Реплика, соединение с которой оборвалось, исключается из ротации.
+    '''
+
+    bind = async_engine
+    if not has_recent_write(request):
+        bind = next(replica_pool.iter_healthy(), async_engine)
+
+    async with InstrumentedAsyncSession(bind=bind, expire_on_commit=False) as session:
+        try:
+            yield session
+        except (DBAPIError, OSError) as e:
+            connection_lost = isinstance(e, OSError) or e.connection_invalidated
+            if connection_lost and bind is not async_engine:
+                replica_pool.eject(bind)
+            raise
+
+
+def get_pool_stats() -> dict[str, dict]:
+    '''
+        Функция get_pool_stats - возвращает метрики пулов соединений асинхронного
+            и синхронного движков и реплик текущего процесса.
+    '''
+
+    return {'async': async_engine.pool.stats(), 'sync': engine.pool.stats(),
+            'replicas': replica_pool.stats(), 'replica_ejections': replica_pool.ejections}
@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from redis.exceptions import ResponseError
+from sqlalchemy import select, update, delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (CLICK_EVENTS_STREAM_MAX_LEN, CLICK_EVENTS_BATCH_SIZE, CLICK_EVENTS_POLL_INTERVAL,
+                    CLICK_EVENTS_CLAIM_IDLE_MS)
+from database import async_session_maker
+from metrics import observe_dropped_click_events
+from redis_client import get_redis
+from .models import click_event, Link, LinkClickRollup, LinkClickBreakdown
+
+
+logger = logging.getLogger(__name__)
+
+# Поток событий переходов в Redis и группа обработчиков, которые переносят их в БД
+CLICK_EVENTS_STREAM = 'tinyurl:click_events'
+CLICK_EVENTS_GROUP = 'click-aggregator'
+
+# Интервалы, по которым агрегируются переходы
+GRANULARITIES = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+# Максимальная длина сохраняемых referrer и user-agent
+MAX_HEADER_LENGTH = 512
+
+# Количество строк агрегатов в одном INSERT (ограничение количества параметров запроса)
+UPSERT_BATCH_SIZE = 1000
+
+# Подстроки user-agent и соответствующие им семейства браузеров (порядок важен:
+# например, user-agent Edge и Opera тоже содержат Chrome)
+USER_AGENT_FAMILIES = (('bot', 'bot'), ('spider', 'bot'), ('crawl', 'bot'), ('curl/', 'curl'),
+                       ('python', 'script'), ('edg/', 'Edge'), ('opr/', 'Opera'), ('yabrowser', 'Yandex'),
+                       ('firefox', 'Firefox'), ('chrome', 'Chrome'), ('safari', 'Safari'))
+
+_created_partitions: set[str] = set()
+
+
+
+def build_click_event(alias: str, referrer: str | None, user_agent: str | None) -> dict[str, str]:
+    '''
+        Функция build_click_event - возвращает поля события перехода для записи в поток Redis.
+    '''
+
+    return {'alias': alias, 'ts': repr(time.time()),
+            'referrer': (referrer or '')[:MAX_HEADER_LENGTH],
+            'user_agent': (user_agent or '')[:MAX_HEADER_LENGTH]}
+
+
+def add_click_event(pipe, alias: str, referrer: str | None, user_agent: str | None) -> None:
+    '''
+        Функция add_click_event - добавляет в pipeline Redis запись события перехода
+            в поток CLICK_EVENTS_STREAM (длина потока ограничена приблизительно).
+    '''
+
+    pipe.xadd(CLICK_EVENTS_STREAM, build_click_event(alias, referrer, user_agent),
+              maxlen=CLICK_EVENTS_STREAM_MAX_LEN, approximate=True)
+
+
+def get_referrer_host(referrer: str | None) -> str:
+    '''
+        Функция get_referrer_host - возвращает домен источника перехода или direct.
+    '''
+
+    if not referrer:
+        return 'direct'
+
+    return urlsplit(referrer).hostname or 'other'
+
+
+def get_user_agent_family(user_agent: str | None) -> str:
+    '''
+        Функция get_user_agent_family - возвращает семейство браузера по user-agent.
+    '''
+
+    if not user_agent:
+        return 'unknown'
+
+    user_agent = user_agent.lower()
+    for marker, family in USER_AGENT_FAMILIES:
+        if marker in user_agent:
+            return family
+
+    return 'other'
+
+
+def truncate_to_bucket(moment: datetime, granularity: str) -> datetime:
+    '''
+        Функция truncate_to_bucket - возвращает начало интервала granularity,
+            в который попадает moment.
+    '''
+
+    if granularity == 'minute':
+        return moment.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+
+async def ensure_click_event_partitions(months: set[datetime]) -> None:
+    '''
+        Функция ensure_click_event_partitions - создает месячные секции таблицы
+            click_event для переданных месяцев, если они еще не созданы.
+            Создание выполняется под advisory lock, чтобы воркеры не создавали
+            одну секцию одновременно.
+    '''
+
+    missing = {month for month in months if month.strftime('%Y%m') not in _created_partitions}
+    if not missing:
+        return None
+
+    async with async_session_maker() as session:
+        await session.execute(select(func.pg_advisory_xact_lock(func.hashtext('click_event_partitions'))))
+        for month in sorted(missing):
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            await session.execute(text(
+                f'CREATE TABLE IF NOT EXISTS click_event_y{month:%Y}m{month:%m} PARTITION OF click_event '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')"))
+        await session.commit()
+
+    _created_partitions.update(month.strftime('%Y%m') for month in missing)
+
+
+def build_increment_query(model, rows: list[dict]):
+    '''
+        Функция build_increment_query - строит запрос INSERT ... ON CONFLICT DO UPDATE,
+            который прибавляет clicks из rows к существующим агрегатам model.
+    '''
+
+    query = insert(model).values(rows)
+    primary_key = [column.name for column in model.__table__.primary_key]
+
+    return query.on_conflict_do_update(index_elements=primary_key,
+                                       set_={'clicks': model.clicks + query.excluded.clicks})
+
+
+def build_click_aggregates_rows(events) -> tuple[list[dict], list[dict]]:
+    '''
+        Функция build_click_aggregates_rows - возвращает строки приращений агрегатов
+            link_click_rollup и link_click_breakdown для событий переходов.
+    '''
+
+    rollups = Counter()
+    breakdowns = Counter()
+    for event in events:
+        for granularity in GRANULARITIES:
+            rollups[(event.alias, granularity, truncate_to_bucket(event.clicked_at, granularity))] += 1
+        day = event.clicked_at.date()
+        breakdowns[(event.alias, day, 'referrer', get_referrer_host(event.referrer))] += 1
+        breakdowns[(event.alias, day, 'user_agent', get_user_agent_family(event.user_agent))] += 1
+
+    rollup_rows = [{'alias': alias, 'granularity': granularity, 'bucket_start': bucket_start, 'clicks': clicks}
+                   for (alias, granularity, bucket_start), clicks in rollups.items()]
+    breakdown_rows = [{'alias': alias, 'day': day, 'dimension': dimension, 'value': value, 'clicks': clicks}
+                      for (alias, day, dimension, value), clicks in breakdowns.items()]
+
+    return rollup_rows, breakdown_rows
+
+
+async def process_click_events(entries: list[tuple[bytes, dict]]) -> int:
+    '''
+        Функция process_click_events - записывает пачку событий переходов
+            в click_event и увеличивает агрегаты в link_click_rollup и
+            link_click_breakdown одной транзакцией, возвращает количество
+            новых событий.
+        Обработка идемпотентна: событие записывается вместе с его id в потоке
+            (уникальный индекс по stream_id и clicked_at), и агрегаты увеличиваются
+            только по событиям, которые действительно добавились. Поэтому повторная
+            доставка (XACK не дошел после коммита или события забрал XAUTOCLAIM)
+            не учитывает переходы дважды.
+        Аргументы:
+            entries (list) - записи потока Redis в формате (id, поля события).
+    '''
+
+    events = []
+    for entry_id, fields in entries:
+        if not fields:
+            continue
+        events.append({'stream_id': entry_id.decode() if isinstance(entry_id, bytes) else entry_id,
+                       'alias': fields[b'alias'].decode(),
+                       'clicked_at': datetime.fromtimestamp(float(fields[b'ts'])),
+                       'referrer': fields.get(b'referrer', b'').decode() or None,
+                       'user_agent': fields.get(b'user_agent', b'').decode() or None})
+
+    if not events:
+        return 0
+
+    await ensure_click_event_partitions({truncate_to_bucket(event['clicked_at'], 'day').replace(day=1)
+                                         for event in events})
+
+    async with async_session_maker() as session:
+        new_events = []
+        for i in range(0, len(events), UPSERT_BATCH_SIZE):
+            query = (insert(click_event).values(events[i:i + UPSERT_BATCH_SIZE])
+                     .on_conflict_do_nothing(index_elements=['stream_id', 'clicked_at'])
+                     .returning(click_event.c.alias, click_event.c.clicked_at,
+                                click_event.c.referrer, click_event.c.user_agent))
+            new_events += (await session.execute(query)).all()
+
+        if not new_events:
+            await session.commit()
+            return 0
+
+        # Агрегаты увеличиваются только для существующих ссылок. Строки ссылок блокируются
+        # (FOR KEY SHARE) до конца транзакции, чтобы параллельное удаление или смена алиаса
+        # дождались записи агрегатов и удалили или перенесли их
+        query = (select(Link.alias).filter(Link.alias.in_({event.alias for event in new_events}))
+                 .order_by(Link.alias).with_for_update(key_share=True))
+        aliases = set((await session.execute(query)).scalars().all())
+        linked_events = [event for event in new_events if event.alias in aliases]
+        rollup_rows, breakdown_rows = build_click_aggregates_rows(linked_events)
+
+        for i in range(0, len(rollup_rows), UPSERT_BATCH_SIZE):
+            await session.execute(build_increment_query(LinkClickRollup, rollup_rows[i:i + UPSERT_BATCH_SIZE]))
+        for i in range(0, len(breakdown_rows), UPSERT_BATCH_SIZE):
+            await session.execute(build_increment_query(LinkClickBreakdown, breakdown_rows[i:i + UPSERT_BATCH_SIZE]))
+        await session.commit()
+
+    # События по алиасам, которых уже нет: ссылка удалена или ее алиас сменился между
+    # переходом и обработкой события (агрегаты переименованной ссылки их не получат)
+    dropped = len(new_events) - len(linked_events)
+    if dropped:
+        observe_dropped_click_events(dropped)
+        logger.warning('%s событий переходов не учтены в агрегатах: ссылки с их алиасами не найдены', dropped)
+
+    return len(new_events)
+
+
+async def read_click_events(consumer: str) -> list[tuple[bytes, dict]]:
+    '''
+        Функция read_click_events - возвращает пачку событий для обработки:
+            сначала зависшие события других (упавших) воркеров, затем новые.
+    '''
+
+    redis = get_redis()
+    claimed = await redis.xautoclaim(CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP, consumer,
+                                     min_idle_time=CLICK_EVENTS_CLAIM_IDLE_MS, start_id='0-0',
+                                     count=CLICK_EVENTS_BATCH_SIZE)
+    if claimed[1]:
+        return claimed[1]
+
+    response = await redis.xreadgroup(CLICK_EVENTS_GROUP, consumer, {CLICK_EVENTS_STREAM: '>'},
+                                      count=CLICK_EVENTS_BATCH_SIZE)
+
+    return response[0][1] if response else []
+
+
+async def run_click_event_consumer() -> None:
+    '''
+        Функция run_click_event_consumer - в цикле читает события переходов из потока
+            Redis в группе CLICK_EVENTS_GROUP, записывает их в БД и подтверждает (XACK).
+            Если события закончились, то ждет CLICK_EVENTS_POLL_INTERVAL секунд.
+            Событие, запись которого в БД завершилась ошибкой, остается в потоке
+            и будет обработано повторно.
+    '''
+
+    consumer = f'{socket.gethostname()}-{os.getpid()}'
+    group_created = False
+
+    while True:
+        try:
+            redis = get_redis()
+            if not group_created:
+                try:
+                    await redis.xgroup_create(CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP, id='0', mkstream=True)
+                except ResponseError as e:
+                    if 'BUSYGROUP' not in str(e):
+                        raise
+                group_created = True
+
+            entries = await read_click_events(consumer)
+            if not entries:
+                await asyncio.sleep(CLICK_EVENTS_POLL_INTERVAL)
+                continue
+
+            await process_click_events(entries)
+            await redis.xack(CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP, *[entry_id for entry_id, _ in entries])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Не удалось обработать события переходов по ссылкам')
+            await asyncio.sleep(CLICK_EVENTS_POLL_INTERVAL)
+
+
+
+def build_delete_click_aggregates_queries(aliases: list[str]) -> list:
+    '''
+        Функция build_delete_click_aggregates_queries - возвращает запросы, которые
+            удаляют агрегаты переходов удаленных ссылок (выполняются в транзакции
+            удаления, чтобы освободившийся алиас не унаследовал чужую статистику).
+    '''
+
+    return [delete(LinkClickRollup).filter(LinkClickRollup.alias.in_(aliases)),
+            delete(LinkClickBreakdown).filter(LinkClickBreakdown.alias.in_(aliases))]
+
+
+def build_rename_click_aggregates_queries(old_alias: str, new_alias: str) -> list:
+    '''
+        Функция build_rename_click_aggregates_queries - возвращает запросы, которые
+            переносят агрегаты переходов со старого алиаса ссылки на новый.
+    '''
+
+    return [update(LinkClickRollup).filter(LinkClickRollup.alias == old_alias).values(alias=new_alias),
+            update(LinkClickBreakdown).filter(LinkClickBreakdown.alias == old_alias).values(alias=new_alias)]
+
+
+async def get_click_timeseries(session: AsyncSession, alias: str, granularity: str,
+                               start: datetime, end: datetime, top: int = 10) -> dict:
+    '''
+        Функция get_click_timeseries - возвращает количество переходов по ссылке
+            по интервалам granularity в промежутке [start, end) (интервалы без
+            переходов заполняются нулями), а также топ источников переходов
+            и семейств браузеров за дни этого промежутка. Читает только агрегаты.
+        Аргументы:
+            session (AsyncSession) - сессия подключения к БД.
+            alias (str) - алиас короткой ссылки.
+            granularity (str) - minute, hour или day.
+            start (datetime) - начало промежутка.
+            end (datetime) - конец промежутка.
+            top (int) - количество значений в разбивках.
+    '''
+
+    start = truncate_to_bucket(start, granularity)
+    query = (select(LinkClickRollup.bucket_start, LinkClickRollup.clicks)
+             .filter((LinkClickRollup.alias == alias) & (LinkClickRollup.granularity == granularity)
+                     & (LinkClickRollup.bucket_start >= start) & (LinkClickRollup.bucket_start < end)))
+    clicks = {row.bucket_start: row.clicks for row in (await session.execute(query)).all()}
+
+    points = []
+    bucket_start, step = start, GRANULARITIES[granularity]
+    while bucket_start < end:
+        points.append({'bucket_start': bucket_start, 'clicks': clicks.get(bucket_start, 0)})
+        bucket_start += step
+
+    total = func.sum(LinkClickBreakdown.clicks).label('clicks')
+    query = (select(LinkClickBreakdown.dimension, LinkClickBreakdown.value, total)
+             .filter((LinkClickBreakdown.alias == alias)
+                     & (LinkClickBreakdown.day >= start.date()) & (LinkClickBreakdown.day <= end.date()))
+             .group_by(LinkClickBreakdown.dimension, LinkClickBreakdown.value)
+             .order_by(total.desc()))
+    breakdowns = {'referrer': [], 'user_agent': []}
+    for row in (await session.execute(query)).all():
+        if len(breakdowns[row.dimension]) < top:
+            breakdowns[row.dimension].append({'value': row.value, 'clicks': row.clicks})
+
+    return {'alias': alias, 'granularity': granularity, 'start': start, 'end': end,
+            'total_clicks': sum(point['clicks'] for point in points), 'points': points,
+            'referrers': breakdowns['referrer'], 'user_agents': breakdowns['user_agent']}
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import math
+import time
+
+from redis.exceptions import RedisError
+from sqlalchemy import select, text
+
+from config import (ALIAS_FILTER_ENABLED, ALIAS_FILTER_CAPACITY, ALIAS_FILTER_ERROR_RATE,
+                    ALIAS_FILTER_BUILD_BATCH_SIZE, ALIAS_FILTER_REBUILD_INTERVAL, ALIAS_FILTER_RECENT_TTL)
+from database import read_connection
+from broadcast import worker_events
+from redis_client import get_redis
+from .models import Link
+
+
+logger = logging.getLogger(__name__)
+
+
+# Отсортированное множество недавно созданных алиасов (score - время создания), по которому
+# проверяется отсутствующий в фильтре алиас: событие о нем могло еще не дойти до воркера
+RECENT_ALIASES_KEY = 'tinyurl:aliases:recent'
+# Запас вместимости фильтра относительно оценки количества ссылок в таблице
+ALIAS_FILTER_HEADROOM = 1.25
+# Пауза перед повтором построения после ошибки в секундах
+ALIAS_FILTER_RETRY_INTERVAL = 10
+
+
+
+def get_bloom_filter_size(capacity: int, error_rate: float) -> tuple[int, int]:
+    '''
+        Функция get_bloom_filter_size - возвращает оптимальные размер фильтра Блума
+            в битах и количество хэш-функций для capacity элементов
+            и вероятности ложного срабатывания error_rate.
+            Например, для 50 млн алиасов и 1% - 479 млн бит (57 МиБ) и 7 хэшей,
+            для 0.1% - 719 млн бит (86 МиБ) и 10 хэшей.
+    '''
+
+    size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    return size, max(1, round(size / capacity * math.log(2)))
+
+
+
+class BloomFilter:
+    '''
+        Класс BloomFilter - фильтр Блума над строками: отсутствие строки в фильтре
+            гарантировано, присутствие - с вероятностью ложного срабатывания error_rate
+            (пока в фильтре не больше capacity элементов). Позиции битов получаются
+            двойным хэшированием из hash() строки, который закэширован в объекте str,
+            но отличается между процессами, поэтому фильтр строится в каждом процессе заново.
+        Аргументы:
+            capacity (int) - ожидаемое количество элементов.
+            error_rate (float) - допустимая вероятность ложного срабатывания.
+    '''
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size, self.hash_count = get_bloom_filter_size(capacity, error_rate)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._offsets = range(self.hash_count)
+
+    def add(self, *keys: str) -> None:
+        bits, size, offsets = self._bits, self.size, self._offsets
+        for key in keys:
+            value = hash(key)
+            first, step = value & 0xFFFFFFFF, (value >> 32 & 0xFFFFFFFF) | 1
+            for offset in offsets:
+                position = (first + offset * step) % size
+                bits[position >> 3] |= 1 << (position & 7)
+        self.count += len(keys)
+
+    def __contains__(self, key: str) -> bool:
+        bits, size = self._bits, self.size
+        value = hash(key)
+        first, step = value & 0xFFFFFFFF, (value >> 32 & 0xFFFFFFFF) | 1
+        for offset in self._offsets:
+            position = (first + offset * step) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return True
+
+    def false_positive_rate(self) -> float:
+        '''
+            Возвращает ожидаемую вероятность ложного срабатывания при текущем количестве элементов.
+        '''
+
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+    def stats(self) -> dict[str, int | float]:
+        return {'capacity': self.capacity, 'count': self.count, 'size_bytes': len(self._bits),
+                'hash_count': self.hash_count, 'false_positive_rate': self.false_positive_rate()}
+
+
+
+class AliasFilter:
+    '''
+        Класс AliasFilter - фильтр Блума над алиасами существующих ссылок в пределах
+            воркера. Алиас, которого нет в фильтре, точно не существует, и запрос
+            к нему не идет ни в Redis, ни в БД. Пока фильтр не построен (или после
+            потери обновлений из канала), любой алиас считается возможно существующим.
+            Удаленные алиасы остаются в фильтре до перестроения и проверяются как обычно.
+        Аргументы:
+            capacity (int) - минимальная вместимость фильтра.
+            error_rate (float) - допустимая вероятность ложного срабатывания.
+    '''
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter: BloomFilter | None = None
+        self._building: BloomFilter | None = None
+        self.negatives = 0
+        self.recent_hits = 0
+        self.builds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, alias: str) -> bool:
+        '''
+            Возвращает False, если алиаса точно нет в БД, иначе True.
+        '''
+
+        if self._filter is None or alias in self._filter:
+            return True
+
+        self.negatives += 1
+        return False
+
+    def add(self, *aliases: str) -> None:
+        '''
+            Добавляет алиасы в текущий фильтр и в фильтр, который сейчас строится.
+        '''
+
+        for bloom in (self._filter, self._building):
+            if bloom is not None:
+                bloom.add(*[alias for alias in aliases if alias not in bloom])
+
+    def reset(self) -> None:
+        '''
+            Отключает фильтр до следующего построения.
+        '''
+
+        self._filter = None
+
+    async def build(self) -> None:
+        '''
+            Строит новый фильтр по всем алиасам из БД (серверный курсор на primary,
+                пачками по ALIAS_FILTER_BUILD_BATCH_SIZE с передачей управления
+                event loop между пачками) и заменяет им текущий. Алиасы, добавленные
+                во время построения, попадают в оба фильтра.
+        '''
+
+        async with read_connection(use_primary=True) as connection:
+            # Оценка количества строк из статистики таблицы (-1, если таблица еще не анализировалась)
+            estimate = (await connection.execute(text(
+                f"SELECT reltuples FROM pg_class WHERE oid = '{Link.__tablename__}'::regclass"))).scalar() or 0
+            bloom = self._building = BloomFilter(max(self.capacity, int(estimate * ALIAS_FILTER_HEADROOM)),
+                                                 self.error_rate)
+            try:
+                result = await connection.stream(
+                    select(Link.alias).execution_options(yield_per=ALIAS_FILTER_BUILD_BATCH_SIZE))
+                async for aliases in result.scalars().partitions():
+                    bloom.add(*aliases)
+                    await asyncio.sleep(0)
+            finally:
+                self._building = None
+
+        self._filter = bloom
+        self.builds += 1
+        logger.info('Фильтр алиасов построен: %s алиасов, %s байт', bloom.count, bloom.stats()['size_bytes'])
+
+    def stats(self) -> dict[str, int | float]:
+        stats = {'ready': int(self.ready), 'negatives': self.negatives, 'recent_hits': self.recent_hits,
+                 'builds': self.builds}
+        if self._filter is not None:
+            stats.update(self._filter.stats())
+
+        return stats
+
+
+
+alias_filter = AliasFilter(ALIAS_FILTER_CAPACITY, ALIAS_FILTER_ERROR_RATE)
+_alias_filter_builder: asyncio.Task | None = None
+
+
+
+async def publish_aliases(*aliases: str) -> None:
+    '''
+        Функция publish_aliases - добавляет новые алиасы в фильтр текущего воркера
+            и рассылает их остальным воркерам событием aliases. Вызывается
+            после коммита, до ответа клиенту.
+        Аргументы:
+            aliases (str) - алиасы созданных или переименованных ссылок.
+    '''
+
+    if not aliases or not ALIAS_FILTER_ENABLED:
+        return None
+
+    alias_filter.add(*aliases)
+    now = time.time()
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.zadd(RECENT_ALIASES_KEY, dict.fromkeys(aliases, now))
+            pipe.zremrangebyscore(RECENT_ALIASES_KEY, '-inf', now - ALIAS_FILTER_RECENT_TTL)
+            pipe.expire(RECENT_ALIASES_KEY, int(ALIAS_FILTER_RECENT_TTL))
+            await pipe.execute()
+    except RedisError:
+        pass
+    if not await worker_events.publish('aliases', *aliases):
+        logger.warning('Redis недоступен, алиасы %s попадут в фильтры других воркеров при перестроении', aliases)
+
+
+async def is_recent_alias(alias: str) -> bool:
+    '''
+        Функция is_recent_alias - проверяет, был ли алиас создан через API за последние
+            ALIAS_FILTER_RECENT_TTL секунд. Если Redis недоступен, то алиас считается
+            недавно созданным (отсутствие в фильтре не подтверждено).
+    '''
+
+    try:
+        created_at = await get_redis().zscore(RECENT_ALIASES_KEY, alias)
+    except RedisError:
+        return True
+
+    return created_at is not None and created_at > time.time() - ALIAS_FILTER_RECENT_TTL
+
+
+async def is_alias_missing(alias: str) -> bool:
+    '''
+        Функция is_alias_missing - возвращает True, если ссылки с алиасом точно нет:
+            алиаса нет в фильтре, и отсутствие подтверждено по недавно созданным
+            алиасам в Redis (событие о новом алиасе из другого воркера могло еще
+            не прийти). Запрос в БД для такого алиаса не выполняется.
+    '''
+
+    if alias_filter.might_exist(alias):
+        return False
+
+    if await is_recent_alias(alias):
+        alias_filter.recent_hits += 1
+        alias_filter.add(alias)
+        return False
+
+    return True
+
+
+async def request_alias_filter_rebuild() -> bool:
+    '''
+        Функция request_alias_filter_rebuild - перестраивает фильтры алиасов всех
+            воркеров. Вызывается после добавления ссылок в БД в обход API (например,
+            tests/benchmarks/seed.py), возвращает False, если Redis недоступен.
+    '''
+
+    return await worker_events.publish('rebuild_alias_filter')
+
+
+async def keep_alias_filter_built() -> None:
+    '''
+        Функция keep_alias_filter_built - строит фильтр алиасов (с повтором при ошибке)
+            и перестраивает его каждые ALIAS_FILTER_REBUILD_INTERVAL секунд, чтобы
+            убрать из него удаленные алиасы и увеличить вместимость.
+    '''
+
+    while True:
+        try:
+            await alias_filter.build()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Не удалось построить фильтр алиасов')
+            await asyncio.sleep(ALIAS_FILTER_RETRY_INTERVAL)
+            continue
+
+        await asyncio.sleep(ALIAS_FILTER_REBUILD_INTERVAL)
+
+
+def stop_alias_filter() -> None:
+    '''
+        Функция stop_alias_filter - останавливает построение фильтра алиасов
+            и отключает его (при потере подписки на события воркеров).
+    '''
+
+    global _alias_filter_builder
+    if _alias_filter_builder is not None:
+        _alias_filter_builder.cancel()
+        _alias_filter_builder = None
+    alias_filter.reset()
+
+
+def start_alias_filter() -> None:
+    '''
+        Функция start_alias_filter - строит фильтр алиасов заново после каждой
+            (повторной) подписки на события воркеров: алиасы, добавленные за время
+            переподключения, могли не прийти. Построение начинается после подтверждения
+            подписки, поэтому алиасы, созданные во время построения, придут событиями.
+    '''
+
+    global _alias_filter_builder
+    stop_alias_filter()
+    _alias_filter_builder = asyncio.create_task(keep_alias_filter_built())
+
+
+def register_alias_filter() -> None:
+    '''
+        Функция register_alias_filter - подключает фильтр алиасов к событиям воркеров.
+    '''
+
+    worker_events.on('aliases', alias_filter.add)
+    worker_events.on('rebuild_alias_filter', start_alias_filter)
+    worker_events.on_subscribe(start_alias_filter)
+    worker_events.on_disconnect(stop_alias_filter)
@@ -0,0 +1,251 @@
+import codecs
+import json
+from collections.abc import AsyncIterator
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from starlette.responses import StreamingResponse
+
+from config import (HOST_URL_OR_DOMEN, HOST_PORT, BULK_SHORTEN_CHUNK_SIZE, BULK_SHORTEN_MAX_ITEM_SIZE,
+                    ALL_MY_LINKS_STREAM_BATCH_SIZE)
+from database import async_session_maker, read_connection
+from .bloom import publish_aliases
+from .cache import invalidate_alias, invalidate_search
+from .models import Link
+from .schemas import PostShortenLinkRequestBody
+from .utils import alias_allocator, parse_expires_at, get_dedup_key, ALIAS_ALLOCATION_ATTEMPTS
+
+
+
+class BulkInputError(ValueError):
+    '''
+        Ошибка разбора входного потока массового создания ссылок.
+    '''
+
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    '''
+        Потоковый ответ в формате NDJSON, который не слушает receive канал
+            в фоне, так как генератор ответа сам дочитывает тело запроса.
+    '''
+
+    media_type = 'application/x-ndjson'
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+
+async def iter_json_items(chunks: AsyncIterator[bytes]) -> AsyncIterator[object]:
+    '''
+        Функция iter_json_items - инкрементально разбирает поток байт,
+            содержащий JSON массив или NDJSON, и по одному возвращает его элементы.
+            В памяти держится только текущий недочитанный элемент.
+        Аргументы:
+            chunks (AsyncIterator[bytes]) - поток тела запроса.
+    '''
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    is_array = None
+    array_closed = False
+
+    async for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+
+        # Определение формата по первому значимому символу
+        if is_array is None:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            is_array = buffer[0] == '['
+            if is_array:
+                buffer = buffer[1:]
+
+        if not is_array:
+            *lines, buffer = buffer.split('\n')
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            while True:
+                buffer = buffer.lstrip(' \t\r\n,')
+                if not buffer:
+                    break
+                if buffer[0] == ']':
+                    array_closed = True
+                    buffer = buffer[1:]
+                    break
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    # Элемент пришел не полностью, ждем следующую порцию данных
+                    break
+                yield item
+                buffer = buffer[end:]
+
+        if len(buffer) > BULK_SHORTEN_MAX_ITEM_SIZE:
+            raise BulkInputError(f'Элемент длиннее {BULK_SHORTEN_MAX_ITEM_SIZE} байт')
+
+    buffer = (buffer + text_decoder.decode(b'', final=True)).strip()
+    if is_array and (buffer or not array_closed):
+        raise BulkInputError('Некорректный JSON массив')
+    if not is_array and buffer:
+        yield json.loads(buffer)
+
+
+
+async def insert_links_chunk(session, chunk: list[tuple[int, PostShortenLinkRequestBody, datetime | None]],
+                             user_id: int) -> dict[int, dict]:
+    '''
+        Функция insert_links_chunk - сохраняет пачку ссылок одним запросом
+            INSERT ... ON CONFLICT DO NOTHING, возвращает результаты по индексам элементов.
+            Сгенерированные алиасы, совпавшие с кастомными, заменяются на новые.
+            Для элементов с deduplicate возвращается алиас существующей ссылки
+            с тем же dedup_key, если она есть.
+        Аргументы:
+            session (AsyncSession) - сессия подключения к БД.
+            chunk (list) - список кортежей (индекс элемента, параметры ссылки, время удаления ссылки).
+            user_id (int) - идентификатор пользователя, создающего ссылки.
+    '''
+
+    results = {}
+    created_at = datetime.now()
+    pending = {}
+    expires = {}
+    dedup_keys = {}
+    created_aliases = []
+
+    # Кастомные алиасы, повторяющиеся внутри пачки, сразу считаются занятыми
+    custom_aliases = set()
+    for index, link_params, expires_at in chunk:
+        alias = link_params.custom_alias
+        if alias and alias in custom_aliases:
+            results[index] = {'index': index, 'error': 'Переданный custom_alias уже существует'}
+        else:
+            custom_aliases.add(alias)
+            pending[index] = link_params
+            expires[index] = expires_at
+            if link_params.deduplicate and not alias:
+                dedup_keys[index] = get_dedup_key(link_params.source_url, expires_at)
+
+    aliases = {index: link_params.custom_alias for index, link_params in pending.items()}
+    for attempt in range(ALIAS_ALLOCATION_ATTEMPTS):
+        generated = [index for index in pending if not pending[index].custom_alias]
+        for index, alias in zip(generated, await alias_allocator.allocate_many(session, len(generated))):
+            aliases[index] = alias
+
+        rows = [{'user_id': user_id, 'alias': aliases[index],
+                 'source_url': link_params.source_url, 'created_at': created_at,
+                 'expires_at': expires[index],
+                 'last_used_at': None, 'transitions_quantity': 0,
+                 'dedup_key': dedup_keys.get(index)}
+                for index, link_params in pending.items()]
+        # Конфликт без указания индекса: пропускаются и занятые алиасы, и дубликаты по dedup_key
+        query = insert(Link).values(rows).on_conflict_do_nothing().returning(Link.alias)
+        inserted = set((await session.execute(query)).scalars())
+        created_aliases.extend(inserted)
+
+        # Алиасы существующих ссылок для элементов, которые не вставлены из-за dedup_key
+        keys = [dedup_keys[index] for index in pending if index in dedup_keys and aliases[index] not in inserted]
+        existing = {}
+        if keys:
+            query = select(Link.dedup_key, Link.alias).filter((Link.user_id == user_id)
+                                                              & Link.dedup_key.in_(keys))
+            existing = dict((await session.execute(query)).all())
+
+        retry = {}
+        for index, link_params in pending.items():
+            alias = aliases[index]
+            if alias in inserted:
+                results[index] = {'index': index,
+                                  'short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{alias}'}
+            elif dedup_keys.get(index) in existing:
+                results[index] = {'index': index,
+                                  'short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{existing[dedup_keys[index]]}'}
+            elif link_params.custom_alias:
+                results[index] = {'index': index, 'error': 'Переданный custom_alias уже существует'}
+            elif attempt == ALIAS_ALLOCATION_ATTEMPTS - 1:
+                results[index] = {'index': index, 'error': 'Не удалось сгенерировать алиас'}
+            else:
+                retry[index] = link_params
+        pending = retry
+        if not pending:
+            break
+
+    await session.commit()
+
+    # Добавление созданных алиасов в фильтры алиасов воркеров, сброс закэшированных
+    # отрицательных результатов для кастомных алиасов и результатов поиска ссылок
+    # пользователя на созданные url
+    await publish_aliases(*created_aliases)
+    await invalidate_alias(*(alias for alias in custom_aliases if alias))
+    await invalidate_search(*[(user_id, link_params.source_url) for _, link_params, _ in chunk])
+
+    return results
+
+
+
+async def bulk_shorten_links(chunks: AsyncIterator[bytes], user_id: int) -> AsyncIterator[bytes]:
+    '''
+        Функция bulk_shorten_links - читает элементы PostShortenLinkRequestBody
+            из потока, сохраняет их пачками по BULK_SHORTEN_CHUNK_SIZE и по мере
+            сохранения возвращает результат по каждому элементу строкой NDJSON.
+        Аргументы:
+            chunks (AsyncIterator[bytes]) - поток тела запроса.
+            user_id (int) - идентификатор пользователя, создающего ссылки.
+    '''
+
+    def dump(result: dict) -> bytes:
+        return json.dumps(result, ensure_ascii=False).encode() + b'\n'
+
+    async with async_session_maker() as session:
+        chunk = []
+        index = 0
+        try:
+            async for item in iter_json_items(chunks):
+                try:
+                    link_params = PostShortenLinkRequestBody.model_validate(item)
+                    chunk.append((index, link_params, parse_expires_at(link_params.expires_at)))
+                except ValidationError as e:
+                    yield dump({'index': index, 'error': e.errors(include_url=False, include_context=False)})
+                except ValueError as e:
+                    yield dump({'index': index, 'error': str(e)})
+                index += 1
+
+                if len(chunk) >= BULK_SHORTEN_CHUNK_SIZE:
+                    results = await insert_links_chunk(session, chunk, user_id)
+                    for result_index in sorted(results):
+                        yield dump(results[result_index])
+                    chunk = []
+        except (BulkInputError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            yield dump({'index': index, 'error': f'Не удалось разобрать входные данные: {e}'})
+
+        if chunk:
+            results = await insert_links_chunk(session, chunk, user_id)
+            for result_index in sorted(results):
+                yield dump(results[result_index])
+
+
+
+async def stream_user_links(query, use_primary: bool = False) -> AsyncIterator[bytes]:
+    '''
+        Функция stream_user_links - выполняет запрос ссылок пользователя через
+            серверный курсор и по мере чтения возвращает их строками NDJSON.
+            В памяти одновременно держится не больше ALL_MY_LINKS_STREAM_BATCH_SIZE строк.
+        Аргументы:
+            query - запрос, построенный build_user_links_query.
+            use_primary (bool) - читать с primary, а не с реплики.
+    '''
+
+    async with read_connection(use_primary=use_primary) as connection:
+        result = await connection.stream(query.execution_options(yield_per=ALL_MY_LINKS_STREAM_BATCH_SIZE))
+        async for link_data in result:
+            line = {'id': link_data.id,
+                    'short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{link_data.alias}',
+                    'original_url': link_data.source_url}
+            yield json.dumps(line, ensure_ascii=False).encode() + b'\n'
@@ -0,0 +1,397 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import orjson
+from redis.exceptions import RedisError
+
+from config import (ALIAS_CACHE_MAX_SIZE, ALIAS_CACHE_TTL, ALIAS_CACHE_NEGATIVE_TTL, SEARCH_CACHE_TTL,
+                    ALIAS_REDIS_STALE_TTL, ALIAS_REDIS_TTL_JITTER, ALIAS_REFRESH_LOCK_TTL)
+from broadcast import worker_events
+from metrics import timed
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+# Маркер промаха кэша (отличается от False, которым кэшируется несуществующий алиас)
+MISS = object()
+
+# Префикс ключей fastapi_cache и namespace, в котором get_url_data_by_alias
+# хранит данные об алиасах в Redis
+CACHE_PREFIX = 'fastapi-cache'
+ALIAS_CACHE_NAMESPACE = 'alias'
+# Время жизни данных об алиасе в Redis в секундах, после которого запись считается
+# устаревшей и обновляется одним запросом (еще ALIAS_REDIS_STALE_TTL секунд она отдается как есть)
+ALIAS_REDIS_TTL = 60
+# Блокировка на обновление устаревшей записи об алиасе (одна на все воркеры)
+ALIAS_REFRESH_LOCK_KEY = 'tinyurl:alias_refresh:{}'
+
+# Обратный индекс для /links/search: hash по хэшу исходного url, поле - user_id,
+# значение - JSON список алиасов ссылок пользователя на этот url
+SEARCH_CACHE_KEY = 'tinyurl:search:{}'
+
+
+
+class UrlData(NamedTuple):
+    '''
+        Класс UrlData - данные о ссылке, которые нужны для редиректа и проверки
+            владельца. Хранится в in-process кэше как есть, а в Redis - плоским
+            массивом orjson (см. pack_url_data). Статистика ссылки сюда не входит
+            и читается из БД отдельно.
+    '''
+
+    user_id: int
+    source_url: str
+    # Время удаления ссылки (unix timestamp) или None для бессрочной ссылки
+    expires_at: float | None
+
+    @classmethod
+    def from_row(cls, row) -> 'UrlData':
+        return cls(row.user_id, row.source_url, row.expires_at.timestamp() if row.expires_at else None)
+
+
+
+class AliasCache:
+    '''
+        Класс AliasCache - ограниченный по размеру in-process кэш алиасов (LRU + TTL),
+            который стоит перед кэшем в Redis на горячем пути редиректа.
+        Несуществующие алиасы кэшируются как False с отдельным (коротким) TTL.
+        Аргументы:
+            max_size (int) - максимальное количество записей в кэше.
+            ttl (float) - время жизни записи о существующем алиасе в секундах.
+            negative_ttl (float) - время жизни записи о несуществующем алиасе в секундах.
+    '''
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: OrderedDict[str, tuple[float, UrlData | bool]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, alias: str):
+        '''
+            Возвращает закэшированные данные об алиасе или MISS, если записи нет
+                или ее время жизни истекло.
+        '''
+
+        entry = self._data.get(alias)
+        if entry is None:
+            self.misses += 1
+            return MISS
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[alias]
+            self.misses += 1
+            return MISS
+
+        self._data.move_to_end(alias)
+        self.hits += 1
+        return value
+
+    def set(self, alias: str, value: UrlData | bool) -> None:
+        '''
+            Сохраняет данные об алиасе в кэш, при переполнении вытесняет
+                самую давно использованную запись.
+        '''
+
+        ttl = self.ttl if value else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return None
+
+        self._data[alias] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(alias)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *aliases: str) -> None:
+        '''
+            Удаляет из кэша записи о переданных алиасах.
+        '''
+
+        for alias in aliases:
+            self._data.pop(alias, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        '''
+            Возвращает счетчики попаданий, промахов и вытеснений, а также текущий размер кэша.
+        '''
+
+        return {'size': len(self._data), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+
+class SingleFlight:
+    '''
+        Класс SingleFlight - объединяет одновременные вызовы с одним ключом
+            в пределах воркера: первый вызов запускает задачу, остальные ждут
+            ее результата (или исключения) вместо повторного выполнения.
+        Задача не отменяется, если отменен запрос, который ее запустил.
+    '''
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func, *args):
+        '''
+            Возвращает результат await func(*args), выполняя его не больше одного
+                раза одновременно для ключа key.
+        '''
+
+        task = self._tasks.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._tasks[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> dict[str, int]:
+        '''
+            Возвращает количество выполненных и объединенных вызовов, а также
+                количество вызовов, выполняющихся сейчас.
+        '''
+
+        return {'in_flight': len(self._tasks), 'calls': self.calls, 'coalesced': self.coalesced}
+
+
+
+alias_cache = AliasCache(ALIAS_CACHE_MAX_SIZE, ALIAS_CACHE_TTL, ALIAS_CACHE_NEGATIVE_TTL)
+alias_lookups = SingleFlight()
+
+
+
+def get_alias_cache_key(alias: str) -> str:
+    return f'{CACHE_PREFIX}:{ALIAS_CACHE_NAMESPACE}:{alias}'
+
+
+def get_alias_redis_ttl() -> float:
+    '''
+        Функция get_alias_redis_ttl - возвращает ALIAS_REDIS_TTL со случайным разбросом
+            ±ALIAS_REDIS_TTL_JITTER, чтобы записи, сохраненные одновременно
+            (например, при прогреве кэша), не устаревали в одну и ту же секунду.
+    '''
+
+    return ALIAS_REDIS_TTL * (1 + random.uniform(-ALIAS_REDIS_TTL_JITTER, ALIAS_REDIS_TTL_JITTER))
+
+
+def pack_url_data(url: UrlData | bool, refresh_at: float) -> bytes:
+    '''
+        Функция pack_url_data - возвращает запись об алиасе для Redis: массив
+            [refresh_at, user_id, source_url, expires_at] или [refresh_at]
+            для несуществующего алиаса.
+        Аргументы:
+            url (UrlData или bool) - данные о ссылке или False, если ссылки нет.
+            refresh_at (float) - время (unix timestamp), после которого запись устаревает.
+    '''
+
+    return orjson.dumps((refresh_at, *url) if url else (refresh_at,))
+
+
+def unpack_url_data(cached: bytes) -> tuple[UrlData | bool, float]:
+    '''
+        Функция unpack_url_data - возвращает пару (данные о ссылке или False, refresh_at)
+            из записи pack_url_data или MISS, если запись в другом формате.
+    '''
+
+    try:
+        values = orjson.loads(cached)
+    except orjson.JSONDecodeError:
+        return MISS
+
+    # Записи в прежних форматах (JSON объект или [refresh_at, объект]) считаются промахом
+    if not isinstance(values, list) or len(values) not in (1, 4):
+        return MISS
+
+    return (UrlData(*values[1:]) if len(values) == 4 else False), values[0]
+
+
+@timed('alias_cache_get')
+async def get_cached_url_data(alias: str) -> tuple[UrlData | bool, bool]:
+    '''
+        Функция get_cached_url_data - возвращает пару (данные об алиасе из Redis
+            (False для несуществующего алиаса), признак устаревшей записи)
+            или MISS, если записи нет или Redis недоступен.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+    '''
+
+    try:
+        cached = await get_redis().get(get_alias_cache_key(alias))
+    except RedisError:
+        logger.warning('Redis недоступен, данные об алиасе %s будут получены из БД', alias)
+        return MISS
+
+    if cached is None:
+        return MISS
+
+    cached = unpack_url_data(cached)
+    if cached is MISS:
+        return MISS
+
+    url, refresh_at = cached
+    return url, refresh_at <= time.time()
+
+
+def add_cached_url_data(pipe, alias: str, url: UrlData | bool, nx: bool = False):
+    '''
+        Функция add_cached_url_data - добавляет в pipeline (или выполняет на клиенте)
+            Redis команду сохранения данных об алиасе: запись считается свежей
+            get_alias_redis_ttl() секунд, после чего еще ALIAS_REDIS_STALE_TTL секунд
+            отдается как устаревшая. При nx=True существующая запись не перезаписывается.
+    '''
+
+    ttl = get_alias_redis_ttl()
+    return pipe.set(get_alias_cache_key(alias), pack_url_data(url, time.time() + ttl),
+                    px=int((ttl + ALIAS_REDIS_STALE_TTL) * 1000), nx=nx)
+
+
+@timed('alias_cache_set')
+async def set_cached_url_data(alias: str, url: UrlData | bool) -> None:
+    '''
+        Функция set_cached_url_data - сохраняет данные об алиасе в Redis (см. add_cached_url_data).
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+            url (UrlData или bool) - данные о ссылке или False, если ссылки нет.
+    '''
+
+    try:
+        await add_cached_url_data(get_redis(), alias, url)
+    except RedisError:
+        logger.warning('Redis недоступен, данные об алиасе %s не сохранены в кэш', alias)
+
+
+async def acquire_alias_refresh_lock(alias: str) -> bool:
+    '''
+        Функция acquire_alias_refresh_lock - захватывает на ALIAS_REFRESH_LOCK_TTL
+            секунд блокировку на обновление устаревшей записи об алиасе. Возвращает
+            True только для одного запроса среди всех воркеров, остальные отдают
+            устаревшие данные. Блокировка не снимается, а истекает сама.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+    '''
+
+    try:
+        return bool(await get_redis().set(ALIAS_REFRESH_LOCK_KEY.format(alias), 1, nx=True,
+                                          px=int(ALIAS_REFRESH_LOCK_TTL * 1000)))
+    except RedisError:
+        logger.warning('Redis недоступен, устаревшая запись об алиасе %s не обновляется', alias)
+        return False
+
+
+async def invalidate_alias(*aliases: str) -> None:
+    '''
+        Функция invalidate_alias - удаляет записи о переданных алиасах из
+            кэша в Redis и из in-process кэшей всех воркеров (событием
+            invalidate_aliases). Если Redis недоступен, то записи истекут сами по TTL.
+        Аргументы:
+            aliases (str) - алиасы коротких ссылок.
+    '''
+
+    if not aliases:
+        return None
+
+    alias_cache.invalidate(*aliases)
+    try:
+        await get_redis().delete(*[get_alias_cache_key(alias) for alias in aliases])
+    except RedisError:
+        logger.warning('Redis недоступен, алиасы %s удалены только из кэша текущего воркера', aliases)
+        return None
+
+    await worker_events.publish('invalidate_aliases', *aliases)
+
+
+def register_alias_cache() -> None:
+    '''
+        Функция register_alias_cache - подключает in-process кэш алиасов к событиям
+            воркеров: удаленные, переименованные и созданные в любом воркере алиасы
+            удаляются из кэшей всех воркеров, а при потере подписки кэш очищается.
+    '''
+
+    worker_events.on('invalidate_aliases', alias_cache.invalidate)
+    worker_events.on_subscribe(alias_cache.clear)
+    worker_events.on_disconnect(alias_cache.clear)
+
+
+
+def get_search_cache_key(source_url: str) -> str:
+    return SEARCH_CACHE_KEY.format(hashlib.sha1(source_url.encode()).hexdigest())
+
+
+async def get_cached_search(user_id: int, source_url: str) -> list[str]:
+    '''
+        Функция get_cached_search - возвращает алиасы ссылок пользователя на source_url
+            из обратного индекса в Redis или MISS, если записи нет или Redis недоступен.
+        Аргументы:
+            user_id (int) - идентификатор пользователя.
+            source_url (str) - исходный url.
+    '''
+
+    try:
+        cached = await get_redis().hget(get_search_cache_key(source_url), user_id)
+    except RedisError:
+        logger.warning('Redis недоступен, поиск ссылок на %s выполняется в БД', source_url)
+        return MISS
+
+    if cached is None:
+        return MISS
+
+    return json.loads(cached)
+
+
+async def set_cached_search(user_id: int, source_url: str, aliases: list[str]) -> None:
+    '''
+        Функция set_cached_search - сохраняет алиасы ссылок пользователя на source_url
+            в обратный индекс в Redis на SEARCH_CACHE_TTL секунд.
+    '''
+
+    key = get_search_cache_key(source_url)
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.hset(key, user_id, json.dumps(aliases))
+            pipe.expire(key, SEARCH_CACHE_TTL)
+            await pipe.execute()
+    except RedisError:
+        logger.warning('Redis недоступен, результат поиска ссылок на %s не сохранен в кэш', source_url)
+
+
+async def invalidate_search(*links: tuple[int, str]) -> None:
+    '''
+        Функция invalidate_search - удаляет из обратного индекса результаты поиска
+            для переданных пар (user_id, source_url) после создания, изменения
+            или удаления ссылок.
+    '''
+
+    if not links:
+        return None
+
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for user_id, source_url in set(links):
+                pipe.hdel(get_search_cache_key(source_url), user_id)
+            await pipe.execute()
+    except RedisError:
+        logger.warning('Redis недоступен, результаты поиска истекут в кэше по TTL')
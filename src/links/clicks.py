@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+from sqlalchemy import update, delete, values, column, func, cast, exists, literal, String, Integer, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import CLICK_FLUSH_INTERVAL, CLICK_FLUSH_BATCH_SIZE, CLICK_FLUSH_LOCK_TTL, CLICK_EVENTS_ENABLED
+from database import async_session_maker
+from redis_client import get_redis
+from .analytics import add_click_event
+from .models import Link, ClickFlushBatch
+
+
+logger = logging.getLogger(__name__)
+
+# Ключи Redis, в которых копятся еще не записанные в БД переходы по ссылкам
+# (общий hash tag {tinyurl:clicks}, чтобы в Redis Cluster все ключи лежали в одном слоте)
+CLICKS_KEY = '{tinyurl:clicks}'
+LAST_USED_KEY = '{tinyurl:clicks}:last_used'
+# Ключи, в которые переносятся переходы на время записи в БД
+FLUSHING_CLICKS_KEY = '{tinyurl:clicks}:flushing'
+FLUSHING_LAST_USED_KEY = '{tinyurl:clicks}:last_used:flushing'
+# id пачки переходов в ключах для записи в БД
+FLUSH_BATCH_KEY = '{tinyurl:clicks}:flush_batch'
+# Сколько хранятся id записанных в БД пачек (пачка, которая записалась в БД,
+# но не удалилась из Redis, удаляется при следующей записи)
+FLUSH_BATCH_RETENTION = timedelta(days=1)
+# Блокировка, чтобы одновременно запись в БД выполнял только один воркер
+FLUSH_LOCK_KEY = 'tinyurl:clicks:flush_lock'
+# Как часто проверяется, освободилась ли блокировка, при ожидании в секундах
+FLUSH_LOCK_WAIT_INTERVAL = 0.05
+
+# Снятие блокировки только ее владельцем (запись могла выполняться дольше
+# CLICK_FLUSH_LOCK_TTL, и блокировку уже захватил другой воркер)
+RELEASE_FLUSH_LOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+
+async def record_click(alias: str, session: AsyncSession | None = None,
+                       referrer: str | None = None, user_agent: str | None = None) -> None:
+    '''
+        Функция record_click - учитывает переход по короткой ссылке в буфере в Redis
+            (HINCRBY по алиасу и время последнего перехода) и добавляет событие
+            перехода в поток для аналитики (тем же запросом к Redis). Если Redis
+            недоступен, то увеличивает счетчик переходов напрямую в БД.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+            session (AsyncSession или None) - сессия подключения к БД, если не передана,
+                то при недоступности Redis открывается новая.
+            referrer (str или None) - заголовок Referer запроса.
+            user_agent (str или None) - заголовок User-Agent запроса.
+    '''
+
+    try:
+        redis = get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(CLICKS_KEY, alias, 1)
+            pipe.hset(LAST_USED_KEY, alias, time.time())
+            if CLICK_EVENTS_ENABLED:
+                add_click_event(pipe, alias, referrer, user_agent)
+            await pipe.execute()
+        return None
+    except RedisError:
+        logger.warning('Redis недоступен, переход по %s записывается напрямую в БД', alias)
+
+    query = update(Link).filter(Link.alias == alias).values(last_used_at=datetime.now(),
+                                                            transitions_quantity=Link.transitions_quantity + 1)
+    if session is None:
+        async with async_session_maker() as session:
+            await session.execute(query)
+            await session.commit()
+        return None
+
+    await session.execute(query)
+    await session.commit()
+
+
+
+# Lua скрипт для атомарного переноса накопленных переходов со старого алиаса на новый
+# (в парах ключей: переходы и время последнего перехода, основные и для записи в БД)
+RENAME_CLICKS_SCRIPT = '''
+for i = 1, #KEYS, 2 do
+    local clicks = redis.call('HGET', KEYS[i], ARGV[1])
+    if clicks then
+        redis.call('HINCRBY', KEYS[i], ARGV[2], clicks)
+        redis.call('HDEL', KEYS[i], ARGV[1])
+    end
+    local last_used = redis.call('HGET', KEYS[i + 1], ARGV[1])
+    if last_used then
+        redis.call('HSET', KEYS[i + 1], ARGV[2], last_used)
+        redis.call('HDEL', KEYS[i + 1], ARGV[1])
+    end
+end
+return 1
+'''
+
+
+async def rename_clicks(old_alias: str, new_alias: str) -> None:
+    '''
+        Функция rename_clicks - переносит еще не записанные в БД переходы
+            со старого алиаса ссылки на новый, чтобы они не потерялись при смене алиаса,
+            в том числе переходы, оставшиеся от незавершенной записи в БД. Смена алиаса
+            в БД и перенос выполняются под блокировкой записи переходов (hold_flush_lock),
+            иначе идущая запись обновит в БД уже не существующий старый алиас.
+        Аргументы:
+            old_alias (str) - старый алиас короткой ссылки.
+            new_alias (str) - новый алиас короткой ссылки.
+    '''
+
+    try:
+        redis = get_redis()
+        await redis.eval(RENAME_CLICKS_SCRIPT, 4, CLICKS_KEY, LAST_USED_KEY,
+                         FLUSHING_CLICKS_KEY, FLUSHING_LAST_USED_KEY, old_alias, new_alias)
+    except RedisError:
+        logger.warning('Не удалось перенести переходы с %s на %s', old_alias, new_alias)
+
+
+
+# Lua скрипт для атомарного переноса накопленных переходов в ключи для записи в БД,
+# возвращает id пачки переходов в этих ключах (если предыдущая запись не завершилась,
+# то ключи для записи уже существуют, не трогаются и возвращается id их пачки)
+START_FLUSH_SCRIPT = '''
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('RENAME', KEYS[1], KEYS[3])
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RENAME', KEYS[2], KEYS[4])
+    end
+    redis.call('SET', KEYS[5], ARGV[1])
+end
+local batch_id = redis.call('GET', KEYS[5])
+if not batch_id then
+    redis.call('SET', KEYS[5], ARGV[1])
+    batch_id = ARGV[1]
+end
+return batch_id
+'''
+
+# Удаление записанной в БД пачки переходов (если это все еще она)
+FINISH_FLUSH_SCRIPT = '''
+if redis.call('GET', KEYS[3]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+end
+return 0
+'''
+
+
+
+# Атомарное чтение переходов по алиасу (чтобы между чтениями не начиналась запись в БД)
+GET_UNFLUSHED_CLICKS_SCRIPT = '''
+return {redis.call('HGET', KEYS[1], ARGV[1]), redis.call('HGET', KEYS[2], ARGV[1]),
+        redis.call('HGET', KEYS[3], ARGV[1]), redis.call('HGET', KEYS[4], ARGV[1]),
+        redis.call('GET', KEYS[5])}
+'''
+
+
+
+class UnflushedClicks(NamedTuple):
+    '''
+        Класс UnflushedClicks - переходы по алиасу, которые еще не записаны в БД:
+            накопленные и переданные на запись в БД пачкой batch_id. Пачка могла
+            уже записаться в БД, поэтому ее переходы учитываются, только если
+            в том же запросе к БД, из которого берутся счетчики ссылки, пачки
+            нет в click_flush_batch (см. build_flush_batch_applied_clause).
+    '''
+
+    clicks: int = 0
+    last_used_at: datetime | None = None
+    flushing_clicks: int = 0
+    flushing_last_used_at: datetime | None = None
+    batch_id: str | None = None
+
+    def get_delta(self, batch_applied: bool) -> tuple[int, datetime | None]:
+        '''
+            Возвращает количество незаписанных переходов и время последнего из них.
+        '''
+
+        if batch_applied:
+            return self.clicks, self.last_used_at
+
+        last_used_at = max(filter(None, (self.last_used_at, self.flushing_last_used_at)), default=None)
+        return self.clicks + self.flushing_clicks, last_used_at
+
+
+
+async def get_unflushed_clicks(alias: str) -> UnflushedClicks:
+    '''
+        Функция get_unflushed_clicks - возвращает переходы по алиасу, которые
+            еще не записаны в БД.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+    '''
+
+    try:
+        keys = (CLICKS_KEY, LAST_USED_KEY, FLUSHING_CLICKS_KEY, FLUSHING_LAST_USED_KEY, FLUSH_BATCH_KEY)
+        clicks, last_used, flushing_clicks, flushing_last_used, batch_id = await get_redis().eval(
+            GET_UNFLUSHED_CLICKS_SCRIPT, len(keys), *keys, alias)
+    except RedisError:
+        return UnflushedClicks()
+
+    return UnflushedClicks(int(clicks or 0), datetime.fromtimestamp(float(last_used)) if last_used else None,
+                           int(flushing_clicks or 0),
+                           datetime.fromtimestamp(float(flushing_last_used)) if flushing_last_used else None,
+                           batch_id.decode() if batch_id else None)
+
+
+def build_flush_batch_applied_clause(batch_id: str | None):
+    '''
+        Функция build_flush_batch_applied_clause - возвращает выражение SQL,
+            истинное, если пачка переходов batch_id уже записана в БД.
+    '''
+
+    if batch_id is None:
+        return literal(False)
+
+    return exists().where(ClickFlushBatch.id == batch_id)
+
+
+
+@asynccontextmanager
+async def hold_flush_lock(wait: float = 0) -> AsyncIterator[bool]:
+    '''
+        Функция hold_flush_lock - захватывает блокировку записи переходов в БД
+            на время блока with и возвращает, удалось ли ее захватить.
+        Аргументы:
+            wait (float) - сколько секунд ждать освобождения блокировки.
+    '''
+
+    redis = get_redis()
+    token = uuid4().hex
+    deadline = time.monotonic() + wait
+    try:
+        while not (locked := bool(await redis.set(FLUSH_LOCK_KEY, token, nx=True, ex=CLICK_FLUSH_LOCK_TTL))):
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(FLUSH_LOCK_WAIT_INTERVAL)
+    except RedisError:
+        logger.warning('Redis недоступен, блокировка записи переходов не захвачена')
+        locked = False
+
+    if not locked:
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        try:
+            await redis.eval(RELEASE_FLUSH_LOCK_SCRIPT, 1, FLUSH_LOCK_KEY, token)
+        except RedisError:
+            logger.warning('Redis недоступен, блокировка записи переходов истечет по TTL')
+
+
+
+def build_clicks_update_query(rows: list[tuple[str, int, datetime | None]]):
+    '''
+        Функция build_clicks_update_query - строит один запрос
+            UPDATE link ... FROM (VALUES ...) для пачки накопленных переходов.
+        Аргументы:
+            rows (list) - список кортежей (алиас, количество переходов, время последнего перехода).
+    '''
+
+    clicks = values(column('alias', String), column('delta', Integer),
+                    column('last_used_at', DateTime), name='clicks').data(rows)
+
+    return (update(Link)
+            .where(Link.alias == clicks.c.alias)
+            .values(transitions_quantity=Link.transitions_quantity + clicks.c.delta,
+                    last_used_at=func.greatest(Link.last_used_at,
+                                                cast(clicks.c.last_used_at, DateTime))))
+
+
+
+async def flush_clicks() -> int:
+    '''
+        Функция flush_clicks - переносит накопленные в Redis переходы в БД
+            (Link.transitions_quantity и Link.last_used_at) пачками по
+            CLICK_FLUSH_BATCH_SIZE ссылок, возвращает количество обновленных алиасов.
+        Если предыдущая запись в БД завершилась ошибкой, то сначала повторно
+            записывает оставшиеся от нее переходы.
+        Запись выполняется ровно один раз: id пачки переходов сохраняется
+            в click_flush_batch той же транзакцией, что и счетчики, и пачка,
+            которая уже есть в БД (коммит прошел, а удаление из Redis - нет),
+            только удаляется из Redis.
+    '''
+
+    redis = get_redis()
+    async with hold_flush_lock() as locked:
+        if not locked:
+            return 0
+
+        # Атомарный перенос накопленных переходов в отдельные ключи, новые переходы
+        # продолжают копиться в основных ключах
+        keys = (CLICKS_KEY, LAST_USED_KEY, FLUSHING_CLICKS_KEY, FLUSHING_LAST_USED_KEY, FLUSH_BATCH_KEY)
+        batch_id = await redis.eval(START_FLUSH_SCRIPT, len(keys), *keys, uuid4().hex)
+        if not batch_id:
+            return 0
+        batch_id = batch_id.decode()
+
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(FLUSHING_CLICKS_KEY)
+            pipe.hgetall(FLUSHING_LAST_USED_KEY)
+            clicks, last_used = await pipe.execute()
+
+        rows = []
+        for alias, quantity in clicks.items():
+            timestamp = last_used.get(alias)
+            last_used_at = datetime.fromtimestamp(float(timestamp)) if timestamp else None
+            rows.append((alias.decode(), int(quantity), last_used_at))
+
+        async with async_session_maker() as session:
+            now = datetime.now()
+            query = (insert(ClickFlushBatch).values(id=batch_id, applied_at=now)
+                     .on_conflict_do_nothing().returning(ClickFlushBatch.id))
+            if (await session.execute(query)).first() is None:
+                logger.warning('Пачка переходов %s уже записана в БД', batch_id)
+                rows = []
+            for i in range(0, len(rows), CLICK_FLUSH_BATCH_SIZE):
+                await session.execute(build_clicks_update_query(rows[i:i + CLICK_FLUSH_BATCH_SIZE]))
+            await session.execute(delete(ClickFlushBatch).filter(ClickFlushBatch.applied_at < now - FLUSH_BATCH_RETENTION))
+            await session.commit()
+
+        await redis.eval(FINISH_FLUSH_SCRIPT, 3, FLUSHING_CLICKS_KEY, FLUSHING_LAST_USED_KEY, FLUSH_BATCH_KEY,
+                         batch_id)
+
+        return len(rows)
+
+
+
+async def run_click_flusher() -> None:
+    '''
+        Функция run_click_flusher - раз в CLICK_FLUSH_INTERVAL секунд переносит
+            накопленные в Redis переходы по ссылкам в БД.
+    '''
+
+    while True:
+        await asyncio.sleep(CLICK_FLUSH_INTERVAL)
+        try:
+            await flush_clicks()
+        except Exception:
+            logger.exception('Не удалось записать переходы по ссылкам в БД')
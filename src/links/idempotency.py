@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+
+from redis.exceptions import RedisError
+
+from config import IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_LOCK_TTL
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+# Ключ с результатом запроса по заголовку Idempotency-Key: user_id и sha256 от значения заголовка.
+# Значение - JSON {"fingerprint": ..., "response": ...}, response равен null, пока запрос выполняется
+IDEMPOTENCY_KEY = 'tinyurl:idempotency:{}:{}'
+
+
+
+def get_idempotency_key(user_id: int, idempotency_key: str) -> str:
+    return IDEMPOTENCY_KEY.format(user_id, hashlib.sha256(idempotency_key.encode()).hexdigest())
+
+
+def get_request_fingerprint(params: dict) -> str:
+    '''
+        Функция get_request_fingerprint - возвращает хэш параметров запроса, по которому
+            повтор с тем же Idempotency-Key отличается от другого запроса с этим ключом.
+        Аргументы:
+            params (dict) - параметры запроса.
+    '''
+
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+
+async def begin_idempotent_request(user_id: int, idempotency_key: str, fingerprint: str) -> dict | None:
+    '''
+        Функция begin_idempotent_request - атомарно (SET NX) занимает Idempotency-Key
+            на IDEMPOTENCY_LOCK_TTL секунд. Возвращает None, если запрос нужно выполнить,
+            иначе сохраненную запись {"fingerprint": ..., "response": ...} предыдущего
+            запроса с этим ключом (response равен None, если он еще выполняется).
+            Если Redis недоступен, запрос выполняется без защиты от повторов.
+        Аргументы:
+            user_id (int) - идентификатор пользователя.
+            idempotency_key (str) - значение заголовка Idempotency-Key.
+            fingerprint (str) - хэш параметров запроса.
+    '''
+
+    key = get_idempotency_key(user_id, idempotency_key)
+    pending = json.dumps({'fingerprint': fingerprint, 'response': None})
+    try:
+        redis = get_redis()
+        if await redis.set(key, pending, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+            return None
+        record = await redis.get(key)
+    except RedisError:
+        logger.warning('Redis недоступен, запрос с Idempotency-Key выполняется без защиты от повторов')
+        return None
+
+    # Запись истекла между SET NX и GET - предыдущий запрос не завершился
+    if record is None:
+        return None
+
+    return json.loads(record)
+
+
+async def save_idempotent_response(user_id: int, idempotency_key: str, fingerprint: str,
+                                   response: dict) -> None:
+    '''
+        Функция save_idempotent_response - сохраняет ответ на запрос с Idempotency-Key
+            на IDEMPOTENCY_KEY_TTL секунд, повторы запроса получат этот же ответ.
+    '''
+
+    record = json.dumps({'fingerprint': fingerprint, 'response': response}, ensure_ascii=False)
+    try:
+        await get_redis().set(get_idempotency_key(user_id, idempotency_key), record, ex=IDEMPOTENCY_KEY_TTL)
+    except RedisError:
+        logger.warning('Redis недоступен, ответ на запрос с Idempotency-Key не сохранен')
+
+
+async def release_idempotency_key(user_id: int, idempotency_key: str) -> None:
+    '''
+        Функция release_idempotency_key - освобождает Idempotency-Key после ошибки
+            выполнения запроса, чтобы клиент мог его повторить.
+    '''
+
+    try:
+        await get_redis().delete(get_idempotency_key(user_id, idempotency_key))
+    except RedisError:
+        logger.warning('Redis недоступен, Idempotency-Key освободится по TTL')
@@ -1,10 +1,18 @@
 from typing import List
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import (Column, Integer, BigInteger, String, ForeignKey, DateTime, Date, Sequence, Index,
+                        Table, func)
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 
 from base import Base
 
 
+# Размер блока идентификаторов, который резервирует один вызов nextval
+ALIAS_BLOCK_SIZE = 1000
+
+# Последовательность, из которой генерируются алиасы коротких ссылок
+link_alias_seq = Sequence('link_alias_seq', start=1, increment=ALIAS_BLOCK_SIZE, metadata=Base.metadata)
+
+
 
 class Link(Base):
     __tablename__ = 'link'
@@ -17,5 +25,78 @@ class Link(Base):
     expires_at = Column(DateTime, unique=False, nullable=True)
     last_used_at = Column(DateTime, unique=False, nullable=True)
     transitions_quantity = Column(Integer, default=0, unique=False, nullable=False)
+    # sha256 от нормализованного source_url и expires_at, заполняется только
+    # для ссылок, созданных в идемпотентном режиме (deduplicate=True)
+    dedup_key = Column(String(64), unique=False, nullable=True)
+
+    user: Mapped["User"] = relationship(back_populates='link')
+
+
+# Индексы для поиска ссылок пользователя по исходному url и для выборки всех ссылок пользователя
+Index('ix_link_user_id_source_url_md5', Link.user_id, func.md5(Link.source_url))
+Index('ix_link_user_id_id', Link.user_id, Link.id)
+Index('ix_link_expires_at', Link.expires_at, postgresql_where=Link.expires_at.isnot(None))
+# Уникальный индекс для идемпотентного создания ссылок (user_id + хэш url и времени удаления)
+Index('ux_link_user_id_dedup_key', Link.user_id, Link.dedup_key, unique=True,
+      postgresql_where=Link.dedup_key.isnot(None))
+
+
+
+class ClickFlushBatch(Base):
+    '''
+        id пачек переходов, записанных из буфера в Redis в БД (links/clicks.py flush_clicks).
+    '''
+
+    __tablename__ = 'click_flush_batch'
+
+    id = Column(String(32), primary_key=True)
+    applied_at = Column(DateTime, nullable=False)
+
+
+
+# Сырые события переходов по ссылкам (только добавление), секционированы по месяцам.
+# Секции click_event_yYYYYmMM создаются обработчиком событий по мере необходимости
+click_event = Table(
+    'click_event', Base.metadata,
+    # id записи в потоке Redis, по которому повторно доставленное событие не учитывается дважды
+    Column('stream_id', String, nullable=True),
+    Column('alias', String, nullable=False),
+    Column('clicked_at', DateTime, nullable=False),
+    Column('referrer', String, nullable=True),
+    Column('user_agent', String, nullable=True),
+    postgresql_partition_by='RANGE (clicked_at)',
+)
+
+Index('ix_click_event_alias_clicked_at', click_event.c.alias, click_event.c.clicked_at)
+# Уникальный индекс секционированной таблицы должен включать ключ секционирования
+Index('ux_click_event_stream_id', click_event.c.stream_id, click_event.c.clicked_at, unique=True)
+
+
+
+class LinkClickRollup(Base):
+    '''
+        Количество переходов по ссылке за интервал (минута, час или день).
+    '''
+
+    __tablename__ = 'link_click_rollup'
+
+    alias = Column(String, primary_key=True)
+    granularity = Column(String(6), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    clicks = Column(BigInteger, default=0, nullable=False)
+
+
+
+class LinkClickBreakdown(Base):
+    '''
+        Количество переходов по ссылке за день в разрезе источника перехода
+            (dimension = referrer) или семейства браузеров (dimension = user_agent).
+    '''
+
+    __tablename__ = 'link_click_breakdown'
 
-    user: Mapped["User"] = relationship(back_populates='link')
\ No newline at end of file
+    alias = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    dimension = Column(String(10), primary_key=True)
+    value = Column(String, primary_key=True)
+    clicks = Column(BigInteger, default=0, nullable=False)
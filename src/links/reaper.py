@@ -0,0 +1,49 @@
+import logging
+import time
+from datetime import datetime
+
+from config import REAPER_BATCH_SIZE
+from database import async_session_maker
+from .analytics import build_delete_click_aggregates_queries
+from .cache import invalidate_alias, invalidate_search
+from .utils import build_expired_links_delete_query
+
+
+logger = logging.getLogger(__name__)
+
+
+
+async def delete_expired_links() -> int:
+    '''
+        Функция delete_expired_links - удаляет ссылки, у которых истекло время
+            существования, пачками по REAPER_BATCH_SIZE (каждая пачка в отдельной
+            сессии и транзакции, чтобы не держать соединение и блокировки между
+            пачками) вместе с их агрегатами переходов и убирает их из кэшей. Возвращает количество удаленных ссылок.
+            Асинхронный аналог задачи Celery links/tasks.py для MAINTENANCE_BACKEND=app.
+    '''
+
+    started = time.perf_counter()
+    deleted = 0
+    now = datetime.now()
+
+    while True:
+        async with async_session_maker() as session:
+            deleted_links = (await session.execute(build_expired_links_delete_query(now, REAPER_BATCH_SIZE))).all()
+            if deleted_links:
+                for query in build_delete_click_aggregates_queries([link.alias for link in deleted_links]):
+                    await session.execute(query)
+            await session.commit()
+
+        # Удаление данных об удаленных ссылках из кэшей и из обратного индекса поиска
+        await invalidate_alias(*[link.alias for link in deleted_links])
+        await invalidate_search(*[(link.user_id, link.source_url) for link in deleted_links])
+
+        deleted += len(deleted_links)
+        if len(deleted_links) < REAPER_BATCH_SIZE:
+            break
+
+    if deleted:
+        elapsed = time.perf_counter() - started
+        logger.info('%s expired links has been deleted in %.2fs (%.0f rows/sec).', deleted, elapsed, deleted / elapsed)
+
+    return deleted
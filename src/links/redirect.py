@@ -0,0 +1,88 @@
+from starlette.responses import JSONResponse, RedirectResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .bloom import is_alias_missing
+from .cache import alias_cache, UrlData, MISS
+from .clicks import record_click
+from .utils import get_url_data_by_alias, is_link_expired
+
+
+# Префикс пути редиректа и пути роутера /links, которые не являются алиасами
+REDIRECT_PATH_PREFIX = '/links/'
+# Шаблон пути редиректа, под которым запросы fast-path учитываются в метриках
+REDIRECT_ROUTE_PATH = '/links/{short_code}'
+RESERVED_PATHS = frozenset({'search', 'all_my_links', 'shorten'})
+
+
+
+async def resolve_alias(alias: str) -> UrlData | bool:
+    '''
+        Функция resolve_alias - возвращает данные о ссылке из in-process кэша,
+            а при промахе - из Redis / БД (соединение с БД берется только при промахе
+            обоих кэшей). Точно отсутствующие алиасы (см. is_alias_missing) не кэшируются,
+            чтобы перебор случайных кодов не вытеснял из кэша существующие ссылки.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+    '''
+
+    url = alias_cache.get(alias)
+    if url is MISS:
+        if await is_alias_missing(alias):
+            return False
+        url = await get_url_data_by_alias(alias)
+        alias_cache.set(alias, url)
+
+    return url
+
+
+
+class RedirectMiddleware:
+    '''
+        Класс RedirectMiddleware - ASGI middleware, которое обрабатывает
+            GET /links/{short_code} до роутинга FastAPI: без валидации параметров,
+            внедрения зависимостей и открытия сессии БД на каждый запрос.
+            Ответы совпадают с ответами эндпоинта redirect_on_full_link.
+        Аргументы:
+            app (ASGIApp) - следующее ASGI приложение.
+    '''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        alias = self.get_alias(scope)
+        if alias is None:
+            await self.app(scope, receive, send)
+            return None
+
+        scope['route_path'] = REDIRECT_ROUTE_PATH
+        url = await resolve_alias(alias)
+        if not url or is_link_expired(url):
+            response = JSONResponse({'detail': 'Переданный short_code не найден'}, status_code=404)
+        else:
+            headers = dict(scope['headers'])
+            referrer, user_agent = headers.get(b'referer'), headers.get(b'user-agent')
+            await record_click(alias, referrer=referrer.decode('latin-1') if referrer else None,
+                               user_agent=user_agent.decode('latin-1') if user_agent else None)
+            response = RedirectResponse(url.source_url)
+
+        await response(scope, receive, send)
+
+    @staticmethod
+    def get_alias(scope: Scope) -> str | None:
+        '''
+            Возвращает алиас, если запрос является редиректом по короткой ссылке, иначе None.
+        '''
+
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+
+        path = scope['path']
+        if not path.startswith(REDIRECT_PATH_PREFIX):
+            return None
+
+        alias = path[len(REDIRECT_PATH_PREFIX):]
+        if not alias or '/' in alias or alias in RESERVED_PATHS:
+            return None
+
+        return alias
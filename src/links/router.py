@@ -1,16 +1,27 @@
-import time
-from datetime import datetime
-from typing import Annotated
-from fastapi import APIRouter, Query, Path, Depends, Request, HTTPException, status
-from fastapi.responses import RedirectResponse
+from datetime import datetime, timedelta
+from typing import Annotated, Literal
+from fastapi import APIRouter, Query, Path, Header, Depends, Request, Response, HTTPException, status
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy import update, delete, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_cache.decorator import cache
 
-from config import HOST_URL_OR_DOMEN, HOST_PORT
-from database import get_async_session
-from .utils import get_random_link_alias, get_url_data_by_alias
-from .schemas import PostShortenLinkRequestBody, valid_url_regexp, UpdateShortLinkRequest
+from config import HOST_URL_OR_DOMEN, HOST_PORT, ALL_MY_LINKS_DEFAULT_LIMIT, ALL_MY_LINKS_MAX_LIMIT
+from config import CLICK_TIMESERIES_MAX_POINTS, URL_MAX_LENGTH, CLICK_FLUSH_LOCK_TTL
+from database import get_async_session, get_read_session, has_recent_write, mark_recent_write
+from .utils import (alias_allocator, get_url_data_by_alias, parse_expires_at, build_search_query,
+                    build_user_links_query, is_link_expired, get_dedup_key, build_deduplicated_insert_query,
+                    ALIAS_ALLOCATION_ATTEMPTS)
+from .bloom import publish_aliases
+from .cache import alias_cache, invalidate_alias, get_cached_search, set_cached_search, invalidate_search, MISS
+from .clicks import (record_click, get_unflushed_clicks, rename_clicks, hold_flush_lock,
+                     build_flush_batch_applied_clause)
+from .analytics import (get_click_timeseries, build_rename_click_aggregates_queries,
+                        build_delete_click_aggregates_queries, GRANULARITIES)
+from .idempotency import (get_request_fingerprint, begin_idempotent_request, save_idempotent_response,
+                          release_idempotency_key)
+from .bulk import bulk_shorten_links, stream_user_links, NDJSONStreamingResponse
+from .schemas import PostShortenLinkRequestBody, SourceUrl, UpdateShortLinkRequest
 from .models import Link
 from auth.models import User
 from auth.dependencies import coockie_scheme, credentials_exception
@@ -20,14 +31,93 @@ links_router = APIRouter(prefix='/links', tags=['links'])
 
 
 
+async def create_short_link(session: AsyncSession, user_id: int, link_params: dict) -> tuple[str, bool]:
+    '''
+        Функция create_short_link - сохраняет короткую ссылку в БД и возвращает ее алиас
+            и признак того, что ссылка создана. В идемпотентном режиме (deduplicate без
+            custom_alias) возвращает алиас существующей ссылки пользователя на тот же
+            нормализованный url с тем же временем удаления.
+        Аргументы:
+            session (AsyncSession) - сессия подключения к БД.
+            user_id (int) - идентификатор пользователя, создающего ссылку.
+            link_params (dict) - параметры ссылки из тела запроса.
+    '''
+
+    source_url = link_params.get('source_url')
+
+    # Парсинг времени удаления ссылки
+    expires_at = parse_expires_at(link_params.get('expires_at'))
+
+    # Проверка, передан ли кастомный алиас для короткой ссылки
+    custom_alias = link_params.get('custom_alias')
+    if not custom_alias:
+        # Выдача нового алиаса из зарезервированного блока, проверка
+        # существования не нужна, так как сгенерированные алиасы не повторяются
+        alias = await alias_allocator.allocate(session)
+    else:
+        alias = custom_alias
+        url = await get_url_data_by_alias(alias, session)
+        # Если переданный алиас уже существует, то возвращает ошибку 409
+        if url:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail='Переданный custom_alias уже существует')
+
+    dedup_key = None
+    if link_params.get('deduplicate') and not custom_alias:
+        dedup_key = get_dedup_key(source_url, expires_at)
+
+    # Установка значений дополнительных данных о ссылке
+    values = {'user_id': user_id, 'source_url': source_url, 'created_at': datetime.now(),
+              'expires_at': expires_at, 'last_used_at': None, 'transitions_quantity': 0,
+              'dedup_key': dedup_key}
+
+    # Сохранение записи о ссылке в БД. Сгенерированный алиас может совпасть только
+    # с ранее созданным кастомным алиасом, в этом случае берется следующий алиас
+    for attempt in range(ALIAS_ALLOCATION_ATTEMPTS):
+        row = None
+        try:
+            if dedup_key:
+                # Вставка или выборка существующей ссылки одним запросом
+                row = (await session.execute(build_deduplicated_insert_query({**values, 'alias': alias}))).first()
+            else:
+                session.add(Link(**values, alias=alias))
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            if custom_alias:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail='Переданный custom_alias уже существует')
+            if attempt == ALIAS_ALLOCATION_ATTEMPTS - 1:
+                raise
+            alias = await alias_allocator.allocate(session)
+            continue
+
+        if not dedup_key:
+            return alias, True
+        if row is not None:
+            return row.alias, row.created
+        # Ссылка с тем же dedup_key создана параллельным запросом после начала
+        # нашего запроса и не видна в его снимке, повтор увидит ее
+
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                        detail='Ссылка на этот url создается параллельным запросом, повторите запрос')
+
+
+
 @links_router.post('/shorten')
-async def post_shorten_link(request: Request, link_params: PostShortenLinkRequestBody, 
+async def post_shorten_link(request: Request, response: Response, link_params: PostShortenLinkRequestBody,
+                            idempotency_key: Annotated[str | None, Header(
+                                description='Ключ для безопасного повтора запроса', max_length=255)] = None,
                             session: AsyncSession = Depends(get_async_session)) -> dict[str, str]:
     '''
         Создает кастомную короткую ссылку если передан параметр alias.
         Если ничего не передано, то генерирует alias автоматически и создает короткую ссылку.
         Если создается с параметром expires_at в формате даты с точностью до минуты, 
             то после указанного времени короткая ссылка автоматически удаляется.
+        С параметром deduplicate возвращает существующую ссылку пользователя
+            на тот же url с тем же expires_at вместо создания новой.
+        Повтор запроса с тем же заголовком Idempotency-Key в течение IDEMPOTENCY_KEY_TTL
+            секунд возвращает ответ первого запроса без создания новой ссылки.
     '''
 
     # Получение JWT токена и проверка, авторизован ли пользователь
@@ -40,60 +130,82 @@ async def post_shorten_link(request: Request, link_params: PostShortenLinkReques
 
     # Распаковка тела запроса
     link_params = link_params.dict()
-    source_url = link_params.get('source_url')
-    
-    # Проверка, передан ли кастомный алиас для короткой ссылки
-    if not link_params.get('custom_alias'):
-        # Генерация случайной короткой ссылки длиной в 6 символов
-        alias = get_random_link_alias()
-        # Если был сгененрирован уже существующий алиас, 
-        # то генерирует новый алиас длиной 7 символов
-        url = await get_url_data_by_alias(alias, session)
-        if url:
-            alias = get_random_link_alias(7)
-    else:
-        alias = link_params.get('custom_alias')
-        url = await get_url_data_by_alias(alias, session)
-        # Если переданный алиас уже существует, то возвращает ошибку 409
-        if url:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail='Переданный custom_alias уже существует')
 
-    # Парсинг времени удаления ссылки
-    expires_at = link_params.get('expires_at')
-    if expires_at:
-        expires_at = time.strptime(expires_at, '%d.%m.%Y %H:%M')
-        expires_at = time.mktime(expires_at)
-        expires_at = datetime.fromtimestamp(expires_at)
+    # Повтор запроса с тем же Idempotency-Key получает сохраненный ответ
+    if idempotency_key:
+        fingerprint = get_request_fingerprint(link_params)
+        record = await begin_idempotent_request(user_id, idempotency_key, fingerprint)
+        if record is not None:
+            if record.get('fingerprint') != fingerprint:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail='Idempotency-Key уже использован с другими параметрами запроса')
+            if record.get('response') is None:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail='Запрос с этим Idempotency-Key еще выполняется')
+            return record.get('response')
+
+    try:
+        alias, created = await create_short_link(session, user_id, link_params)
+    except BaseException:
+        if idempotency_key:
+            await release_idempotency_key(user_id, idempotency_key)
+        raise
+
+    if created:
+        # Добавление алиаса в фильтры алиасов воркеров, сброс закэшированного при проверке
+        # существования алиаса отрицательного результата и результатов поиска ссылок
+        # пользователя на этот url
+        await publish_aliases(alias)
+        await invalidate_alias(alias)
+        await invalidate_search((user_id, link_params.get('source_url')))
+        # Следующие чтения пользователя идут в primary, пока реплики не догонят запись
+        mark_recent_write(response)
+
+    result = {'message': 'Короткая ссылка успешно создана.' if created else 'Короткая ссылка уже существует.',
+              'short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{alias}'}
+    if idempotency_key:
+        await save_idempotent_response(user_id, idempotency_key, fingerprint, result)
+
+    return result
+
+
+
+@links_router.post('/shorten/bulk', response_class=NDJSONStreamingResponse)
+async def post_shorten_links_bulk(request: Request,
+                                  session: AsyncSession = Depends(get_async_session)) -> NDJSONStreamingResponse:
+    '''
+        Массово создает короткие ссылки. Принимает JSON массив или NDJSON поток
+            объектов в формате тела запроса /links/shorten, сохраняет их пачками
+            и потоково возвращает результат по каждому элементу в формате NDJSON
+            ({"index": ..., "short_link": ...} или {"index": ..., "error": ...}).
+    '''
 
-    # Установка значений дополнительных данных о ссылке
-    created_at = datetime.now()
-    last_used_at = None
-    transitions_quantity = 0
-
-    # Сохранение записи о ссылке в БД
-    new_link = Link(user_id=user_id, alias=alias, source_url=source_url,
-                    created_at=created_at, expires_at=expires_at,
-                    last_used_at=last_used_at, 
-                    transitions_quantity=transitions_quantity)
-    session.add(new_link)
-    await session.commit()
+    # Получение JWT токена и проверка, авторизован ли пользователь (один раз на весь поток)
+    token = request.cookies.get('tinyurl_access_token')
+    user = await get_current_user(User, token, session)
+    if user:
+        user_id = user.get('id')
+    else:
+        user_id = 1    # Идентификатор для неавторизованного пользователя
 
-    return {'message': 'Короткая ссылка успешно создана.', 
-            'short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{alias}'} 
+    response = NDJSONStreamingResponse(bulk_shorten_links(request.stream(), user_id))
+    mark_recent_write(response)
+
+    return response
 
 
 
 @links_router.get('/search')
-@cache(expire=60)
-async def get_short_link_by_original_url(original_url: Annotated[str, Query(regexp=valid_url_regexp)], 
+async def get_short_link_by_original_url(original_url: Annotated[SourceUrl, Query(max_length=URL_MAX_LENGTH)], 
                                          request: Request, 
-                                         session: AsyncSession = Depends(get_async_session)) -> dict[str, str]:
+                                         session: AsyncSession = Depends(get_read_session)) -> dict[str, str]:
     '''
         Возвращает короткую ссылку, привязанную к переданному оригинальному url.
         Авторизованный пользователь получит данные только о своих ссылках.
         Неавторизованный пользователь получит данные только о тех ссылках,
             которые были созданы неавторизованными пользователями.
+        Результаты кэшируются в обратном индексе в Redis по (user_id, original_url)
+            и сбрасываются при создании, изменении и удалении ссылок.
     '''
 
     # Получение JWT токена и проверка, авторизован ли пользователь
@@ -104,18 +216,22 @@ async def get_short_link_by_original_url(original_url: Annotated[str, Query(rege
     else:
         user_id = 1    # Идентификатор для неавторизованного пользователя
 
-    # Получение данных о ссылке из БД
-    query = select(Link).filter((Link.source_url == original_url) & (Link.user_id == user_id))
-    result = await session.execute(query)
-    result = result.scalars().all()
+    # Получение алиасов ссылок из обратного индекса в Redis, а при промахе -
+    # из БД (по индексу user_id + md5(source_url)) с сохранением в индекс
+    aliases = await get_cached_search(user_id, original_url)
+    if aliases is MISS:
+        query = build_search_query(user_id, original_url)
+        result = await session.execute(query)
+        aliases = [link_data.alias for link_data in result.all()]
+        await set_cached_search(user_id, original_url, aliases)
 
     # Если данные о ссылке не найдены, вернется ошибка
-    if len(result) == 0:
+    if len(aliases) == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Для переданного original_url не найдены короткие ссылки.')
 
     # Список коротких ссылок, привязанных к переданному алиасу
-    result = [f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{link_data.alias}' for link_data in result]
+    result = [f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{alias}' for alias in aliases]
 
     return {'message': f'Найдено {len(result)} котортких ссылок для {original_url}',
             'shotr_codes_list': result}
@@ -129,25 +245,81 @@ async def get_short_link_statistics(short_code: Annotated[str, Path(description=
         Отображает оригинальный URL, возвращает дату создания, количество переходов, дату последнего использования.
     '''
 
-    # Получение данных о ссылке, если данные не найдены, то вернет ошику
-    url = await get_url_data_by_alias(short_code, session)
+    # Переходы, которые еще не записаны из буфера в БД (читаются до запроса в БД, чтобы
+    # пачка, которая записывается в этот момент, не учлась дважды или не потерялась)
+    unflushed = await get_unflushed_clicks(short_code)
+
+    # Получение данных о ссылке напрямую из primary (в кэше счетчики могут быть устаревшими,
+    # а реплика может еще не получить пачку, которая уже удалена из буфера),
+    # если данные не найдены, то вернет ошику
+    query = select(Link.source_url, Link.created_at, Link.transitions_quantity, Link.last_used_at,
+                   build_flush_batch_applied_clause(unflushed.batch_id).label('batch_applied')
+                   ).filter(Link.alias == short_code)
+    result = await session.execute(query)
+    url = result.first()
     if not url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Переданный short_code не найден')
 
+    # Добавление переходов, которые еще не записаны из буфера в БД
+    unflushed_clicks, unflushed_last_used_at = unflushed.get_delta(url.batch_applied)
+    transitions_quantity = url.transitions_quantity + unflushed_clicks
+    last_used_at = max(filter(None, (url.last_used_at, unflushed_last_used_at)), default=None)
+
     return {'message': f'Найдены следующие статистики по короткой ссылке {HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{short_code}',
-            'original_url': url.get('source_url'), 'created_at': url.get('created_at'),
-            'transitions_quantity': url.get('transitions_quantity'),
-            'last_used_at': url.get('last_used_at')}
+            'original_url': url.source_url, 'created_at': url.created_at,
+            'transitions_quantity': transitions_quantity,
+            'last_used_at': last_used_at}
+
+
+
+@links_router.get('/{short_code}/stats/timeseries')
+async def get_short_link_timeseries(short_code: Annotated[str, Path(description='Алиас короткой ссылки')],
+                                    granularity: Annotated[Literal['minute', 'hour', 'day'],
+                                                           Query(description='Интервал агрегации')] = 'hour',
+                                    start: Annotated[datetime | None, Query(description='Начало периода')] = None,
+                                    end: Annotated[datetime | None, Query(description='Конец периода')] = None,
+                                    session: AsyncSession = Depends(get_read_session)):
+    '''
+        Возвращает количество переходов по короткой ссылке по минутам, часам или дням,
+            а также топ источников переходов (referrer) и браузеров за период.
+            По умолчанию период - последние сутки. Данные читаются из агрегатов,
+            которые обновляются с задержкой в несколько секунд.
+    '''
+
+    # Даты в БД хранятся без часового пояса (локальное время сервера)
+    start, end = [moment.astimezone().replace(tzinfo=None) if moment and moment.tzinfo else moment
+                  for moment in (start, end)]
+
+    # Определение периода и проверка количества интервалов в нем
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='start должен быть раньше end')
+    if (end - start) / GRANULARITIES[granularity] > CLICK_TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'Период содержит больше {CLICK_TIMESERIES_MAX_POINTS} интервалов, '
+                                   'увеличьте granularity или сократите период')
+
+    return await get_click_timeseries(session, short_code, granularity, start, end)
 
 
 
 @links_router.get('/all_my_links')
-async def get_all_my_links(token: str = Depends(coockie_scheme), 
-                           session: AsyncSession = Depends(get_async_session)):
+async def get_all_my_links(request: Request,
+                           limit: Annotated[int, Query(ge=1, le=ALL_MY_LINKS_MAX_LIMIT,
+                                                       description='Количество ссылок на странице')] = ALL_MY_LINKS_DEFAULT_LIMIT,
+                           cursor: Annotated[int | None, Query(description='next_cursor с предыдущей страницы')] = None,
+                           stream: Annotated[bool, Query(description='Вернуть все ссылки потоком NDJSON')] = False,
+                           token: str = Depends(coockie_scheme), 
+                           session: AsyncSession = Depends(get_read_session)):
     '''
-        Возвращает словарь со всеми короткими ссылками, которые создал пользователь
-            в формате {short_code: original_url}.
+        Возвращает словарь с короткими ссылками, которые создал пользователь
+            в формате {short_code: original_url}, постранично (keyset пагинация по id).
+            Для получения следующей страницы нужно передать next_cursor из ответа в cursor.
+        Если передан stream=true, то возвращает все ссылки (начиная с cursor) потоком NDJSON
+            без загрузки их в память целиком.
         Эндпоинт доступен только залогиненным пользователям.
     '''
 
@@ -156,51 +328,66 @@ async def get_all_my_links(token: str = Depends(coockie_scheme),
     if not user:
         raise credentials_exception
 
-    # Получение данных о коротких ссылках, созданных пользователем
-    query = select(Link).filter(Link.user_id == user.get('id'))
+    # Потоковая выдача всех ссылок пользователя через серверный курсор
+    if stream:
+        query = build_user_links_query(user.get('id'), cursor=cursor)
+        return StreamingResponse(stream_user_links(query, use_primary=has_recent_write(request)),
+                                 media_type='application/x-ndjson')
+
+    # Получение страницы алиасов и исходных url ссылок, созданных пользователем
+    query = build_user_links_query(user.get('id'), cursor=cursor, limit=limit)
     result = await session.execute(query)
-    result = result.scalars().all()
+    result = result.all()
 
     # Если ни одной ссылки не найдено, вернет ошибку
-    if len(result) == 0:
+    if len(result) == 0 and cursor is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Для переданного original_url не найдены короткие ссылки.')
 
-    # Сборка словаря со всеми ссылками пользователя в формате {short_code: original_url}
+    # Курсор следующей страницы, если текущая страница заполнена целиком
+    next_cursor = result[-1].id if len(result) == limit else None
+
+    # Сборка словаря со ссылками пользователя в формате {short_code: original_url}
     result = {f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{link_data.alias}': 
                 link_data.source_url for link_data in result}
 
     return {'message': 'Найдены следующие короткие ссылки',
-            'links_dict': result}
+            'links_dict': result, 'next_cursor': next_cursor}
 
 
 
 @links_router.get('/{short_code}')
 async def redirect_on_full_link(short_code: Annotated[str, Path(description='Алиас короткой ссылки')],
+                                request: Request,
                                 session: AsyncSession = Depends(get_async_session)):
     '''
         Перенаправляет на оригинальный URL, который привязан к короткой ссылке.
+        При REDIRECT_FAST_PATH=True такие запросы обрабатывает RedirectMiddleware
+            (links/redirect.py) до роутинга, а этот эндпоинт остается для документации.
     '''
 
-    # Получение данных о ссылке, если ссылка не найдена, то вернет ошибку
-    url = await get_url_data_by_alias(short_code, session)
-    if not url:
+    # Получение данных о ссылке из in-process кэша, а при промахе - из Redis / БД
+    url = alias_cache.get(short_code)
+    if url is MISS:
+        url = await get_url_data_by_alias(short_code, session)
+        alias_cache.set(short_code, url)
+
+    # Если ссылка не найдена или время ее существования истекло, то вернет ошибку
+    if not url or is_link_expired(url):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='Переданный short_code не найден')
 
-    # Увеличение счетчика переходов по короткой ссылке на 1
-    transitions_quantity = url.get('transitions_quantity') + 1
-    query = update(Link).filter(Link.alias == short_code).values(last_used_at=datetime.now(),
-                                                                 transitions_quantity=transitions_quantity)
-    await session.execute(query)
-    await session.commit()
+    # Учет перехода в буфере, который периодически записывается в БД
+    await record_click(short_code, session, referrer=request.headers.get('referer'),
+                       user_agent=request.headers.get('user-agent'))
 
-    return RedirectResponse(url.get('source_url'))
+    return RedirectResponse(url.source_url)
 
 
 
 @links_router.delete('/{short_code}')
 async def delete_short_link(short_code: Annotated[str, Path(description='Алиас короткой ссылки')],
+                            response: Response,
                             token: str = Depends(coockie_scheme),
                             session: AsyncSession = Depends(get_async_session)) -> dict[str, str]:
     '''
@@ -214,11 +401,20 @@ async def delete_short_link(short_code: Annotated[str, Path(description='Али
     if not user:
         raise credentials_exception
 
-    # Удаление ссылки
-    query = delete(Link).filter((Link.alias == short_code) & (Link.user_id == user.get('id')))
-    await session.execute(query)
+    # Удаление ссылки и ее агрегатов переходов одной транзакцией
+    query = (delete(Link).filter((Link.alias == short_code) & (Link.user_id == user.get('id')))
+             .returning(Link.source_url))
+    deleted_urls = (await session.execute(query)).scalars().all()
+    if deleted_urls:
+        for delete_query in build_delete_click_aggregates_queries([short_code]):
+            await session.execute(delete_query)
     await session.commit()
 
+    # Удаление данных о ссылке из кэшей
+    await invalidate_alias(short_code)
+    await invalidate_search(*[(user.get('id'), source_url) for source_url in deleted_urls])
+    mark_recent_write(response)
+
     return {'message': f'Ссылка {HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{short_code} удалена'}
 
 
@@ -226,6 +422,7 @@ async def delete_short_link(short_code: Annotated[str, Path(description='Али
 @links_router.put('/{short_code}')
 async def update_short_link(short_code: Annotated[str, Path(description='Алиас короткой ссылки')],
                             link_params: UpdateShortLinkRequest,
+                            response: Response,
                             token: str = Depends(coockie_scheme),
                             session: AsyncSession = Depends(get_async_session)):
     '''
@@ -240,25 +437,23 @@ async def update_short_link(short_code: Annotated[str, Path(description='Али
     url = await get_url_data_by_alias(short_code, session)
 
     # Проверка, что ссылка существует и принадлежит текущему пользователю
-    if url.get('user_id') != user.get('id'):
+    if not url or url.user_id != user.get('id'):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail='Указанный short_code принадлежит \
                                 другому пользователю или не существует')
 
+    source_url = url.source_url
+
     # Распаковка тела запроса
     link_params = link_params.dict()
 
     # Проверка, передан ли кастомный алиас для короткой ссылки
-    new_alias = link_params.get('new_alias')
-    if not new_alias:
-        # Генерация случайной короткой ссылки длиной в 6 символов
-        new_alias = get_random_link_alias()
-        # Если был сгененрирован уже существующий алиас, 
-        # то генерирует новый алиас длиной 7 символов
-        url = await get_url_data_by_alias(new_alias, session)
-        if url:
-            new_alias = get_random_link_alias(7)
+    custom_alias = link_params.get('new_alias')
+    if not custom_alias:
+        # Выдача нового алиаса из зарезервированного блока
+        new_alias = await alias_allocator.allocate(session)
     else:
+        new_alias = custom_alias
         url = await get_url_data_by_alias(new_alias, session)
         # Если переданный алиас уже существует, то возвращает ошибку 409
         if url:
@@ -266,17 +461,48 @@ async def update_short_link(short_code: Annotated[str, Path(description='Али
                                 detail='Переданный new_alias уже существует')
 
     # Парсинг времени протухания ссылки
-    expires_at = link_params.get('expires_at')
-    if expires_at:
-        expires_at = time.strptime(expires_at, '%d.%m.%Y %H:%M')
-        expires_at = time.mktime(expires_at)
-        expires_at = datetime.fromtimestamp(expires_at)
+    expires_at = parse_expires_at(link_params.get('expires_at'))
+
+    # Обновление записи о ссылке в БД, при совпадении сгенерированного алиаса
+    # с кастомным берется следующий алиас. Запись переходов в БД на это время
+    # останавливается, чтобы перенести на новый алиас и переходы, которые она записывает
+    async with hold_flush_lock(wait=CLICK_FLUSH_LOCK_TTL):
+        for attempt in range(ALIAS_ALLOCATION_ATTEMPTS):
+            # Ключ дедупликации включает expires_at, поэтому после изменения
+            # ссылка больше не считается дубликатом при идемпотентном создании
+            query = update(Link).filter(Link.alias == short_code).values(alias=new_alias,
+                                                                         expires_at=expires_at,
+                                                                         dedup_key=None)
+            try:
+                await session.execute(query)
+                # Перенос агрегатов переходов на новый алиас в той же транзакции (агрегаты,
+                # оставшиеся под свободным до этого алиасом, удаляются, чтобы не было конфликта ключей)
+                for rename_query in [*build_delete_click_aggregates_queries([new_alias]),
+                                     *build_rename_click_aggregates_queries(short_code, new_alias)]:
+                    await session.execute(rename_query)
+                await session.commit()
+                break
+            except IntegrityError:
+                await session.rollback()
+                if custom_alias:
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                        detail='Переданный new_alias уже существует')
+                if attempt == ALIAS_ALLOCATION_ATTEMPTS - 1:
+                    raise
+                new_alias = await alias_allocator.allocate(session)
+
+        await rename_clicks(short_code, new_alias)
+
+    # Добавление нового алиаса в фильтры алиасов воркеров, удаление из кэшей данных
+    # о старом алиасе, отрицательного результата для нового и результатов поиска,
+    # в которых был старый алиас
+    await publish_aliases(new_alias)
+    await invalidate_alias(short_code, new_alias)
+    await invalidate_search((user.get('id'), source_url))
+
+    # Следующие чтения пользователя идут в primary, пока реплики не догонят запись
+    mark_recent_write(response)
 
-    query = update(Link).filter(Link.alias == short_code).values(alias=new_alias,
-                                                                 expires_at=expires_at)
-
-    await session.execute(query)
-    await session.commit()
     return {'message': f'Ссылка изменена',
             'old_short_link' : f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{short_code}',
             'new_short_link': f'{HOST_URL_OR_DOMEN}:{HOST_PORT}/links/{new_alias}'}
@@ -1,28 +1,29 @@
-import re
-from datetime import datetime
-from pydantic import BaseModel, Field
+from typing import Annotated
+from pydantic import AfterValidator, BaseModel, Field
 
+from config import URL_MAX_LENGTH
+from .urls import normalize_url
 
-# Регулярка для валидации исходных ссылок 
-valid_url_regexp = re.compile(
-        r'^(?:http|ftp)s?://' # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
-        r'localhost|' #localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
-        r'(?::\d+)?' # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+# Исходный url, который валидируется и приводится к канонической форме
+SourceUrl = Annotated[str, AfterValidator(normalize_url)]
 
 
 class PostShortenLinkRequestBody(BaseModel):
-    source_url: str = Field(pattern=valid_url_regexp, 
-                             description='url, к которому будет привязана короткая ссылка', 
-                             examples=['https://pikabu.ru',])
+    source_url: SourceUrl = Field(max_length=URL_MAX_LENGTH,
+                                  description='url, к которому будет привязана короткая ссылка',
+                                  examples=['https://pikabu.ru',])
     custom_alias: str | None = Field(default=None, 
                                      description='Кастомный алиас для короткой ссылки',
                                      examples=['pika',])
     expires_at: str | None = Field(pattern=r'(\d{2}).(\d{2}).(\d{4}) (\d{2}):(\d{2})', default=None, 
                                    description='Дата и время удаления короткой ссылки', 
                                    examples=['12.06.2025 04:20',])
+    deduplicate: bool = Field(default=False,
+                              description='Вернуть существующую ссылку пользователя на тот же url '
+                                          'с тем же expires_at вместо создания новой '
+                                          '(не действует вместе с custom_alias)',
+                              examples=[True,])
 
 
 
@@ -34,13 +35,3 @@ class UpdateShortLinkRequest(BaseModel):
                                    description='Дата и время удаления короткой ссылки',
                                    examples=['10.04.2025 12:30']) 
 
-
-
-class UrlData(BaseModel):
-    user_id: int
-    alias: str
-    source_url: str
-    created_at: datetime
-    expires_at: datetime | None = None
-    last_used_at: datetime | None = None
-    transitions_quantity: int  = 0
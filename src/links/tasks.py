@@ -1,54 +1,90 @@
+import logging
+import time
 from datetime import datetime
 
 from celery import Celery
-from sqlalchemy import select, delete
+import orjson
+from redis.exceptions import RedisError
 
-from database import get_session
+from broadcast import WORKER_EVENTS_CHANNEL
+from config import REAPER_BATCH_SIZE, REAPER_INTERVAL, MAINTENANCE_BACKEND
+from database import session_maker
+from redis_client import create_sync_redis, get_celery_broker_url, get_celery_broker_transport_options
 from auth.models import User    # Импорт необходим для правильной инициализации схемы данных sqlalchemy
-from .models import Link
+from .cache import get_alias_cache_key, get_search_cache_key
+from .analytics import build_delete_click_aggregates_queries
+from .utils import build_expired_links_delete_query
 
 
-celery = Celery('tasks', broker=f"redis://:@redis:5370/1",
+logger = logging.getLogger(__name__)
+
+celery = Celery('tasks', broker=get_celery_broker_url(),
+                broker_transport_options=get_celery_broker_transport_options(),
                 broker_connection_retry_on_startup = True)
 
+# Клиент Redis, в котором лежит кэш алиасов (fastapi_cache)
+cache_redis = create_sync_redis()
+
 # celery.autodiscover_tasks()
 
 
 @celery.task(name='tasks.delete_expired_links', default_retry_delay=10, max_retries=3)
 def delete_expired_links():
     '''
-        Функция delete_expired_links раз в 1 минуту проходится по БД
+        Функция delete_expired_links раз в REAPER_INTERVAL секунд проходится по БД
             и удаляет сслыки, у которых истекло время существования.
+        Ссылки удаляются пачками по REAPER_BATCH_SIZE запросом build_expired_links_delete_query,
+            каждая пачка в отдельной транзакции, чтобы не держать долгие блокировки.
+            Удаленные алиасы убираются из кэша.
+        При MAINTENANCE_BACKEND=app то же самое делает links/reaper.py в планировщике API.
     '''
 
-    # Получение сессии соединения с БД
-    session = get_session()
+    started = time.perf_counter()
+    deleted = 0
+    now = datetime.now()
+
+    with session_maker() as session:
+        while True:
+            # Удаление пачки ссылок с истекшим временем существования и их агрегатов переходов
+            deleted_links = session.execute(build_expired_links_delete_query(now, REAPER_BATCH_SIZE)).all()
+            if deleted_links:
+                for query in build_delete_click_aggregates_queries([link.alias for link in deleted_links]):
+                    session.execute(query)
+            session.commit()
 
-    # Получение из БД данных о ссылках с истекшим временем существования
-    query = select(Link).filter(Link.expires_at <= datetime.now())
-    result = session.execute(query)
-    result = result.scalars().all()
+            # Удаление данных об удаленных ссылках из кэша и из обратного индекса поиска
+            if deleted_links:
+                try:
+                    with cache_redis.pipeline(transaction=False) as pipe:
+                        for link in deleted_links:
+                            pipe.delete(get_alias_cache_key(link.alias))
+                            pipe.hdel(get_search_cache_key(link.source_url), link.user_id)
+                        # Удаление алиасов из in-process кэшей воркеров API (links/cache.py invalidate_alias)
+                        pipe.publish(WORKER_EVENTS_CHANNEL,
+                                     orjson.dumps(['invalidate_aliases', *[link.alias for link in deleted_links]]))
+                        pipe.execute()
+                except RedisError:
+                    logger.warning('Redis недоступен, записи об удаленных ссылках истекут в кэше по TTL')
 
-    links_to_delete = []
-    if result:
-        # Получение списка id ссылок для удаления
-        for link in result:
-            links_to_delete.append(link.id)
+            deleted += len(deleted_links)
+            if len(deleted_links) < REAPER_BATCH_SIZE:
+                break
 
-        # Удаление ссылок, у которых истекло время существования
-        query = delete(Link).filter(Link.id.in_(links_to_delete))
-        session.execute(query)
-        session.commit()
+    elapsed = time.perf_counter() - started
+    if not deleted:
+        return 'No links to delete'
 
-        return f'Links with id {links_to_delete} has been deleted.'
+    message = f'{deleted} expired links has been deleted in {elapsed:.2f}s ({deleted / elapsed:.0f} rows/sec).'
+    logger.info(message)
 
-    return 'No links to delete'
+    return message
 
 
-# Регистрация таски в расписании
-celery.conf.beat_schedule = {
-    'delete-expired-links-every-minute': {
-        'task': "tasks.delete_expired_links",
-        "schedule": 60.0
-    },
-}
+# Регистрация таски в расписании (при MAINTENANCE_BACKEND=app задачи выполняет планировщик API)
+if MAINTENANCE_BACKEND == 'celery':
+    celery.conf.beat_schedule = {
+        'delete-expired-links-every-minute': {
+            'task': "tasks.delete_expired_links",
+            "schedule": REAPER_INTERVAL
+        },
+    }
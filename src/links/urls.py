@@ -0,0 +1,100 @@
+import ipaddress
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+from config import URL_MAX_LENGTH
+
+
+# Допустимые схемы исходных ссылок и их порты по умолчанию (отбрасываются при нормализации)
+URL_ALLOWED_SCHEMES = frozenset({'http', 'https', 'ftp', 'ftps'})
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21, 'ftps': 990}
+
+# Регулярки без вложенных квантификаторов, проверяются за линейное время:
+# пробельные и управляющие символы, метка домена (до 63 символов) после IDNA
+FORBIDDEN_CHARS_REGEXP = re.compile(r'[\x00-\x20\x7f]')
+HOST_LABEL_REGEXP = re.compile(r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?')
+HOST_MAX_LENGTH = 253
+
+
+
+class InvalidUrlError(ValueError):
+    '''
+        Ошибка валидации исходного url.
+    '''
+
+
+
+def normalize_host(host: str) -> str:
+    '''
+        Функция normalize_host - проверяет хост и возвращает его каноническую запись:
+            IP адрес, localhost или домен в нижнем регистре (интернационализированные
+            домены переводятся в punycode).
+        Аргументы:
+            host (str) - хост из url без порта и userinfo.
+    '''
+
+    host = host.rstrip('.')
+    # Запись в punycode не короче исходной, поэтому длинный хост отбрасывается до IDNA
+    if len(host) > HOST_MAX_LENGTH:
+        raise InvalidUrlError('Некорректный домен в url')
+
+    if ':' in host or host[-1:].isdigit():
+        try:
+            address = ipaddress.ip_address(host)
+            return f'[{address.compressed}]' if address.version == 6 else address.compressed
+        except ValueError:
+            pass
+
+    try:
+        host = host.encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        raise InvalidUrlError('Некорректный домен в url')
+
+    if host == 'localhost':
+        return host
+
+    labels = host.split('.')
+    if (len(host) > HOST_MAX_LENGTH or len(labels) < 2 or labels[-1].isdigit()
+            or not all(HOST_LABEL_REGEXP.fullmatch(label) for label in labels)):
+        raise InvalidUrlError('Некорректный домен в url')
+
+    return host
+
+
+def normalize_url(url: str) -> str:
+    '''
+        Функция normalize_url - валидирует исходный url за линейное от его длины время
+            и возвращает его каноническую форму: схема и хост в нижнем регистре,
+            домен в punycode, без порта по умолчанию. Путь, параметры и фрагмент
+            не изменяются. Каноническая форма сохраняется в БД и используется
+            в ключах дедупликации и кэша поиска.
+        Аргументы:
+            url (str) - исходный url.
+    '''
+
+    url = url.strip()
+    if len(url) > URL_MAX_LENGTH:
+        raise InvalidUrlError(f'url длиннее {URL_MAX_LENGTH} символов')
+    if FORBIDDEN_CHARS_REGEXP.search(url):
+        raise InvalidUrlError('url содержит пробельные или управляющие символы')
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        raise InvalidUrlError('Некорректный url')
+
+    scheme = parts.scheme.lower()
+    if scheme not in URL_ALLOWED_SCHEMES:
+        raise InvalidUrlError(f'Схема url должна быть одной из: {", ".join(sorted(URL_ALLOWED_SCHEMES))}')
+    if not parts.hostname:
+        raise InvalidUrlError('В url не указан хост')
+
+    netloc = normalize_host(parts.hostname)
+    if port is not None and DEFAULT_PORTS[scheme] != port:
+        netloc = f'{netloc}:{port}'
+    userinfo, separator, _ = parts.netloc.rpartition('@')
+    if separator:
+        netloc = f'{userinfo}@{netloc}'
+
+    return urlunsplit((scheme, netloc, parts.path, parts.query, parts.fragment))
@@ -1,46 +1,330 @@
-import re
-import uuid
-from sqlalchemy import select
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import select, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_cache.decorator import cache
 
-from .models import Link
-from .schemas import UrlData
+from database import read_connection, replica_pool
+from .bloom import is_alias_missing
+from .models import Link, link_alias_seq, ALIAS_BLOCK_SIZE
+from .cache import (get_cached_url_data, set_cached_url_data, acquire_alias_refresh_lock, alias_lookups,
+                    UrlData, MISS)
 
 
+logger = logging.getLogger(__name__)
 
-def get_random_link_alias(short_code_lenght: int = 6):
+
+# Алфавит и длина генерируемых алиасов (62^7 ~ 3.5 трлн уникальных кодов)
+BASE62_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ALIAS_LENGTH = 7
+ALIAS_SPACE = 62 ** ALIAS_LENGTH
+
+# Параметры биекции id -> код, чтобы соседние алиасы не шли подряд.
+# Множитель взаимно прост с 62, поэтому разные id всегда дают разные коды
+ALIAS_MULTIPLIER = 2_654_435_761
+ALIAS_OFFSET = 1_130_142_857
+ALIAS_MULTIPLIER_INVERSE = pow(ALIAS_MULTIPLIER, -1, ALIAS_SPACE)
+
+# Количество попыток сохранить ссылку со сгенерированным алиасом
+ALIAS_ALLOCATION_ATTEMPTS = 3
+
+# Фоновые обновления устаревших записей кэша алиасов (ссылки на задачи хранятся до их завершения)
+alias_refreshes: set[asyncio.Task] = set()
+
+
+
+def encode_alias_id(alias_id: int) -> str:
     '''
-        Принимает длину алиаса и создает случайный алиас для сокращенной ссылки при помощи функции uuid4.
+        Функция encode_alias_id - взаимно однозначно переводит числовой идентификатор
+            в алиас из ALIAS_LENGTH символов base62.
         Аргументы:
-            short_code_lenght (int): длина алиаса, по умолчанию 6.
+            alias_id (int) - идентификатор из последовательности link_alias_seq.
     '''
 
-    alias = str(uuid.uuid4())[:short_code_lenght]
+    number = (alias_id * ALIAS_MULTIPLIER + ALIAS_OFFSET) % ALIAS_SPACE
+    chars = []
+    for _ in range(ALIAS_LENGTH):
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
 
-    return alias
+    return ''.join(reversed(chars))
 
 
-@cache(expire=60)
-async def get_url_data_by_alias(alias: str, session: AsyncSession) -> str | bool:
+def decode_alias(alias: str) -> int:
     '''
-        Функция get_url_by_alias
+        Функция decode_alias - обратная к encode_alias_id, возвращает идентификатор
+            по сгенерированному алиасу.
+        Аргументы:
+            alias (str) - алиас из ALIAS_LENGTH символов base62.
+    '''
+
+    number = 0
+    for char in alias:
+        number = number * 62 + BASE62_ALPHABET.index(char)
+
+    return (number - ALIAS_OFFSET) * ALIAS_MULTIPLIER_INVERSE % ALIAS_SPACE
+
+
+
+def parse_expires_at(expires_at: str | None) -> datetime | None:
     '''
+        Функция parse_expires_at - переводит дату и время удаления ссылки
+            из формата "дд.мм.гггг чч:мм" в datetime.
+        Аргументы:
+            expires_at (str или None) - дата и время удаления ссылки.
+    '''
+
+    if not expires_at:
+        return None
+
+    expires_at = time.strptime(expires_at, '%d.%m.%Y %H:%M')
+    expires_at = time.mktime(expires_at)
+
+    return datetime.fromtimestamp(expires_at)
+
+
+
+def is_link_expired(url_data: UrlData) -> bool:
+    '''
+        Функция is_link_expired - возвращает True, если время существования ссылки
+            истекло (даже если она еще не удалена из БД).
+        Аргументы:
+            url_data (UrlData) - данные о ссылке из get_url_data_by_alias.
+    '''
+
+    return url_data.expires_at is not None and url_data.expires_at <= time.time()
+
 
-    query = select(Link).filter(Link.alias == alias)
-    url = await session.execute(query)
-    url = url.scalar()
-    
-    if not url:
+
+class AliasAllocator:
+    '''
+        Класс AliasAllocator - выдает алиасы для коротких ссылок без проверки их
+            существования в БД. Каждый воркер резервирует в последовательности
+            link_alias_seq блок из ALIAS_BLOCK_SIZE идентификаторов и выдает
+            алиасы из него, поэтому сгенерированные алиасы не повторяются.
+    '''
+
+    def __init__(self, block_size: int = ALIAS_BLOCK_SIZE):
+        self.block_size = block_size
+        self._next_id = 0
+        self._block_end = 0
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, session: AsyncSession) -> str:
+        '''
+            Возвращает один новый алиас.
+        '''
+
+        aliases = await self.allocate_many(session, 1)
+
+        return aliases[0]
+
+    async def allocate_many(self, session: AsyncSession, count: int) -> list[str]:
+        '''
+            Возвращает список из count новых алиасов, при необходимости
+                резервирует новые блоки идентификаторов.
+        '''
+
+        aliases = []
+        async with self._lock:
+            while len(aliases) < count:
+                if self._next_id >= self._block_end:
+                    result = await session.execute(select(link_alias_seq.next_value()))
+                    self._next_id = result.scalar_one()
+                    self._block_end = self._next_id + self.block_size
+
+                taken = min(count - len(aliases), self._block_end - self._next_id)
+                aliases.extend(encode_alias_id(alias_id)
+                               for alias_id in range(self._next_id, self._next_id + taken))
+                self._next_id += taken
+
+        return aliases
+
+
+
+alias_allocator = AliasAllocator()
+
+
+
+def build_search_query(user_id: int, source_url: str):
+    '''
+        Функция build_search_query - строит запрос алиасов ссылок пользователя
+            по исходному url. Условие на md5(source_url) позволяет использовать
+            индекс ix_link_user_id_source_url_md5 (длинные url не помещаются в btree).
+        Аргументы:
+            user_id (int) - идентификатор пользователя.
+            source_url (str) - исходный url.
+    '''
+
+    return select(Link.alias).filter((Link.user_id == user_id)
+                                     & (func.md5(Link.source_url) == func.md5(source_url))
+                                     & (Link.source_url == source_url))
+
+
+def get_dedup_key(source_url: str, expires_at: datetime | None) -> str:
+    '''
+        Функция get_dedup_key - возвращает ключ дедупликации ссылки: sha256 от
+            канонической формы url и времени удаления ссылки.
+        Аргументы:
+            source_url (str) - исходный url в канонической форме (normalize_url).
+            expires_at (datetime или None) - время удаления ссылки.
+    '''
+
+    expires = expires_at.isoformat() if expires_at else ''
+    return hashlib.sha256(f'{source_url}\n{expires}'.encode()).hexdigest()
+
+
+def build_deduplicated_insert_query(values: dict):
+    '''
+        Функция build_deduplicated_insert_query - строит запрос, который за один
+            round trip создает ссылку (INSERT ... ON CONFLICT DO NOTHING RETURNING)
+            или, если у пользователя уже есть ссылка с тем же dedup_key, возвращает
+            ее алиас. Колонка created показывает, была ли ссылка создана.
+            Пустой результат означает, что ссылка с тем же ключом создана
+            параллельной транзакцией уже после начала запроса - его нужно повторить.
+        Аргументы:
+            values (dict) - значения колонок новой ссылки, включая dedup_key.
+    '''
+
+    inserted = (insert(Link).values(**values)
+                .on_conflict_do_nothing(index_elements=[Link.user_id, Link.dedup_key],
+                                        index_where=Link.dedup_key.isnot(None))
+                .returning(Link.alias)
+                .cte('inserted'))
+    existing = select(Link.alias, literal(False)).filter((Link.user_id == values['user_id'])
+                                                         & (Link.dedup_key == values['dedup_key']))
+
+    return select(inserted.c.alias, literal(True).label('created')).union_all(existing)
+
+
+def build_user_links_query(user_id: int, cursor: int | None = None, limit: int | None = None):
+    '''
+        Функция build_user_links_query - строит запрос идентификаторов, алиасов
+            и исходных url ссылок пользователя, упорядоченных по id (keyset пагинация
+            по индексу ix_link_user_id_id).
+        Аргументы:
+            user_id (int) - идентификатор пользователя.
+            cursor (int или None) - id последней ссылки с предыдущей страницы.
+            limit (int или None) - максимальное количество ссылок, None - без ограничения.
+    '''
+
+    query = select(Link.id, Link.alias, Link.source_url).filter(Link.user_id == user_id)
+    if cursor is not None:
+        query = query.filter(Link.id > cursor)
+
+    return query.order_by(Link.id).limit(limit)
+
+
+
+def build_expired_links_delete_query(now: datetime, limit: int):
+    '''
+        Функция build_expired_links_delete_query - строит запрос
+            DELETE ... WHERE id IN (SELECT ... LIMIT n FOR UPDATE SKIP LOCKED) RETURNING alias, user_id, source_url,
+            который удаляет пачку ссылок с истекшим временем существования
+            (по индексу ix_link_expires_at), пропуская строки, заблокированные
+            параллельным удалением.
+        Аргументы:
+            now (datetime) - момент, на который ссылки считаются истекшими.
+            limit (int) - максимальное количество ссылок в пачке.
+    '''
+
+    expired_links = (select(Link.id)
+                     .filter(Link.expires_at <= now)
+                     .order_by(Link.expires_at)
+                     .limit(limit)
+                     .with_for_update(skip_locked=True)
+                     .scalar_subquery())
+
+    return (delete(Link).filter(Link.id.in_(expired_links))
+            .returning(Link.alias, Link.user_id, Link.source_url)
+            .execution_options(synchronize_session=False))
+
+
+async def load_url_data(alias: str, session: AsyncSession | None = None) -> UrlData | bool:
+    '''
+        Функция load_url_data - возвращает данные о ссылке (user_id, source_url,
+            expires_at) из БД и сохраняет их в кэш в Redis. Если ссылки нет,
+            то возвращает (и кэширует) False.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+            session (AsyncSession или None) - сессия подключения к БД. Если не передана,
+                то используется соединение с репликой (или primary).
+    '''
+
+    query = select(Link.user_id, Link.source_url, Link.expires_at).filter(Link.alias == alias)
+    if session is not None:
+        result = await session.execute(query)
+        row = result.first()
+    else:
+        async with read_connection() as connection:
+            result = await connection.execute(query)
+            row = result.first()
+
+        # Реплика может отставать от primary, поэтому отсутствие ссылки подтверждается на primary
+        if row is None and replica_pool.engines:
+            async with read_connection(use_primary=True) as connection:
+                result = await connection.execute(query)
+                row = result.first()
+
+    url = UrlData.from_row(row) if row else False
+    await set_cached_url_data(alias, url)
+
+    return url
+
+
+async def refresh_url_data(alias: str) -> None:
+    '''
+        Функция refresh_url_data - обновляет устаревшую запись об алиасе в кэше
+            в фоне. Ошибки логируются: до следующей попытки отдаются устаревшие данные.
+    '''
+
+    try:
+        await load_url_data(alias)
+    except Exception:
+        logger.exception('Не удалось обновить данные об алиасе %s в кэше', alias)
+
+
+async def lookup_url_data(alias: str, session: AsyncSession | None = None) -> UrlData | bool:
+    '''
+        Функция lookup_url_data - возвращает данные о ссылке из кэша в Redis, а при
+            промахе - из БД. Устаревшая запись отдается сразу, а обновляет ее
+            только запрос, захвативший блокировку на обновление (stale-while-revalidate).
+    '''
+
+    cached = await get_cached_url_data(alias)
+    if cached is MISS:
+        return await load_url_data(alias, session)
+
+    url, stale = cached
+    if stale and await acquire_alias_refresh_lock(alias):
+        task = asyncio.create_task(refresh_url_data(alias))
+        alias_refreshes.add(task)
+        task.add_done_callback(alias_refreshes.discard)
+
+    return url
+
+
+async def get_url_data_by_alias(alias: str, session: AsyncSession | None = None) -> UrlData | bool:
+    '''
+        Функция get_url_data_by_alias - возвращает данные о ссылке (user_id, source_url,
+            expires_at) из кэша в Redis, а при промахе - из БД (с сохранением в кэш).
+            Если ссылки нет, то возвращает (и кэширует) False. Алиас, которого нет
+            в фильтре алиасов, сразу считается несуществующим.
+            Одновременные запросы одного алиаса без сессии объединяются в пределах
+            воркера, поэтому промах горячего алиаса дает один запрос в Redis и в БД.
+        Аргументы:
+            alias (str) - алиас короткой ссылки.
+            session (AsyncSession или None) - сессия подключения к БД. Если не передана,
+                то соединение с репликой (или primary) берется только при промахе кэша.
+    '''
+
+    if await is_alias_missing(alias):
         return False
-    
-    url_dict = {}
-    url_dict['user_id'] = url.user_id
-    url_dict['alias'] = url.alias
-    url_dict['source_url'] = url.source_url
-    url_dict['created_at'] = url.created_at
-    url_dict['expires_at'] = url.expires_at
-    url_dict['last_used_at'] = url.last_used_at
-    url_dict['transitions_quantity'] = url.transitions_quantity
-
-    return url_dict
\ No newline at end of file
+
+    if session is not None:
+        return await lookup_url_data(alias, session)
+
+    return await alias_lookups.do(alias, lookup_url_data, alias)
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import orjson
+from redis.exceptions import RedisError
+from sqlalchemy import select, or_
+
+from broadcast import worker_events
+from config import WARMUP_TOP_N, WARMUP_TIMEOUT, WARMUP_INTERVAL, WARMUP_BATCH_SIZE
+from database import read_connection
+from redis_client import get_redis
+from .cache import alias_cache, add_cached_url_data, get_alias_cache_key, unpack_url_data, UrlData, MISS
+from .models import Link
+
+
+logger = logging.getLogger(__name__)
+
+
+# Список самых популярных алиасов, по которому прогреваются воркеры, запущенные
+# после того, как один из них прочитал его из БД, и все воркеры после обновления лидером
+WARMUP_SNAPSHOT_KEY = 'tinyurl:alias_warmup:snapshot'
+# Блокировка, чтобы при одновременном запуске воркеров список читал из БД только один
+WARMUP_LOCK_KEY = 'tinyurl:alias_warmup:lock'
+# Как часто воркер без блокировки проверяет, появился ли список, в секундах
+WARMUP_POLL_INTERVAL = 0.5
+# Сколько секунд прогрев при запуске ждет подписки на события воркеров
+WARMUP_SUBSCRIBE_WAIT = 5
+
+# Снятие блокировки только ее владельцем
+RELEASE_WARMUP_LOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def build_hot_aliases_query(now: datetime, limit: int):
+    '''
+        Функция build_hot_aliases_query - строит запрос limit алиасов неистекших
+            ссылок с наибольшим количеством переходов (при равенстве - с самым
+            поздним переходом).
+    '''
+
+    return (select(Link.alias)
+            .filter(or_(Link.expires_at.is_(None), Link.expires_at > now))
+            .order_by(Link.transitions_quantity.desc(), Link.last_used_at.desc().nulls_last())
+            .limit(limit))
+
+
+def build_url_data_query(aliases: list[str], now: datetime):
+    '''
+        Функция build_url_data_query - строит запрос данных о неистекших ссылках
+            с переданными алиасами (по уникальному индексу алиаса).
+    '''
+
+    return (select(Link.alias, Link.user_id, Link.source_url, Link.expires_at)
+            .filter(Link.alias.in_(aliases) & or_(Link.expires_at.is_(None), Link.expires_at > now)))
+
+
+
+class CacheWarmer:
+    '''
+        Класс CacheWarmer - прогревает in-process кэш и кэш алиасов в Redis данными
+            о top_n самых популярных ссылках, чтобы после деплоя или перезапуска
+            Redis первые редиректы не шли в БД.
+        Список популярных алиасов читается из реплики, а данные о ссылках -
+            из primary (ссылки из списка могли быть уже удалены или переименованы)
+            и пишутся в Redis только при отсутствии записи (SET NX), чтобы не затирать
+            более свежие. Остальные воркеры прогревают in-process кэш записями
+            из Redis, которые удаляются при удалении и смене алиаса.
+        Аргументы:
+            top_n (int) - количество ссылок.
+            batch_size (int) - размер пачки при чтении из БД и Redis и записи в Redis.
+    '''
+
+    def __init__(self, top_n: int, batch_size: int):
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.ready = False
+        self.warmed = 0
+        self.runs = 0
+        self.duration = 0.0
+        self._local_warmup: asyncio.Task | None = None
+        self._startup_pending = True
+
+    async def load_hot_aliases(self) -> list[tuple[str, UrlData]]:
+        '''
+            Читает самые популярные алиасы и данные о них из БД, пишет их в Redis
+                и сохраняет список алиасов для остальных воркеров.
+        '''
+
+        now = datetime.now()
+        async with read_connection() as connection:
+            query = build_hot_aliases_query(now, self.top_n).execution_options(yield_per=self.batch_size)
+            aliases = [alias async for batch in (await connection.stream(query)).scalars().partitions()
+                       for alias in batch]
+
+        redis = get_redis()
+        entries = []
+        async with read_connection(use_primary=True) as connection:
+            for i in range(0, len(aliases), self.batch_size):
+                rows = (await connection.execute(build_url_data_query(aliases[i:i + self.batch_size], now))).all()
+                batch = [(row.alias, UrlData.from_row(row)) for row in rows]
+                entries += batch
+                try:
+                    async with redis.pipeline(transaction=False) as pipe:
+                        for alias, url in batch:
+                            add_cached_url_data(pipe, alias, url, nx=True)
+                        await pipe.execute()
+                except RedisError:
+                    logger.warning('Redis недоступен, популярные алиасы не записаны в кэш в Redis')
+
+        try:
+            await redis.set(WARMUP_SNAPSHOT_KEY, orjson.dumps([alias for alias, _ in entries]),
+                            ex=int(WARMUP_INTERVAL * 2))
+        except RedisError:
+            logger.warning('Redis недоступен, список популярных алиасов не сохранен')
+
+        return entries
+
+    async def warm_local(self, aliases: list[str]) -> int:
+        '''
+            Прогревает in-process кэш воркера записями об алиасах из Redis
+                (пачками через pipeline), возвращает количество прогретых алиасов.
+        '''
+
+        redis = get_redis()
+        warmed = 0
+        for i in range(0, len(aliases), self.batch_size):
+            batch = aliases[i:i + self.batch_size]
+            async with redis.pipeline(transaction=False) as pipe:
+                for alias in batch:
+                    pipe.get(get_alias_cache_key(alias))
+                cached_entries = await pipe.execute()
+
+            for alias, cached in zip(batch, cached_entries):
+                entry = unpack_url_data(cached) if cached is not None else MISS
+                if entry is not MISS and entry[0]:
+                    alias_cache.set(alias, entry[0])
+                    warmed += 1
+
+        return warmed
+
+    async def get_snapshot(self, token: str) -> list[str] | None:
+        '''
+            Возвращает список популярных алиасов, сохраненный другим воркером. Если списка
+                нет, то ждет его, пока блокировку на чтение из БД держит другой воркер,
+                иначе захватывает блокировку с token и возвращает None (список нужно
+                прочитать из БД).
+        '''
+
+        redis = get_redis()
+        try:
+            while True:
+                snapshot = await redis.get(WARMUP_SNAPSHOT_KEY)
+                if snapshot is not None:
+                    return orjson.loads(snapshot)
+                if await redis.set(WARMUP_LOCK_KEY, token, nx=True, ex=int(WARMUP_TIMEOUT)):
+                    return None
+                await asyncio.sleep(WARMUP_POLL_INTERVAL)
+        except RedisError:
+            return None
+
+    async def release_lock(self, token: str) -> None:
+        '''
+            Снимает блокировку чтения из БД, если ее держит этот воркер (токен token).
+        '''
+
+        try:
+            await get_redis().eval(RELEASE_WARMUP_LOCK_SCRIPT, 1, WARMUP_LOCK_KEY, token)
+        except RedisError:
+            logger.warning('Redis недоступен, блокировка прогрева кэша истечет по TTL')
+
+    async def warm(self) -> int:
+        '''
+            Прогревает кэши при запуске воркера и возвращает количество алиасов:
+                из списка, сохраненного другим воркером, или, если его нет, из БД
+                (под блокировкой, чтобы одновременно запущенные воркеры читали БД один раз).
+        '''
+
+        started = time.perf_counter()
+        token = uuid4().hex
+        aliases = await self.get_snapshot(token)
+        if aliases is None:
+            try:
+                entries = await self.load_hot_aliases()
+            finally:
+                await self.release_lock(token)
+            for alias, url in entries:
+                alias_cache.set(alias, url)
+            warmed = len(entries)
+        else:
+            warmed = await self.warm_local(aliases)
+
+        self.record_run(warmed, started)
+        return warmed
+
+    async def refresh(self) -> int:
+        '''
+            Периодическая задача воркера-лидера планировщика: обновляет список
+                популярных алиасов и кэш в Redis, после чего все воркеры прогревают
+                свои in-process кэши событием alias_warmup.
+        '''
+
+        entries = await self.load_hot_aliases()
+        await worker_events.publish('alias_warmup')
+
+        return len(entries)
+
+    async def warm_from_snapshot(self) -> None:
+        started = time.perf_counter()
+        try:
+            snapshot = await get_redis().get(WARMUP_SNAPSHOT_KEY)
+            if snapshot is not None:
+                self.record_run(await self.warm_local(orjson.loads(snapshot)), started)
+        except Exception:
+            logger.exception('Не удалось прогреть in-process кэш алиасов')
+
+    def on_warmup_event(self) -> None:
+        '''
+            Обработчик события alias_warmup: прогревает in-process кэш в фоне
+                (если предыдущий прогрев еще идет, событие пропускается).
+        '''
+
+        if self._local_warmup is None or self._local_warmup.done():
+            self._local_warmup = asyncio.create_task(self.warm_from_snapshot())
+
+    def on_subscribe(self) -> None:
+        '''
+            Обработчик (повторной) подписки на события воркеров, которая очищает
+                in-process кэш алиасов: если прогрев при запуске уже начался, то кэш
+                прогревается заново из Redis.
+        '''
+
+        if not self._startup_pending:
+            self.on_warmup_event()
+
+    def record_run(self, warmed: int, started: float) -> None:
+        self.warmed = warmed
+        self.runs += 1
+        self.duration = time.perf_counter() - started
+
+    async def warm_after_subscribe(self) -> int:
+        '''
+            Прогревает кэши после подписки на события воркеров (обработчики подписки
+                очищают in-process кэш), но не ждет ее дольше WARMUP_SUBSCRIBE_WAIT секунд.
+        '''
+
+        await worker_events.wait_subscribed(WARMUP_SUBSCRIBE_WAIT)
+        self._startup_pending = False
+
+        return await self.warm()
+
+    async def warm_on_startup(self, timeout: float) -> None:
+        '''
+            Прогревает кэши при запуске воркера не дольше timeout секунд, после чего
+                воркер считается готовым принимать трафик (даже если прогрев не удался).
+        '''
+
+        try:
+            warmed = await asyncio.wait_for(self.warm_after_subscribe(), timeout)
+            logger.info('Кэш алиасов прогрет: %s алиасов за %.2f с', warmed, self.duration)
+        except asyncio.TimeoutError:
+            logger.warning('Прогрев кэша алиасов не уложился в %s с', timeout)
+        except Exception:
+            logger.exception('Не удалось прогреть кэш алиасов')
+        finally:
+            self.ready = True
+
+    def stats(self) -> dict[str, int | float]:
+        return {'ready': int(self.ready), 'warmed': self.warmed, 'runs': self.runs,
+                'duration_seconds': self.duration}
+
+
+
+cache_warmer = CacheWarmer(WARMUP_TOP_N, WARMUP_BATCH_SIZE)
+
+
+
+def register_cache_warmer() -> None:
+    '''
+        Функция register_cache_warmer - подключает прогрев in-process кэша к событиям
+            воркеров (вызывается после register_alias_cache, чтобы при подписке кэш
+            прогревался после очистки).
+    '''
+
+    worker_events.on('alias_warmup', cache_warmer.on_warmup_event)
+    worker_events.on_subscribe(cache_warmer.on_subscribe)
@@ -1,37 +1,230 @@
+import asyncio
+import logging
+import os
+import shutil
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
-from time import sleep
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
-from redis import asyncio as aioredis
 
-from config import DEBUG, HOST_PORT, REDIS_PASSWORD
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from config import DEBUG, HOST_PORT, REDIRECT_FAST_PATH, CLICK_EVENTS_ENABLED, METRICS_MULTIPROC_DIR
+from config import ALIAS_FILTER_ENABLED, MAINTENANCE_BACKEND, REAPER_INTERVAL, CLICK_FLUSH_INTERVAL
+from config import WARMUP_TIMEOUT, WARMUP_INTERVAL
+from config import (SERVER_WORKERS, SERVER_BACKLOG, SERVER_KEEP_ALIVE, SERVER_LIMIT_CONCURRENCY,
+                    SERVER_GRACEFUL_TIMEOUT)
 from links.router import links_router
+from links.bloom import alias_filter, register_alias_filter
+from links.cache import alias_cache, alias_lookups, register_alias_cache, CACHE_PREFIX
+from links.clicks import run_click_flusher, flush_clicks
+from links.reaper import delete_expired_links
+from links.redirect import RedirectMiddleware
+from links.warmer import cache_warmer, register_cache_warmer
+from links.analytics import run_click_event_consumer
 from auth.router import auth_router
+from auth.cache import identity_cache, register_identity_cache
+from auth.hashing import password_hasher
+from auth.models import create_anonimous_user
+from database import get_pool_stats, async_session_maker
+from redis_client import get_redis, close_redis
+from metrics import MetricsMiddleware, generate_metrics, register_stats
+from scheduler import scheduler
+from broadcast import worker_events
+
+
+logger = logging.getLogger(__name__)
+
+# Метрики и обработчики событий уже подключены в этом воркере
+_worker_hooks_registered = False
+
+
+def get_pool_stats_by_pool() -> dict[str, dict]:
+    stats = get_pool_stats()
+    return {'async': stats['async'], 'sync': stats['sync'],
+            **{replica['url']: replica for replica in stats['replicas']}}
+
+
+def register_worker_hooks() -> None:
+    '''
+        Функция register_worker_hooks - добавляет в /metrics текущие значения пулов
+            соединений и in-process кэшей и подключает обработчики событий, которые
+            воркеры рассылают друг другу. Вызывается из lifespan один раз на процесс:
+            при запуске python src/main.py модуль импортируется дважды (как __main__
+            и как main), поэтому регистрация при импорте выполнялась бы повторно.
+    '''
+
+    global _worker_hooks_registered
+    if _worker_hooks_registered:
+        return None
+    _worker_hooks_registered = True
+
+    register_stats('tinyurl_db_pool', get_pool_stats_by_pool, label='pool')
+    register_stats('tinyurl_alias_cache', alias_cache.stats)
+    register_stats('tinyurl_alias_lookups', alias_lookups.stats)
+    register_stats('tinyurl_alias_filter', alias_filter.stats)
+    register_stats('tinyurl_identity_cache', identity_cache.stats)
+    register_stats('tinyurl_password_hasher', password_hasher.stats)
+    register_stats('tinyurl_scheduler', scheduler.stats)
+    register_stats('tinyurl_alias_warmup', cache_warmer.stats)
+    register_stats('tinyurl_worker_events', worker_events.stats)
 
+    if ALIAS_FILTER_ENABLED:
+        register_alias_filter()
+    register_alias_cache()
+    register_identity_cache()
+    register_cache_warmer()
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    redis = aioredis.from_url(f"redis://:@redis:5370/0")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    # Метрики пулов и кэшей и обработчики событий других воркеров
+    register_worker_hooks()
+
+    # Общий для всего воркера клиент Redis (кэш, счетчики переходов, отзыв токенов)
+    FastAPICache.init(RedisBackend(get_redis()), prefix=CACHE_PREFIX)
+
+    # Инициализация анонимного пользователя, если такой еще не создан
+    async with async_session_maker() as session:
+        await create_anonimous_user(session)
+
+    # Подписка на события других воркеров (новые алиасы, сброс кэшей), после нее
+    # в фоне строится фильтр алиасов
+    worker_events_listener = asyncio.create_task(worker_events.run())
+    # Прогрев кэшей алиасов популярными ссылками в фоне после подписки (она очищает
+    # in-process кэши), до его окончания /ready отвечает 503
+    cache_warmup = asyncio.create_task(cache_warmer.warm_on_startup(WARMUP_TIMEOUT))
+
+    # Периодические задачи в воркере-лидере планировщика или, при MAINTENANCE_BACKEND=celery,
+    # удаление истекших ссылок в Celery и запись накопленных переходов в БД из каждого воркера
+    click_flusher = None
+    if MAINTENANCE_BACKEND == 'app':
+        scheduler.add_job('delete_expired_links', delete_expired_links, REAPER_INTERVAL)
+        scheduler.add_job('flush_clicks', flush_clicks, CLICK_FLUSH_INTERVAL)
+    else:
+        click_flusher = asyncio.create_task(run_click_flusher())
+    scheduler.add_job('warm_alias_cache', cache_warmer.refresh, WARMUP_INTERVAL)
+    scheduler.start()
+    # Фоновая обработка событий переходов (агрегаты для /links/{short_code}/stats/timeseries)
+    click_event_consumer = asyncio.create_task(run_click_event_consumer()) if CLICK_EVENTS_ENABLED else None
     yield
+    cache_warmup.cancel()
+    if click_flusher is not None:
+        click_flusher.cancel()
+    await scheduler.stop()
+    if click_event_consumer is not None:
+        click_event_consumer.cancel()
+    worker_events_listener.cancel()
+    try:
+        await flush_clicks()
+    except Exception:
+        logger.exception('Не удалось записать переходы по ссылкам в БД при остановке')
+    await close_redis()
 
 
 app = FastAPI(lifespan=lifespan)
 
+if REDIRECT_FAST_PATH:
+    app.add_middleware(RedirectMiddleware)
+# Добавляется последним, чтобы учитывать и ответы fast-path редиректа
+app.add_middleware(MetricsMiddleware)
+
+
+def get_pool_stats_by_pool() -> dict[str, dict]:
+    stats = get_pool_stats()
+    return {'async': stats['async'], 'sync': stats['sync'],
+            **{replica['url']: replica for replica in stats['replicas']}}
+
 
 @app.get('/')
 async def root():
     return {'message': 'Сервис работает!'}
 
+
+@app.get('/ready')
+async def ready(response: Response):
+    '''
+        Проверка готовности воркера принимать трафик: 503, пока не закончился
+            (или не превысил WARMUP_TIMEOUT) прогрев кэшей алиасов при запуске.
+    '''
+
+    if not cache_warmer.ready:
+        response.status_code = 503
+        return {'status': 'warming_up'}
+
+    return {'status': 'ready', **cache_warmer.stats()}
+
+
+@app.get('/stats/alias-cache')
+async def get_alias_cache_stats():
+    '''
+        Возвращает счетчики попаданий, промахов и вытеснений in-process кэша алиасов
+            текущего воркера.
+    '''
+
+    return alias_cache.stats()
+
+
+@app.get('/stats/identity-cache')
+async def get_identity_cache_stats():
+    '''
+        Возвращает счетчики попаданий, промахов и вытеснений in-process кэша
+            данных пользователя по JWT токену текущего воркера.
+    '''
+
+    return identity_cache.stats()
+
+
+@app.get('/stats/password-hasher')
+async def get_password_hasher_stats():
+    '''
+        Возвращает размер очереди и время выполнения хэширования паролей текущего воркера.
+    '''
+
+    return password_hasher.stats()
+
+
+@app.get('/stats/db-pool')
+async def get_db_pool_stats():
+    '''
+        Возвращает заполненность пулов соединений с БД и время ожидания
+            свободного соединения в текущем воркере.
+    '''
+
+    return get_pool_stats()
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    '''
+        Возвращает метрики в формате prometheus: количество и время обработки
+            запросов по роутам, время этапов обработки, пулы соединений и кэши.
+    '''
+
+    return Response(generate_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 app.include_router(links_router)
 app.include_router(auth_router)
 
 
 if __name__ == '__main__':
-    uvicorn.run("main:app", host='0.0.0.0', port=HOST_PORT, reload=DEBUG)
\ No newline at end of file
+    if DEBUG:
+        uvicorn.run("main:app", host='0.0.0.0', port=HOST_PORT, reload=True)
+    else:
+        # Метрики воркеров собираются через файлы в общем каталоге, который
+        #   очищается при каждом запуске
+        if SERVER_WORKERS > 1:
+            shutil.rmtree(METRICS_MULTIPROC_DIR, ignore_errors=True)
+            os.makedirs(METRICS_MULTIPROC_DIR)
+            os.environ['PROMETHEUS_MULTIPROC_DIR'] = METRICS_MULTIPROC_DIR
+
+        # Production режим: несколько воркеров, uvloop + httptools и плавная
+        #   остановка по SIGTERM (воркеры дообрабатывают текущие запросы)
+        uvicorn.run("main:app", host='0.0.0.0', port=HOST_PORT, workers=SERVER_WORKERS,
+                    loop='uvloop', http='httptools', backlog=SERVER_BACKLOG,
+                    timeout_keep_alive=SERVER_KEEP_ALIVE,
+                    limit_concurrency=SERVER_LIMIT_CONCURRENCY or None,
+                    timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT)
\ No newline at end of file
@@ -0,0 +1,236 @@
+import functools
+import inspect
+import os
+import time
+from collections.abc import Callable
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Путь, под которым в метриках учитываются запросы, не попавшие ни в один роут
+UNMATCHED_ROUTE = 'unmatched'
+
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# Этапы обработки запроса, время которых измеряется внутри обработчиков
+STAGES = ('jwt_decode', 'get_current_user', 'alias_cache_get', 'alias_cache_set',
+          'db_execute', 'db_commit', 'bcrypt_hash', 'bcrypt_verify')
+
+REQUESTS_TOTAL = Counter('tinyurl_http_requests_total', 'Количество HTTP запросов',
+                         ['method', 'route', 'status'])
+REQUEST_DURATION = Histogram('tinyurl_http_request_duration_seconds', 'Время обработки HTTP запроса',
+                             ['method', 'route'], buckets=REQUEST_BUCKETS)
+STAGE_DURATION = Histogram('tinyurl_stage_duration_seconds', 'Время выполнения этапа обработки запроса',
+                           ['stage'], buckets=STAGE_BUCKETS)
+JOBS_TOTAL = Counter('tinyurl_job_runs_total', 'Количество запусков периодических задач', ['job', 'status'])
+JOB_DURATION = Histogram('tinyurl_job_duration_seconds', 'Время выполнения периодической задачи',
+                         ['job'], buckets=REQUEST_BUCKETS + (30, 60, 120))
+CLICK_EVENTS_DROPPED = Counter('tinyurl_click_events_dropped_total',
+                               'Количество событий переходов, не учтенных в агрегатах, потому что '
+                               'ссылки с их алиасом уже нет (удалена или переименована)')
+
+# Дочерние метрики этапов создаются заранее, чтобы не искать их по меткам на каждый вызов
+stage_histograms = {stage: STAGE_DURATION.labels(stage) for stage in STAGES}
+
+# Коллекторы текущих значений (пулы соединений, кэши) по префиксу, которые читаются при запросе /metrics
+stats_collectors: dict[str, 'StatsCollector'] = {}
+
+
+
+def is_multiprocess_mode() -> bool:
+    '''
+        Функция is_multiprocess_mode - возвращает True, если запущено несколько воркеров
+            uvicorn: метрики каждого процесса пишутся в файлы в PROMETHEUS_MULTIPROC_DIR
+            и суммируются при чтении /metrics.
+        Переменная окружения читается при каждом вызове, потому что main.py задает ее
+            перед запуском воркеров, когда этот модуль уже импортирован.
+    '''
+
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    stage_histograms[stage].observe(seconds)
+
+
+def stage_timer(stage: str):
+    '''
+        Функция stage_timer - контекстный менеджер, который измеряет время этапа stage.
+        Аргументы:
+            stage (str) - название этапа из STAGES.
+    '''
+
+    return stage_histograms[stage].time()
+
+
+def timed(stage: str) -> Callable:
+    '''
+        Функция timed - декоратор, который измеряет время выполнения функции
+            (синхронной или асинхронной) как этапа stage.
+        Аргументы:
+            stage (str) - название этапа из STAGES.
+    '''
+
+    histogram = stage_histograms[stage]
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+
+def observe_job(job: str, status: str, seconds: float) -> None:
+    JOBS_TOTAL.labels(job, status).inc()
+    JOB_DURATION.labels(job).observe(seconds)
+
+
+def observe_dropped_click_events(count: int) -> None:
+    CLICK_EVENTS_DROPPED.inc(count)
+
+
+
+class StatsCollector:
+    '''
+        Класс StatsCollector - коллектор prometheus, который при чтении метрик
+            вызывает функцию stats и отдает ее числовые значения как gauge
+            {prefix}_{ключ} с меткой pid воркера.
+        Аргументы:
+            prefix (str) - префикс названий метрик.
+            stats (Callable) - функция, возвращающая словарь значений, или, если
+                передан label, словарь {значение метки: словарь значений}.
+            label (str или None) - название метки для группы значений.
+    '''
+
+    def __init__(self, prefix: str, stats: Callable[[], dict], label: str | None = None):
+        self.prefix = prefix
+        self.stats = stats
+        self.label = label
+
+    def collect(self):
+        pid = str(os.getpid())
+        stats = self.stats()
+        groups = stats.items() if self.label else [(None, stats)]
+        labels = ['pid', self.label] if self.label else ['pid']
+
+        families = {}
+        for label_value, values in groups:
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key not in families:
+                    families[key] = GaugeMetricFamily(f'{self.prefix}_{key}', f'{self.prefix} {key}',
+                                                      labels=labels)
+                families[key].add_metric([pid, label_value] if self.label else [pid], float(value))
+
+        yield from families.values()
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], label: str | None = None) -> None:
+    '''
+        Функция register_stats - добавляет в /metrics текущие значения, которые
+            возвращает функция stats (см. StatsCollector). В режиме нескольких
+            воркеров значения относятся к воркеру, который ответил на запрос /metrics.
+        Повторная регистрация того же prefix пропускается.
+    '''
+
+    if prefix in stats_collectors:
+        return None
+
+    collector = StatsCollector(prefix, stats, label)
+    stats_collectors[prefix] = collector
+    if not is_multiprocess_mode():
+        REGISTRY.register(collector)
+
+
+def generate_metrics() -> bytes:
+    '''
+        Функция generate_metrics - возвращает метрики в текстовом формате prometheus.
+    '''
+
+    if not is_multiprocess_mode():
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in stats_collectors.values():
+        registry.register(collector)
+
+    return generate_latest(registry)
+
+
+
+class MetricsMiddleware:
+    '''
+        Класс MetricsMiddleware - ASGI middleware, которое считает HTTP запросы
+            и время их обработки по шаблону роута (/links/{short_code}, а не
+            фактический путь), чтобы количество временных рядов не зависело
+            от количества ссылок.
+        Аргументы:
+            app (ASGIApp) - следующее ASGI приложение.
+    '''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._counters = {}
+        self._histograms = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return None
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.observe(scope, status_code, time.perf_counter() - started)
+
+    def observe(self, scope: Scope, status_code: int, seconds: float) -> None:
+        # FastAPI сохраняет найденный роут в scope, fast-path редиректа - шаблон пути
+        route = scope.get('route')
+        route_path = route.path if route is not None else scope.get('route_path', UNMATCHED_ROUTE)
+        method = scope['method']
+
+        key = (method, route_path, status_code)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = REQUESTS_TOTAL.labels(method, route_path, str(status_code))
+        counter.inc()
+
+        key = (method, route_path)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = REQUEST_DURATION.labels(method, route_path)
+        histogram.observe(seconds)
+
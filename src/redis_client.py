@@ -0,0 +1,149 @@
+from redis import Redis
+from redis import asyncio as aioredis
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+from redis.backoff import ExponentialBackoff
+from redis.cluster import RedisCluster
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+
+from config import (REDIS_PASSWORD, REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_BROKER_DB, REDIS_MODE,
+                    REDIS_SENTINELS, REDIS_SENTINEL_MASTER, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT,
+                    REDIS_CONNECT_TIMEOUT, REDIS_RETRIES, REDIS_RETRY_BACKOFF_CAP,
+                    REDIS_HEALTH_CHECK_INTERVAL, CELERY_BROKER_URL)
+
+
+# Ошибки, при которых команда повторяется с экспоненциальной задержкой
+RETRY_ON_ERRORS = [ConnectionError, TimeoutError]
+
+_redis: aioredis.Redis | AsyncRedisCluster | None = None
+
+
+
+def get_sentinel_nodes() -> list[tuple[str, int]]:
+    '''
+        Функция get_sentinel_nodes - разбирает REDIS_SENTINELS (host:port,host:port)
+            в список адресов sentinel.
+    '''
+
+    nodes = []
+    for node in REDIS_SENTINELS.split(','):
+        if node.strip():
+            host, _, port = node.strip().partition(':')
+            nodes.append((host, int(port or 26379)))
+
+    return nodes
+
+
+def get_connection_kwargs(retry_class) -> dict:
+    '''
+        Функция get_connection_kwargs - возвращает общие для всех режимов параметры
+            подключения: пароль, таймауты, повторы с экспоненциальной задержкой
+            и периодическую проверку соединений.
+    '''
+
+    return {'password': REDIS_PASSWORD,
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_CONNECT_TIMEOUT,
+            'retry': retry_class(ExponentialBackoff(cap=REDIS_RETRY_BACKOFF_CAP), REDIS_RETRIES),
+            'retry_on_error': RETRY_ON_ERRORS,
+            'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL}
+
+
+def create_async_redis() -> aioredis.Redis | AsyncRedisCluster:
+    '''
+        Функция create_async_redis - создает асинхронный клиент Redis с ограниченным
+            пулом соединений в режиме REDIS_MODE (standalone, sentinel или cluster).
+    '''
+
+    kwargs = get_connection_kwargs(AsyncRetry)
+
+    if REDIS_MODE == 'sentinel':
+        sentinel = AsyncSentinel(get_sentinel_nodes(), sentinel_kwargs={'password': REDIS_PASSWORD},
+                                 **kwargs)
+        return sentinel.master_for(REDIS_SENTINEL_MASTER, db=REDIS_DB,
+                                   max_connections=REDIS_MAX_CONNECTIONS)
+
+    if REDIS_MODE == 'cluster':
+        return AsyncRedisCluster(host=REDIS_HOST, port=REDIS_PORT,
+                                 max_connections=REDIS_MAX_CONNECTIONS, **kwargs)
+
+    pool = aioredis.BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                                           max_connections=REDIS_MAX_CONNECTIONS,
+                                           timeout=REDIS_SOCKET_TIMEOUT, **kwargs)
+    return aioredis.Redis(connection_pool=pool)
+
+
+def create_sync_redis() -> Redis | RedisCluster:
+    '''
+        Функция create_sync_redis - создает синхронный клиент Redis (для задач Celery)
+            с теми же настройками, что и асинхронный.
+    '''
+
+    kwargs = get_connection_kwargs(Retry)
+
+    if REDIS_MODE == 'sentinel':
+        sentinel = Sentinel(get_sentinel_nodes(), sentinel_kwargs={'password': REDIS_PASSWORD}, **kwargs)
+        return sentinel.master_for(REDIS_SENTINEL_MASTER, db=REDIS_DB,
+                                   max_connections=REDIS_MAX_CONNECTIONS)
+
+    if REDIS_MODE == 'cluster':
+        return RedisCluster(host=REDIS_HOST, port=REDIS_PORT, max_connections=REDIS_MAX_CONNECTIONS,
+                            **kwargs)
+
+    return Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS,
+                 **kwargs)
+
+
+def get_redis() -> aioredis.Redis | AsyncRedisCluster:
+    '''
+        Функция get_redis - возвращает общий для процесса асинхронный клиент Redis
+            (создается при первом обращении).
+    '''
+
+    global _redis
+    if _redis is None:
+        _redis = create_async_redis()
+
+    return _redis
+
+
+async def close_redis() -> None:
+    '''
+        Функция close_redis - закрывает соединения общего клиента Redis.
+    '''
+
+    global _redis
+    if _redis is not None:
+        if isinstance(_redis, AsyncRedisCluster):
+            await _redis.close()
+        else:
+            await _redis.close(close_connection_pool=True)
+        _redis = None
+
+
+def get_celery_broker_url() -> str:
+    '''
+        Функция get_celery_broker_url - возвращает адрес брокера Celery: CELERY_BROKER_URL,
+            если он задан, иначе адрес на основе настроек Redis (в режиме cluster
+            используется первый узел, так как Celery не поддерживает Redis Cluster).
+    '''
+
+    if CELERY_BROKER_URL:
+        return CELERY_BROKER_URL
+
+    password = REDIS_PASSWORD or ''
+    if REDIS_MODE == 'sentinel':
+        return ';'.join(f'sentinel://:{password}@{host}:{port}/{REDIS_BROKER_DB}'
+                        for host, port in get_sentinel_nodes())
+
+    return f'redis://:{password}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_BROKER_DB}'
+
+
+def get_celery_broker_transport_options() -> dict:
+    if REDIS_MODE == 'sentinel' and not CELERY_BROKER_URL:
+        return {'master_name': REDIS_SENTINEL_MASTER, 'sentinel_kwargs': {'password': REDIS_PASSWORD}}
+
+    return {}
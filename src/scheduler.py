@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from collections.abc import Awaitable, Callable
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+
+from config import SCHEDULER_JITTER, SCHEDULER_LEADER_TTL
+from metrics import observe_job
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+# Блокировка в Redis, которую держит воркер-лидер планировщика
+SCHEDULER_LEADER_KEY = 'tinyurl:scheduler:leader'
+
+# Продление и снятие блокировки только ее владельцем
+EXTEND_LEADER_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+RELEASE_LEADER_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+
+class Scheduler:
+    '''
+        Класс Scheduler - планировщик периодических задач внутри процесса API
+            (замена Celery worker + beat при MAINTENANCE_BACKEND=app).
+        Задачи выполняются только в воркере-лидере среди всех процессов и серверов:
+            лидер захватывает блокировку в Redis (SET NX с TTL leader_ttl) и продлевает
+            ее каждые leader_ttl / 3 секунд. Если лидер остановился или потерял связь
+            с Redis, блокировка истекает и ее захватывает другой воркер.
+        Интервалы задач случайно отклоняются на ±jitter, время выполнения и результат
+            каждого запуска пишутся в метрики tinyurl_job_*.
+        Аргументы:
+            leader_ttl (float) - время жизни блокировки лидера в секундах.
+            jitter (float) - разброс интервалов задач (доля от интервала).
+    '''
+
+    def __init__(self, leader_ttl: float, jitter: float):
+        self.leader_ttl = leader_ttl
+        self.jitter = jitter
+        self.jobs: dict[str, tuple[Callable[[], Awaitable], float]] = {}
+        self.is_leader = False
+        self._token = f'{socket.gethostname()}-{os.getpid()}-{uuid4().hex}'
+        self._tasks: list[asyncio.Task] = []
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], interval: float) -> None:
+        '''
+            Регистрирует задачу name, которая выполняется в лидере раз в interval секунд.
+                Задача сама открывает и закрывает нужные ей сессии БД.
+        '''
+
+        self.jobs[name] = (func, interval)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self.run_leader_election())]
+        self._tasks += [asyncio.create_task(self.run_job(name, func, interval))
+                        for name, (func, interval) in self.jobs.items()]
+
+    async def stop(self) -> None:
+        '''
+            Останавливает задачи и отдает блокировку лидера, чтобы ее сразу
+                захватил другой воркер.
+        '''
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await get_redis().eval(RELEASE_LEADER_SCRIPT, 1, SCHEDULER_LEADER_KEY, self._token)
+            except RedisError:
+                logger.warning('Redis недоступен, блокировка лидера планировщика истечет по TTL')
+
+    async def elect_leader(self) -> bool:
+        '''
+            Продлевает блокировку лидера, если она принадлежит воркеру, иначе пробует ее захватить.
+        '''
+
+        redis = get_redis()
+        ttl_ms = int(self.leader_ttl * 1000)
+        if self.is_leader and await redis.eval(EXTEND_LEADER_SCRIPT, 1, SCHEDULER_LEADER_KEY, self._token, ttl_ms):
+            return True
+
+        return bool(await redis.set(SCHEDULER_LEADER_KEY, self._token, nx=True, px=ttl_ms))
+
+    async def run_leader_election(self) -> None:
+        while True:
+            try:
+                is_leader = await self.elect_leader()
+            except RedisError:
+                # Без связи с Redis нельзя убедиться, что блокировка еще принадлежит воркеру
+                logger.warning('Redis недоступен, воркер не выполняет задачи планировщика')
+                is_leader = False
+
+            if is_leader != self.is_leader:
+                logger.info('Воркер %s %s лидером планировщика', self._token,
+                            'стал' if is_leader else 'перестал быть')
+            self.is_leader = is_leader
+            await asyncio.sleep(self.leader_ttl / 3)
+
+    async def run_job(self, name: str, func: Callable[[], Awaitable], interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            if not self.is_leader:
+                continue
+
+            started = time.perf_counter()
+            status = 'success'
+            try:
+                await func()
+            except Exception:
+                status = 'error'
+                logger.exception('Задача планировщика %s завершилась ошибкой', name)
+            observe_job(name, status, time.perf_counter() - started)
+
+    def stats(self) -> dict[str, int]:
+        return {'leader': int(self.is_leader), 'jobs': len(self.jobs)}
+
+
+
+scheduler = Scheduler(SCHEDULER_LEADER_TTL, SCHEDULER_JITTER)
@@ -0,0 +1,70 @@
+'''
+    Бенчмарк генерации алиасов: скорость выдачи и количество коллизий
+        для старой схемы (uuid4()[:6]) и для AliasAllocator (base62 от
+        идентификатора из последовательности).
+
+    Запуск из корня проекта (нужны переменные окружения из .env):
+        python tests/benchmarks/bench_aliases.py [количество алиасов, по умолчанию 10_000_000]
+'''
+
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from links.utils import encode_alias_id, decode_alias, ALIAS_LENGTH
+from links.models import ALIAS_BLOCK_SIZE
+
+
+
+def bench_uuid_aliases(count: int) -> None:
+    '''
+        Старая схема: 6 hex символов из uuid4 (16.7 млн вариантов).
+        Коллизии считаются по битовой карте всего пространства кодов.
+    '''
+
+    seen = bytearray(16 ** 6 // 8)
+    collisions = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        code = int(str(uuid.uuid4())[:6], 16)
+        byte, bit = divmod(code, 8)
+        if seen[byte] & (1 << bit):
+            collisions += 1
+        else:
+            seen[byte] |= 1 << bit
+    elapsed = time.perf_counter() - started
+
+    print(f'uuid4()[:6]:     {count / elapsed:>12,.0f} aliases/sec, '
+          f'collisions: {collisions:,} ({collisions / count:.2%})')
+
+
+def bench_sequence_aliases(count: int) -> None:
+    '''
+        Новая схема: идентификаторы выдаются блоками по ALIAS_BLOCK_SIZE,
+            каждый переводится в base62 алиас. Отсутствие коллизий проверяется
+            обратным преобразованием (биекция id <-> алиас).
+    '''
+
+    started = time.perf_counter()
+    aliases = []
+    for block_start in range(1, count + 1, ALIAS_BLOCK_SIZE):
+        block_end = min(block_start + ALIAS_BLOCK_SIZE, count + 1)
+        aliases.extend(encode_alias_id(alias_id) for alias_id in range(block_start, block_end))
+    elapsed = time.perf_counter() - started
+
+    collisions = sum(1 for alias_id, alias in enumerate(aliases, start=1)
+                     if decode_alias(alias) != alias_id or len(alias) != ALIAS_LENGTH)
+
+    print(f'base62 sequence: {count / elapsed:>12,.0f} aliases/sec, '
+          f'collisions: {collisions:,} ({collisions / count:.2%})')
+
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    print(f'Generating {count:,} aliases')
+    bench_uuid_aliases(count)
+    bench_sequence_aliases(count)
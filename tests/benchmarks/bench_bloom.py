@@ -0,0 +1,116 @@
+'''
+    Память, вероятность ложного срабатывания и скорость фильтра алиасов (links/bloom.py).
+    test_report_50m считает размер фильтра для 50 млн алиасов и проверяет
+        фактическую вероятность ложного срабатывания на фильтре с тем же количеством
+        бит на алиас, но в SCALE раз меньше (вероятность зависит только от этого
+        отношения), а также оценивает время построения фильтра на 50 млн алиасов.
+        Результаты выводятся с флагом -s.
+    test_definite_negative_skips_lookup проверяет, что редирект по несуществующему
+        алиасу отвечает без обращения к кэшам и БД, а test_recent_alias_is_not_missing -
+        что алиас, созданный в другом воркере, находится до того, как событие о нем
+        дошло до фильтра (проверка пропускается, если Redis недоступен).
+
+    Запуск из корня проекта (нужны переменные окружения из .env):
+        pytest tests/benchmarks/bench_bloom.py -s
+'''
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import auth.models    # регистрирует модель User для relationship в Link
+import links.bloom
+import links.redirect
+from links.bloom import BloomFilter, alias_filter, get_bloom_filter_size, is_alias_missing, RECENT_ALIASES_KEY
+from redis.exceptions import RedisError
+from redis_client import get_redis
+from links.redirect import resolve_alias
+from links.utils import encode_alias_id
+
+
+REPORT_ALIASES = 50_000_000
+ERROR_RATES = (0.01, 0.001)
+SCALE = 50
+PROBES = 200_000
+
+
+
+def build_filter(count: int, error_rate: float) -> tuple[BloomFilter, float]:
+    '''
+        Возвращает фильтр с count сгенерированными алиасами и время его заполнения в секундах.
+    '''
+
+    bloom = BloomFilter(count, error_rate)
+    aliases = [encode_alias_id(alias_id) for alias_id in range(count)]
+    started = time.perf_counter()
+    bloom.add(*aliases)
+
+    return bloom, time.perf_counter() - started
+
+
+
+@pytest.mark.parametrize('error_rate', ERROR_RATES)
+def test_report_50m(error_rate):
+    size, hash_count = get_bloom_filter_size(REPORT_ALIASES, error_rate)
+    count = REPORT_ALIASES // SCALE
+    bloom, seconds = build_filter(count, error_rate)
+
+    # Алиасы вне заполненного диапазона id в фильтр не добавлялись
+    probes = [encode_alias_id(alias_id) for alias_id in range(count, count + PROBES)]
+    false_positives = sum(alias in bloom for alias in probes) / PROBES
+
+    print(f'\n{REPORT_ALIASES} алиасов, error_rate={error_rate}: {size / 8 / 2 ** 20:.1f} МиБ на воркер, '
+          f'{hash_count} хэшей, ложные срабатывания {false_positives:.4%} (ожидается '
+          f'{bloom.false_positive_rate():.4%}), построение ~{seconds * SCALE:.0f} с')
+
+    assert bloom.hash_count == hash_count
+    assert false_positives <= error_rate * 1.5
+
+
+def test_no_false_negatives():
+    bloom, _ = build_filter(100_000, 0.01)
+    assert all(encode_alias_id(alias_id) in bloom for alias_id in range(100_000))
+
+
+def test_definite_negative_skips_lookup(monkeypatch):
+    async def lookup(alias):
+        raise AssertionError('запрос в кэш или БД')
+
+    async def is_recent_alias(alias):
+        return False
+
+    monkeypatch.setattr(links.redirect, 'get_url_data_by_alias', lookup)
+    monkeypatch.setattr(links.bloom, 'is_recent_alias', is_recent_alias)
+    monkeypatch.setattr(alias_filter, '_filter', build_filter(1000, 0.01)[0])
+
+    assert asyncio.run(resolve_alias('garbage!')) is False
+
+
+def test_recent_alias_is_not_missing(monkeypatch):
+    monkeypatch.setattr(alias_filter, '_filter', build_filter(1000, 0.01)[0])
+
+    async def check():
+        redis = get_redis()
+        try:
+            await redis.zadd(RECENT_ALIASES_KEY, {'bench-recent': time.time()})
+        except (RedisError, OSError):
+            pytest.skip('Redis недоступен')
+        try:
+            return await is_alias_missing('bench-recent'), await is_alias_missing('garbage!')
+        finally:
+            await redis.zrem(RECENT_ALIASES_KEY, 'bench-recent')
+
+    assert asyncio.run(check()) == (False, True)
+
+
+
+@pytest.mark.parametrize('exists', [True, False], ids=['existing', 'missing'])
+def test_bench_contains(benchmark, exists):
+    bloom, _ = build_filter(100_000, 0.01)
+    alias = encode_alias_id(1 if exists else 1_000_000)
+    assert benchmark(bloom.__contains__, alias) is exists
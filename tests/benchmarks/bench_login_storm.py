@@ -0,0 +1,85 @@
+'''
+    Бенчмарк задержки редиректа во время "шторма" логинов.
+    Сначала измеряет задержку GET /links/{short_code} без нагрузки, затем
+        во время параллельных логинов (bcrypt) и выводит p50/p95/p99 для обоих
+        прогонов. Если хэширование паролей блокирует event loop, то задержка
+        редиректа во втором прогоне вырастет на сотни миллисекунд.
+
+    Запуск (сервис должен быть запущен):
+        python tests/benchmarks/bench_login_storm.py [адрес сервиса] [количество параллельных логинов]
+'''
+
+import asyncio
+import statistics
+import sys
+import time
+from uuid import uuid4
+
+import httpx
+
+
+REDIRECT_PROBES = 200
+
+
+
+async def measure_redirects(client: httpx.AsyncClient, short_code: str) -> list[float]:
+    '''
+        Последовательно выполняет REDIRECT_PROBES редиректов и возвращает их задержки в мс.
+    '''
+
+    latencies = []
+    for _ in range(REDIRECT_PROBES):
+        started = time.perf_counter()
+        await client.get(f'/links/{short_code}')
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return latencies
+
+
+async def login_storm(base_url: str, data: dict, stop: asyncio.Event) -> int:
+    '''
+        Логинится в цикле до установки события stop, возвращает количество логинов.
+    '''
+
+    logins = 0
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while not stop.is_set():
+            await client.post('/auth/login', data=data)
+            logins += 1
+
+    return logins
+
+
+def report(name: str, latencies: list[float]) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{name:<16} p50={quantiles[49]:7.1f} ms  p95={quantiles[94]:7.1f} ms  p99={quantiles[98]:7.1f} ms')
+
+
+async def main(base_url: str, concurrency: int) -> None:
+    data = {'grant_type': 'password', 'username': f'bench-{uuid4().hex[:8]}@mail.ru',
+            'password': uuid4().hex}
+
+    async with httpx.AsyncClient(base_url=base_url, follow_redirects=False) as client:
+        await client.post('/auth/signup', data=data)
+        response = await client.post('/links/shorten', json={'source_url': 'https://ya.ru'})
+        short_link = response.json().get('short_link')
+        short_code = short_link[short_link.rfind('/') + 1:]
+
+        report('idle', await measure_redirects(client, short_code))
+
+        stop = asyncio.Event()
+        storm = [asyncio.create_task(login_storm(base_url, data, stop)) for _ in range(concurrency)]
+        await asyncio.sleep(1)
+        started = time.perf_counter()
+        latencies = await measure_redirects(client, short_code)
+        stop.set()
+        logins = sum(await asyncio.gather(*storm))
+        report(f'{concurrency} logins', latencies)
+        print(f'logins during run: {logins} ({logins / (time.perf_counter() - started):.1f}/sec)')
+
+
+
+if __name__ == '__main__':
+    base_url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8088'
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    asyncio.run(main(base_url, concurrency))
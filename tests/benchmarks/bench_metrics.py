@@ -0,0 +1,112 @@
+'''
+    Микробенчмарки накладных расходов метрик (pytest-benchmark): один и тот же
+        минимальный эндпоинт FastAPI вызывается напрямую как ASGI приложение
+        без MetricsMiddleware и с ним, отдельно измеряются таймеры этапов.
+    test_metrics_overhead_is_small проверяет, что middleware добавляет к запросу
+        не больше MAX_OVERHEAD_SECONDS, test_register_stats_twice - что повторная
+        регистрация текущих значений не ломает запуск и не дублирует метрики.
+
+    Запуск из корня проекта (нужны переменные окружения из .env):
+        pytest tests/benchmarks/bench_metrics.py
+'''
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from fastapi import FastAPI
+
+from metrics import MetricsMiddleware, generate_metrics, register_stats, stage_timer, timed
+
+
+MAX_OVERHEAD_SECONDS = 0.00005
+REQUESTS = 2000
+
+SCOPE = {'type': 'http', 'method': 'GET', 'path': '/links/abc', 'raw_path': b'/links/abc',
+         'query_string': b'', 'headers': [], 'http_version': '1.1', 'scheme': 'http',
+         'server': ('127.0.0.1', 8088), 'client': ('127.0.0.1', 50000), 'root_path': ''}
+
+
+
+def create_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/links/{short_code}')
+    async def redirect(short_code: str):
+        return {'short_code': short_code}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+
+    return app
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b''}
+
+
+async def send(message):
+    pass
+
+
+async def call_many(app: FastAPI, count: int) -> None:
+    for _ in range(count):
+        await app(dict(SCOPE), receive, send)
+
+
+@timed('jwt_decode')
+def decorated():
+    pass
+
+
+
+@pytest.fixture(scope='module')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.mark.parametrize('with_metrics', [False, True], ids=['plain', 'metrics'])
+def test_bench_request(benchmark, loop, with_metrics):
+    app = create_app(with_metrics)
+    benchmark(lambda: loop.run_until_complete(call_many(app, 10)))
+
+
+def test_bench_stage_timer(benchmark):
+    def run():
+        with stage_timer('db_execute'):
+            pass
+
+    benchmark(run)
+
+
+def test_bench_timed_decorator(benchmark):
+    benchmark(decorated)
+
+
+def test_metrics_overhead_is_small(loop):
+    timings = {}
+    for with_metrics in (False, True):
+        app = create_app(with_metrics)
+        loop.run_until_complete(call_many(app, 100))
+        best = float('inf')
+        for _ in range(5):
+            started = time.perf_counter()
+            loop.run_until_complete(call_many(app, REQUESTS))
+            best = min(best, time.perf_counter() - started)
+        timings[with_metrics] = best / REQUESTS
+
+    assert timings[True] - timings[False] <= MAX_OVERHEAD_SECONDS
+
+
+def test_register_stats_twice():
+    register_stats('tinyurl_bench_stats', lambda: {'hits': 1})
+    register_stats('tinyurl_bench_stats', lambda: {'hits': 2})
+
+    assert generate_metrics().decode().count('# TYPE tinyurl_bench_stats_hits gauge') == 1
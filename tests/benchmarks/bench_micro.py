@@ -0,0 +1,97 @@
+'''
+    Микробенчмарки горячих функций (pytest-benchmark): валидация url, генерация
+        алиасов и получение данных о ссылке по алиасу из in-process кэша и из Redis.
+    Файл не подхватывается обычным запуском pytest (имя не test_*.py),
+        бенчмарки запускаются явно.
+
+    Запуск из корня проекта (нужны переменные окружения из .env; бенчмарки с Redis
+        пропускаются, если он недоступен):
+        pytest tests/benchmarks/bench_micro.py --benchmark-json tests/benchmarks/results/micro.json
+    Сравнение с сохраненным прогоном:
+        pytest tests/benchmarks/bench_micro.py --benchmark-compare --benchmark-compare-fail=mean:10%
+'''
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from redis.exceptions import RedisError
+
+import auth.models    # регистрирует модель User для relationship в Link
+from links.cache import alias_cache, set_cached_url_data, invalidate_alias, UrlData
+from links.redirect import resolve_alias
+from links.schemas import PostShortenLinkRequestBody
+from links.urls import normalize_url
+from links.utils import encode_alias_id, get_url_data_by_alias, is_link_expired
+from redis_client import get_redis
+
+
+BENCH_ALIAS = 'bench-micro'
+BENCH_URL_DATA = UrlData(user_id=1, source_url='https://example.com/articles/bench-micro', expires_at=None)
+
+URLS = {
+    'short': 'https://ya.ru',
+    'typical': 'https://example.com/articles/2025/04/how-to-shorten-links?utm_source=bench&utm_medium=email',
+    'long': 'https://example.com/' + 'a' * 2000,
+}
+
+
+
+@pytest.fixture(scope='module')
+def loop():
+    # Один event loop на модуль: клиент Redis привязывается к loop при первом запросе
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope='module')
+def redis_url_data(loop):
+    '''
+        Сохраняет данные тестовой ссылки в Redis, пропускает бенчмарк, если Redis недоступен.
+    '''
+
+    try:
+        loop.run_until_complete(get_redis().ping())
+    except (RedisError, OSError):
+        pytest.skip('Redis недоступен')
+    loop.run_until_complete(set_cached_url_data(BENCH_ALIAS, BENCH_URL_DATA))
+
+    yield BENCH_URL_DATA
+
+    loop.run_until_complete(invalidate_alias(BENCH_ALIAS))
+
+
+
+@pytest.mark.parametrize('kind', list(URLS))
+def test_normalize_url(benchmark, kind):
+    assert benchmark(normalize_url, URLS[kind])
+
+
+def test_shorten_body_validation(benchmark):
+    body = {'source_url': URLS['typical'], 'expires_at': '12.06.2030 04:20'}
+    assert benchmark(PostShortenLinkRequestBody.model_validate, body).source_url == URLS['typical']
+
+
+def test_encode_alias_id(benchmark):
+    assert len(benchmark(encode_alias_id, 123_456_789)) == 7
+
+
+def test_is_link_expired(benchmark):
+    url_data = BENCH_URL_DATA._replace(expires_at=1_893_456_000.0)
+    assert not benchmark(is_link_expired, url_data)
+
+
+def test_resolve_alias_local_cache(benchmark, loop):
+    alias_cache.set(BENCH_ALIAS, BENCH_URL_DATA)
+    result = benchmark(lambda: loop.run_until_complete(resolve_alias(BENCH_ALIAS)))
+    assert result.source_url == BENCH_URL_DATA.source_url
+
+
+def test_get_url_data_by_alias_redis(benchmark, loop, redis_url_data):
+    result = benchmark(lambda: loop.run_until_complete(get_url_data_by_alias(BENCH_ALIAS)))
+    assert result.source_url == redis_url_data.source_url
@@ -0,0 +1,144 @@
+'''
+    Симуляция одновременного промаха кэша по одному горячему алиасу.
+    STAMPEDE_REQUESTS одновременных запросов одного алиаса должны дать ровно
+        один запрос в БД: при промахе in-process кэша и Redis - за счет объединения
+        запросов внутри воркера (alias_lookups), а при устаревшей записи в Redis -
+        за счет блокировки на обновление, которую захватывает только один запрос
+        среди всех воркеров (каждый вызов lookup_url_data в симуляции ведет себя
+        как запрос в отдельном воркере). БД заменяется счетчиком запросов.
+
+    Запуск из корня проекта (нужны переменные окружения из .env; проверки с Redis
+        пропускаются, если он недоступен):
+        pytest tests/benchmarks/bench_stampede.py
+'''
+
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from redis.exceptions import RedisError
+
+import auth.models    # регистрирует модель User для relationship в Link
+import links.utils
+from links.cache import (alias_cache, alias_lookups, get_alias_cache_key, invalidate_alias, pack_url_data,
+                         unpack_url_data, UrlData, ALIAS_REFRESH_LOCK_KEY)
+from links.redirect import resolve_alias
+from links.utils import alias_refreshes, lookup_url_data
+from redis_client import get_redis
+
+
+STAMPEDE_ALIAS = 'bench-stampede'
+STAMPEDE_REQUESTS = 5000
+# Время "выполнения" запроса в БД, за которое успевают прийти все одновременные запросы
+DB_LATENCY = 0.05
+
+OLD_SOURCE_URL = 'https://example.com/old'
+NEW_SOURCE_URL = 'https://example.com/new'
+
+
+
+class CountingConnection:
+    '''
+        Заменяет соединение с БД: считает запросы и возвращает одну и ту же строку.
+    '''
+
+    def __init__(self, source_url: str):
+        self.queries = 0
+        self.row = SimpleNamespace(user_id=1, source_url=source_url, expires_at=None)
+
+    async def execute(self, query):
+        self.queries += 1
+        await asyncio.sleep(DB_LATENCY)
+        return SimpleNamespace(first=lambda: self.row)
+
+
+
+@pytest.fixture(scope='module')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def connection(monkeypatch, loop):
+    connection = CountingConnection(NEW_SOURCE_URL)
+
+    @asynccontextmanager
+    async def read_connection(use_primary: bool = False):
+        yield connection
+
+    monkeypatch.setattr(links.utils, 'read_connection', read_connection)
+    alias_cache.clear()
+    loop.run_until_complete(invalidate_alias(STAMPEDE_ALIAS))
+
+    yield connection
+
+    alias_cache.clear()
+    loop.run_until_complete(invalidate_alias(STAMPEDE_ALIAS))
+
+
+@pytest.fixture
+def redis(loop):
+    try:
+        loop.run_until_complete(get_redis().ping())
+    except (RedisError, OSError):
+        pytest.skip('Redis недоступен')
+
+    return get_redis()
+
+
+async def put_stale_entry(redis) -> None:
+    '''
+        Сохраняет в Redis запись об алиасе, которая устарела секунду назад, и снимает
+            блокировку на ее обновление.
+    '''
+
+    url = UrlData(user_id=1, source_url=OLD_SOURCE_URL, expires_at=None)
+    await redis.set(get_alias_cache_key(STAMPEDE_ALIAS), pack_url_data(url, time.time() - 1), ex=60)
+    await redis.delete(ALIAS_REFRESH_LOCK_KEY.format(STAMPEDE_ALIAS))
+
+
+async def stampede(func) -> list:
+    results = await asyncio.gather(*[func(STAMPEDE_ALIAS) for _ in range(STAMPEDE_REQUESTS)])
+    await asyncio.gather(*alias_refreshes)
+    return results
+
+
+
+def test_cold_miss_is_coalesced(loop, connection):
+    coalesced = alias_lookups.coalesced
+    results = loop.run_until_complete(stampede(resolve_alias))
+
+    assert connection.queries == 1
+    assert alias_lookups.coalesced - coalesced == STAMPEDE_REQUESTS - 1
+    assert all(url.source_url == NEW_SOURCE_URL for url in results)
+
+
+def test_stale_entry_is_refreshed_once(loop, connection, redis):
+    loop.run_until_complete(put_stale_entry(redis))
+    results = loop.run_until_complete(stampede(lookup_url_data))
+
+    # Все запросы сразу получают устаревшие данные, обновляет запись только один
+    assert connection.queries == 1
+    assert all(url.source_url == OLD_SOURCE_URL for url in results)
+
+    url, refresh_at = unpack_url_data(loop.run_until_complete(redis.get(get_alias_cache_key(STAMPEDE_ALIAS))))
+    assert refresh_at > time.time()
+    assert url.source_url == NEW_SOURCE_URL
+
+
+def test_stale_entry_behind_local_cache(loop, connection, redis):
+    loop.run_until_complete(put_stale_entry(redis))
+    results = loop.run_until_complete(stampede(resolve_alias))
+
+    assert connection.queries == 1
+    assert all(url.source_url == OLD_SOURCE_URL for url in results)
+    assert loop.run_until_complete(lookup_url_data(STAMPEDE_ALIAS)).source_url == NEW_SOURCE_URL
@@ -0,0 +1,97 @@
+'''
+    Сравнение прежнего и текущего представления данных об алиасе в кэше
+        (pytest-benchmark): стоимость попадания в кэш (разбор записи из Redis
+        и проверка срока действия ссылки) и размер записи в Redis.
+    Прежнее представление - JSON объект {user_id, source_url, expires_at} с датой
+        в формате ISO, которая разбиралась datetime.fromisoformat на каждый редирект.
+        Текущее - массив orjson [refresh_at, user_id, source_url, expires_at]
+        с датой в виде unix timestamp (links/cache.py pack_url_data).
+
+    Запуск из корня проекта (нужны переменные окружения из .env):
+        pytest tests/benchmarks/bench_url_data.py -s
+'''
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import auth.models    # регистрирует модель User для relationship в Link
+from links.cache import pack_url_data, unpack_url_data, UrlData
+from links.utils import is_link_expired
+
+
+SOURCE_URL = 'https://example.com/articles/2025/04/how-to-shorten-links?utm_source=bench&utm_medium=email'
+EXPIRES_AT = datetime(2030, 6, 12, 4, 20)
+HITS = 20_000
+
+
+
+def pack_legacy(url: dict) -> bytes:
+    return json.dumps({**url, 'expires_at': url['expires_at'].isoformat()}).encode()
+
+
+def hit_legacy(cached: bytes) -> str | None:
+    url = json.loads(cached)
+    expires_at = url.get('expires_at')
+    if expires_at and datetime.fromisoformat(expires_at) <= datetime.now():
+        return None
+    return url.get('source_url')
+
+
+def hit(cached: bytes) -> str | None:
+    url, _ = unpack_url_data(cached)
+    if is_link_expired(url):
+        return None
+    return url.source_url
+
+
+LEGACY_PAYLOAD = pack_legacy({'user_id': 123_456, 'source_url': SOURCE_URL, 'expires_at': EXPIRES_AT})
+PAYLOAD = pack_url_data(UrlData(123_456, SOURCE_URL, EXPIRES_AT.timestamp()), time.time() + 60)
+
+
+
+def best_of(func, cached: bytes, repeat: int = 5) -> float:
+    '''
+        Возвращает минимальное время одного попадания в кэш в секундах.
+    '''
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(HITS):
+            func(cached)
+        best = min(best, (time.perf_counter() - started) / HITS)
+
+    return best
+
+
+
+def test_compact_representation_is_smaller_and_faster():
+    assert hit(PAYLOAD) == hit_legacy(LEGACY_PAYLOAD) == SOURCE_URL
+
+    legacy_seconds, seconds = best_of(hit_legacy, LEGACY_PAYLOAD), best_of(hit, PAYLOAD)
+    print(f'\nпрежний формат: {len(LEGACY_PAYLOAD)} байт, {legacy_seconds * 1e6:.2f} мкс на попадание'
+          f'\nтекущий формат: {len(PAYLOAD)} байт, {seconds * 1e6:.2f} мкс на попадание')
+
+    assert len(PAYLOAD) < len(LEGACY_PAYLOAD)
+    assert seconds < legacy_seconds
+
+
+@pytest.mark.parametrize('representation', ['legacy', 'compact'])
+def test_bench_cache_hit(benchmark, representation):
+    func, cached = (hit_legacy, LEGACY_PAYLOAD) if representation == 'legacy' else (hit, PAYLOAD)
+    assert benchmark(func, cached) == SOURCE_URL
+
+
+@pytest.mark.parametrize('representation', ['legacy', 'compact'])
+def test_bench_cache_set(benchmark, representation):
+    if representation == 'legacy':
+        benchmark(pack_legacy, {'user_id': 123_456, 'source_url': SOURCE_URL, 'expires_at': EXPIRES_AT})
+    else:
+        benchmark(pack_url_data, UrlData(123_456, SOURCE_URL, EXPIRES_AT.timestamp()), time.time() + 60)
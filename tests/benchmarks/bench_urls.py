@@ -0,0 +1,109 @@
+'''
+    Фаззинг и проверка стоимости валидации исходных url (normalize_url).
+    Проверяет, что на случайных и специально построенных входах normalize_url
+        возвращает строку или выбрасывает только InvalidUrlError, что каноническая
+        форма не меняется при повторной нормализации и что время проверки растет
+        линейно от длины url и ограничено сверху для url максимальной длины.
+    Для сравнения включены бенчмарки прежней регулярки valid_url_regexp,
+        которая на входах вида "http://a.a.a...a!" работает за квадратичное время.
+
+    Запуск из корня проекта (нужны переменные окружения из .env):
+        pytest tests/benchmarks/bench_urls.py
+'''
+
+import os
+import random
+import re
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from config import URL_MAX_LENGTH
+from links.urls import normalize_url, InvalidUrlError
+
+
+# Прежняя регулярка из links/schemas.py - только для сравнения
+legacy_url_regexp = re.compile(
+        r'^(?:http|ftp)s?://'
+        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'
+        r'localhost|'
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
+        r'(?::\d+)?'
+        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+FUZZ_ITERATIONS = 20_000
+FUZZ_ALPHABET = 'aZ09-._~:/?#[]@!$&\'()*+,;=% \t\nяё\x00​'
+FUZZ_PREFIXES = ['http://', 'https://', 'ftp://', 'HTTPS://', 'javascript:', '//', '']
+
+# Входы, которые строятся под заданную длину и дают худший случай для регулярок
+ADVERSARIAL = {
+    'dots': lambda n: 'http://' + 'a.' * (n // 2) + '!',
+    'dashes': lambda n: 'http://' + 'a-' * (n // 2) + '.ru',
+    'long_path': lambda n: 'https://example.com/' + 'a' * n,
+    'long_query': lambda n: 'https://example.com/?' + 'utm=1&' * (n // 6),
+    'long_userinfo': lambda n: 'https://' + 'u:' * (n // 2) + '@example.com',
+    'unicode_host': lambda n: 'https://' + 'я' * n + '.рф',
+}
+
+# Предел стоимости проверки одного url максимальной длины
+MAX_SECONDS_PER_URL = 0.005
+
+
+
+def measure(url: str, repeat: int = 20) -> float:
+    '''
+        Возвращает минимальное из repeat измерений времени normalize_url(url) в секундах.
+    '''
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            normalize_url(url)
+        except InvalidUrlError:
+            pass
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+
+def test_normalize_url_fuzz():
+    rng = random.Random(19)
+    for _ in range(FUZZ_ITERATIONS):
+        body = ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 64)))
+        url = rng.choice(FUZZ_PREFIXES) + body
+        try:
+            canonical = normalize_url(url)
+        except InvalidUrlError:
+            continue
+        assert normalize_url(canonical) == canonical
+
+
+@pytest.mark.parametrize('kind', list(ADVERSARIAL))
+def test_normalize_url_cost_is_linear(kind):
+    build = ADVERSARIAL[kind]
+    small, large = measure(build(URL_MAX_LENGTH // 8)), measure(build(URL_MAX_LENGTH))
+
+    # 8-кратный рост длины дает не больше чем ~8-кратный рост времени (с запасом на шум)
+    assert large <= max(small * 16, 1e-4)
+    assert large <= MAX_SECONDS_PER_URL
+
+
+def test_normalize_url_rejects_too_long_before_parsing():
+    assert measure('https://example.com/' + 'a' * URL_MAX_LENGTH * 10) <= MAX_SECONDS_PER_URL
+
+
+
+@pytest.mark.parametrize('kind', ['dots', 'long_path'])
+def test_bench_normalize_url(benchmark, kind):
+    url = ADVERSARIAL[kind](8192)
+    benchmark(lambda: measure(url, repeat=1))
+
+
+@pytest.mark.parametrize('kind', ['dots', 'long_path'])
+def test_bench_legacy_regexp(benchmark, kind):
+    benchmark(legacy_url_regexp.match, ADVERSARIAL[kind](8192))
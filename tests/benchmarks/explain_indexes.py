@@ -0,0 +1,99 @@
+'''
+    Регрессионная проверка планов запросов /links/search и /links/all_my_links.
+    Заполняет таблицу link тестовыми данными (по умолчанию 1 млн ссылок),
+        выполняет EXPLAIN для запросов, которые строят эндпоинты, и завершается
+        с кодом 1, если хотя бы один из них читает таблицу link через Seq Scan.
+
+    Запуск из корня проекта (нужны переменные окружения из .env и примененные миграции):
+        python tests/benchmarks/explain_indexes.py [количество ссылок]
+    Адрес БД можно переопределить переменной окружения BENCH_DB_URL.
+'''
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import ASYNC_DB_URL
+from links.utils import build_search_query, build_user_links_query
+
+
+BENCH_USERS = 1000
+BENCH_URL_TEMPLATE = 'https://example.com/articles/'
+
+
+
+async def seed(connection, links_count: int) -> None:
+    '''
+        Создает BENCH_USERS пользователей и links_count ссылок, распределенных между ними.
+    '''
+
+    await connection.execute(text(
+        '''INSERT INTO "user" (email, hashed_password, created_at, is_active)
+           SELECT 'bench-' || g || '@bench.local', NULL, now(), true
+           FROM generate_series(1, :users) g
+           ON CONFLICT (email) DO NOTHING'''), {'users': BENCH_USERS})
+    min_user_id = (await connection.execute(text(
+        '''SELECT min(id) FROM "user" WHERE email LIKE 'bench-%@bench.local' '''))).scalar_one()
+
+    await connection.execute(text(
+        '''INSERT INTO link (user_id, alias, source_url, created_at, transitions_quantity)
+           SELECT :min_user_id + g % :users, 'bench-' || g, :url || md5(g::text), now(), 0
+           FROM generate_series(1, :links) g
+           ON CONFLICT (alias) DO NOTHING'''),
+        {'min_user_id': min_user_id, 'users': BENCH_USERS, 'links': links_count, 'url': BENCH_URL_TEMPLATE})
+    await connection.execute(text('ANALYZE link'))
+
+
+def find_seq_scans(plan: dict) -> list[str]:
+    '''
+        Возвращает список таблиц, которые в плане читаются через Seq Scan.
+    '''
+
+    scans = []
+    if plan.get('Node Type') == 'Seq Scan':
+        scans.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        scans.extend(find_seq_scans(child))
+
+    return scans
+
+
+async def main(links_count: int) -> int:
+    engine = create_async_engine(os.getenv('BENCH_DB_URL', ASYNC_DB_URL))
+    async with engine.begin() as connection:
+        await seed(connection, links_count)
+        user_id, source_url = (await connection.execute(text(
+            "SELECT user_id, source_url FROM link WHERE alias = 'bench-1'"))).one()
+
+        queries = {
+            '/links/search': build_search_query(user_id, source_url),
+            '/links/all_my_links': build_user_links_query(user_id, limit=100),
+            '/links/all_my_links?cursor': build_user_links_query(user_id, cursor=1, limit=100),
+        }
+
+        failed = False
+        for endpoint, query in queries.items():
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+            result = await connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}'))
+            plan = result.scalar_one()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            seq_scans = [table for table in find_seq_scans(plan[0]['Plan']) if table == 'link']
+            status = 'SEQ SCAN' if seq_scans else 'ok'
+            failed = failed or bool(seq_scans)
+            print(f'{endpoint:<29} {status}  ({plan[0]["Plan"]["Node Type"]})')
+    await engine.dispose()
+
+    return 1 if failed else 0
+
+
+
+if __name__ == '__main__':
+    links_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sys.exit(asyncio.run(main(links_count)))
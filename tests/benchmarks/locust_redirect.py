@@ -0,0 +1,35 @@
+'''
+    Нагрузочный сценарий редиректа по коротким ссылкам (GET /links/{short_code}).
+    Каждый пользователь создает несколько ссылок и затем без пауз переходит по ним,
+        поэтому почти все запросы попадают в кэш и измеряется накладная стоимость
+        самого обработчика редиректа.
+
+    Для сравнения fast-path (RedirectMiddleware) и обычного эндпоинта запустите сервис
+        на одном ядре (SERVER_WORKERS=1) дважды - с REDIRECT_FAST_PATH=True и False -
+        и сравните req/s:
+        locust -f tests/benchmarks/locust_redirect.py --host http://127.0.0.1:8088 \
+            --headless -u 200 -r 50 -t 60s
+'''
+
+from random import choice
+
+from locust import FastHttpUser, task
+
+
+LINKS_PER_USER = 10
+
+
+
+class RedirectUser(FastHttpUser):
+
+    def on_start(self):
+        self.short_codes = []
+        for i in range(LINKS_PER_USER):
+            response = self.client.post('/links/shorten', json={'source_url': f'https://ya.ru/?q={i}'},
+                                        name='post_link')
+            short_link = response.json().get('short_link')
+            self.short_codes.append(short_link[short_link.rfind('/') + 1:])
+
+    @task
+    def redirect(self):
+        self.client.get(f'/links/{choice(self.short_codes)}', allow_redirects=False, name='redirect')
@@ -0,0 +1,169 @@
+'''
+    Воспроизводимый прогон нагрузочных сценариев и сравнение с базовой линией.
+    Запускает сценарии из tests/benchmarks/scenarios.py по отдельности (locust --headless),
+        собирает для каждого req/s, p50/p95/p99 и количество ошибок и сохраняет
+        результат в JSON с хэшем текущего коммита. Если передан --baseline, то
+        сравнивает результат с ним и завершается с кодом 1 при регрессии больше --threshold.
+
+    Запуск из корня проекта (сервис запущен, БД заполнена tests/benchmarks/seed.py):
+        python tests/benchmarks/run.py run --host http://127.0.0.1:8088 --run-time 60s
+        python tests/benchmarks/run.py run --scenarios redirect mixed --baseline tests/benchmarks/results/<commit>.json
+    Сравнение двух сохраненных результатов:
+        python tests/benchmarks/run.py compare tests/benchmarks/results/a.json tests/benchmarks/results/b.json
+'''
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS_FILE = os.path.join(BENCHMARKS_DIR, 'scenarios.py')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Имя сценария -> класс пользователя в scenarios.py
+SCENARIOS = {'redirect': 'RedirectUser', 'shorten': 'ShortenUser',
+             'mixed': 'MixedUser', 'auth': 'AuthUser'}
+
+# Метрики, рост которых (latency) или падение (rps) считается регрессией
+LATENCY_METRICS = ('p50', 'p95', 'p99')
+THROUGHPUT_METRICS = ('rps',)
+
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def to_float(value: str) -> float:
+    # Для сценария без запросов locust пишет N/A вместо перцентилей
+    return float(value) if value not in ('', 'N/A') else 0.0
+
+
+def parse_stats(csv_prefix: str) -> dict:
+    '''
+        Читает итоговую строку (Aggregated) из CSV статистики locust.
+    '''
+
+    with open(f'{csv_prefix}_stats.csv', newline='') as f:
+        rows = {row['Name']: row for row in csv.DictReader(f)}
+
+    aggregated = rows['Aggregated']
+    return {'rps': to_float(aggregated['Requests/s']),
+            'p50': to_float(aggregated['50%']), 'p95': to_float(aggregated['95%']),
+            'p99': to_float(aggregated['99%']),
+            'requests': int(aggregated['Request Count']),
+            'failures': int(aggregated['Failure Count'])}
+
+
+def run_scenario(name: str, args: argparse.Namespace, workdir: str) -> dict:
+    '''
+        Запускает один сценарий в headless режиме и возвращает его метрики.
+    '''
+
+    csv_prefix = os.path.join(workdir, name)
+    command = ['locust', '-f', SCENARIOS_FILE, SCENARIOS[name], '--host', args.host, '--headless',
+               '--users', str(args.users), '--spawn-rate', str(args.spawn_rate),
+               '--run-time', args.run_time, '--csv', csv_prefix, '--only-summary',
+               '--exit-code-on-error', '0']
+    print(f'Running {name}: {" ".join(command)}', flush=True)
+    subprocess.run(command, check=True)
+
+    return parse_stats(csv_prefix)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    '''
+        Печатает изменения метрик по сценариям, которые есть в обоих результатах,
+            и возвращает список регрессий больше threshold (доля, 0.1 = 10%).
+    '''
+
+    regressions = []
+    print(f'{"scenario":<10} {"metric":<6} {"baseline":>12} {"current":>12} {"change":>8}')
+    for name, metrics in current['scenarios'].items():
+        base_metrics = baseline['scenarios'].get(name)
+        if not base_metrics:
+            continue
+        for metric in THROUGHPUT_METRICS + LATENCY_METRICS:
+            base, value = base_metrics[metric], metrics[metric]
+            change = (value - base) / base if base else 0.0
+            regressed = (-change if metric in THROUGHPUT_METRICS else change) > threshold
+            mark = '  REGRESSION' if regressed else ''
+            print(f'{name:<10} {metric:<6} {base:>12.1f} {value:>12.1f} {change:>+8.1%}{mark}')
+            if regressed:
+                regressions.append(f'{name}.{metric}')
+
+    return regressions
+
+
+def run(args: argparse.Namespace) -> int:
+    result = {'commit': get_commit(), 'created_at': datetime.now().isoformat(timespec='seconds'),
+              'params': {'host': args.host, 'users': args.users, 'spawn_rate': args.spawn_rate,
+                         'run_time': args.run_time},
+              'scenarios': {}}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.scenarios:
+            result['scenarios'][name] = run_scenario(name, args, workdir)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{result["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=4)
+    print(f'Results saved to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), result, args.threshold)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            return 1
+
+    return 0
+
+
+def compare_files(args: argparse.Namespace) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    print(f'{baseline["commit"]} -> {current["commit"]}')
+    regressions = compare(baseline, current, args.threshold)
+
+    return 1 if regressions else 0
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочные прогоны и сравнение с базовой линией')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='запустить сценарии и сохранить результат')
+    run_parser.add_argument('--host', default='http://127.0.0.1:8088')
+    run_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument('--users', type=int, default=200, help='количество пользователей locust')
+    run_parser.add_argument('--spawn-rate', type=int, default=50)
+    run_parser.add_argument('--run-time', default='60s')
+    run_parser.add_argument('--output', help='путь к JSON с результатом, по умолчанию results/<commit>.json')
+    run_parser.add_argument('--baseline', help='JSON с базовой линией для сравнения')
+    run_parser.add_argument('--threshold', type=float, default=0.1, help='допустимая регрессия (доля)')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser('compare', help='сравнить два сохраненных результата')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='допустимая регрессия (доля)')
+    compare_parser.set_defaults(handler=compare_files)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
@@ -0,0 +1,170 @@
+'''
+    Нагрузочные сценарии для воспроизводимых прогонов (запускаются через tests/benchmarks/run.py).
+    Каждый сценарий - отдельный класс пользователя, который выбирается по имени:
+        RedirectUser - только редиректы по засеянным ссылкам с распределением Ципфа;
+        ShortenUser - только создание ссылок;
+        MixedUser - смешанная нагрузка (редиректы, создание, поиск, статистика, список ссылок);
+        AuthUser - логины, проверка текущего пользователя и логауты засеянных пользователей.
+    Перед запуском БД заполняется скриптом tests/benchmarks/seed.py, путь к его манифесту
+        можно переопределить переменной окружения BENCH_SEED_MANIFEST.
+
+    Запуск одного сценария вручную из корня проекта (нужны переменные окружения из .env):
+        locust -f tests/benchmarks/scenarios.py RedirectUser --host http://127.0.0.1:8088 \
+            --headless -u 200 -r 50 -t 60s
+'''
+
+import json
+import math
+import os
+import random
+import sys
+from urllib.parse import urlencode
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from locust import FastHttpUser, task
+
+from links.utils import encode_alias_id
+
+
+SEED_MANIFEST = os.getenv('BENCH_SEED_MANIFEST',
+                          os.path.join(os.path.dirname(__file__), 'data', 'seed.json'))
+
+
+
+class ZipfSampler:
+    '''
+        Выбор ранга из [0, n) с распределением Ципфа (P(k) ~ 1 / (k + 1)^s) обращением
+            непрерывной аппроксимации функции распределения: O(1) по памяти и времени,
+            поэтому подходит и для 10 млн ссылок.
+    '''
+
+    def __init__(self, n: int, s: float, rng: random.Random | None = None):
+        self.n = n
+        self.s = s
+        self.rng = rng or random.Random()
+
+    def sample(self) -> int:
+        u = self.rng.random()
+        if math.isclose(self.s, 1.0):
+            x = self.n ** u
+        else:
+            x = ((self.n ** (1 - self.s) - 1) * u + 1) ** (1 / (1 - self.s))
+
+        return min(int(x) - 1, self.n - 1)
+
+
+
+def load_manifest() -> dict:
+    with open(SEED_MANIFEST) as f:
+        return json.load(f)
+
+
+def get_short_code(response) -> str | None:
+    short_link = response.json().get('short_link') if response.status_code == 200 else None
+    return short_link[short_link.rfind('/') + 1:] if short_link else None
+
+
+
+class SeededUser(FastHttpUser):
+    '''
+        Базовый пользователь сценариев: выбирает засеянные алиасы по популярности.
+    '''
+
+    abstract = True
+    manifest = None
+
+    def on_start(self):
+        if SeededUser.manifest is None:
+            SeededUser.manifest = load_manifest()
+        self.sampler = ZipfSampler(self.manifest['links'], self.manifest['zipf_s'])
+
+    def popular_alias(self) -> str:
+        return encode_alias_id(self.manifest['first_alias_id'] + self.sampler.sample())
+
+    def popular_url(self) -> str:
+        alias_id = self.manifest['first_alias_id'] + self.sampler.sample()
+        return self.manifest['url_template'].format(alias_id)
+
+    def login(self) -> None:
+        email = self.manifest['email_template'].format(random.randint(1, self.manifest['users']))
+        self.client.post('/auth/login', name='login',
+                         data={'grant_type': 'password', 'username': email,
+                               'password': self.manifest['password']})
+
+
+
+class RedirectUser(SeededUser):
+
+    @task
+    def redirect(self):
+        self.client.get(f'/links/{self.popular_alias()}', allow_redirects=False, name='redirect')
+
+
+
+class ShortenUser(SeededUser):
+
+    @task
+    def shorten(self):
+        self.client.post('/links/shorten', json={'source_url': f'https://example.com/bench/{uuid4().hex}'},
+                         name='shorten')
+
+
+
+class MixedUser(SeededUser):
+
+    def on_start(self):
+        super().on_start()
+        self.login()
+        self.short_codes = []
+
+    @task(20)
+    def redirect(self):
+        self.client.get(f'/links/{self.popular_alias()}', allow_redirects=False, name='redirect')
+
+    @task(5)
+    def shorten(self):
+        response = self.client.post('/links/shorten', json={'source_url': self.popular_url()}, name='shorten')
+        short_code = get_short_code(response)
+        if short_code:
+            self.short_codes.append(short_code)
+
+    @task(2)
+    def search(self):
+        self.client.get(f'/links/search?{urlencode({"original_url": self.popular_url()})}', name='search')
+
+    @task(2)
+    def stats(self):
+        self.client.get(f'/links/{self.popular_alias()}/stats', name='stats')
+
+    @task(1)
+    def all_my_links(self):
+        self.client.get('/links/all_my_links?limit=100', name='all_my_links')
+
+    @task(1)
+    def update(self):
+        if self.short_codes:
+            short_code = self.short_codes.pop()
+            response = self.client.put(f'/links/{short_code}', json={}, name='update')
+            new_short_link = response.json().get('new_short_link') if response.status_code == 200 else None
+            if new_short_link:
+                self.short_codes.append(new_short_link[new_short_link.rfind('/') + 1:])
+
+    @task(1)
+    def delete(self):
+        if self.short_codes:
+            self.client.delete(f'/links/{self.short_codes.pop()}', name='delete')
+
+
+
+class AuthUser(SeededUser):
+
+    @task(5)
+    def login_and_check(self):
+        self.login()
+        self.client.get('/auth/current-user', name='current_user')
+
+    @task(1)
+    def logout(self):
+        self.client.post('/auth/logout', name='logout')
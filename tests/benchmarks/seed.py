@@ -0,0 +1,128 @@
+'''
+    Заполнение БД данными для нагрузочных сценариев (tests/benchmarks/scenarios.py).
+    Создает пользователей с известным паролем и links_count ссылок, ссылки загружаются
+        через COPY. Алиасы берутся из блока идентификаторов, зарезервированного
+        в последовательности link_alias_seq, поэтому не пересекаются с алиасами,
+        которые сервис выдает во время прогона.
+    Параметры засева сохраняются в манифест (по умолчанию tests/benchmarks/data/seed.json),
+        по которому сценарии восстанавливают алиасы и выбирают их с распределением Ципфа
+        (ранг популярности ссылки = порядковый номер ее идентификатора в блоке).
+
+    Запуск из корня проекта (нужны переменные окружения из .env и примененные миграции):
+        python tests/benchmarks/seed.py --links 1000000
+        python tests/benchmarks/seed.py --links 10000000 --users 10000 --zipf-s 1.1
+    Адрес БД можно переопределить переменной окружения BENCH_DB_URL.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import ASYNC_DB_URL
+from auth.hashing import pwd_context
+from links.bloom import request_alias_filter_rebuild
+from links.utils import encode_alias_id
+
+
+BENCH_PASSWORD = 'benchmark'
+BENCH_EMAIL_TEMPLATE = 'bench-seed-{}@bench.local'
+BENCH_URL_TEMPLATE = 'https://example.com/articles/{}'
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__), 'data', 'seed.json')
+
+LINK_COLUMNS = ['user_id', 'alias', 'source_url', 'created_at', 'transitions_quantity']
+
+
+
+async def seed_users(connection, users_count: int) -> list[int]:
+    '''
+        Создает users_count пользователей с паролем BENCH_PASSWORD, возвращает их id.
+    '''
+
+    await connection.execute(text(
+        '''INSERT INTO "user" (email, hashed_password, created_at, is_active)
+           SELECT replace(:template, '{}', g::text), :hashed_password, now(), true
+           FROM generate_series(1, :users) g
+           ON CONFLICT (email) DO NOTHING'''),
+        {'template': BENCH_EMAIL_TEMPLATE, 'hashed_password': pwd_context.hash(BENCH_PASSWORD),
+         'users': users_count})
+    result = await connection.execute(text(
+        '''SELECT id FROM "user" WHERE email LIKE 'bench-seed-%@bench.local' ORDER BY id'''))
+
+    return list(result.scalars())
+
+
+async def reserve_alias_ids(connection, links_count: int) -> int:
+    '''
+        Резервирует в link_alias_seq непрерывный блок из links_count идентификаторов
+            и возвращает первый из них.
+    '''
+
+    first_alias_id = (await connection.execute(text("SELECT nextval('link_alias_seq')"))).scalar_one()
+    await connection.execute(text("SELECT setval('link_alias_seq', :last_id)"),
+                             {'last_id': first_alias_id + links_count})
+
+    return first_alias_id
+
+
+def generate_links(first_alias_id: int, links_count: int, user_ids: list[int], seed: int):
+    '''
+        Генерирует строки таблицы link для COPY.
+    '''
+
+    rng = random.Random(seed)
+    created_at = datetime.now()
+    for i in range(links_count):
+        alias_id = first_alias_id + i
+        yield (rng.choice(user_ids), encode_alias_id(alias_id), BENCH_URL_TEMPLATE.format(alias_id),
+               created_at, 0)
+
+
+async def main(args: argparse.Namespace) -> None:
+    engine = create_async_engine(os.getenv('BENCH_DB_URL', ASYNC_DB_URL))
+    async with engine.begin() as connection:
+        user_ids = await seed_users(connection, args.users)
+        first_alias_id = await reserve_alias_ids(connection, args.links)
+
+        started = time.perf_counter()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            'link', columns=LINK_COLUMNS,
+            records=generate_links(first_alias_id, args.links, user_ids, args.seed))
+        print(f'COPY {args.links:,} links: {time.perf_counter() - started:.1f} s')
+
+        await connection.execute(text('ANALYZE link'))
+    await engine.dispose()
+
+    # Ссылки добавлены в обход API, поэтому запущенные воркеры перестраивают фильтры алиасов
+    if not await request_alias_filter_rebuild():
+        print('Redis недоступен, фильтры алиасов запущенных воркеров не перестроены')
+
+    manifest = {'first_alias_id': first_alias_id, 'links': args.links, 'zipf_s': args.zipf_s,
+                'users': len(user_ids), 'email_template': BENCH_EMAIL_TEMPLATE,
+                'password': BENCH_PASSWORD, 'url_template': BENCH_URL_TEMPLATE}
+    os.makedirs(os.path.dirname(args.manifest), exist_ok=True)
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    print(f'Manifest saved to {args.manifest}')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заполнение БД данными для нагрузочных сценариев')
+    parser.add_argument('--links', type=int, default=1_000_000, help='количество ссылок')
+    parser.add_argument('--users', type=int, default=1000, help='количество пользователей')
+    parser.add_argument('--zipf-s', type=float, default=1.0,
+                        help='параметр распределения Ципфа популярности алиасов')
+    parser.add_argument('--seed', type=int, default=42, help='seed генератора случайных чисел')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help='путь к манифесту засева')
+    asyncio.run(main(parser.parse_args()))
@@ -12,9 +12,10 @@ class TestUser(HttpUser):
                        'https://www.reddit.com', 'https://dzen.ru', 'https://ya.ru',
                        'https://ru.pinterest.com', 'https://vk.com', 'https://mail.ru',
                        'https://pikabu.ru']
-    short_codes_list = ['6b7a62',]
 
     def on_start(self):
+        # короткие ссылки, созданные этим пользователем
+        self.short_codes_list = []
         # регистрируемся и логинимся
         fake = Faker()
         username = f'{fake.user_name()}@mail.ru'
@@ -35,9 +36,9 @@ class TestUser(HttpUser):
     def post_links_shorten(self):
         source_url = choice(self.source_url_list)
         response = self.client.post('/links/shorten', json={"source_url": source_url}, name='post_link')
-        short_code = response.json().get('short_link')
-        short_code = short_code[short_code.rfind('/') + 1:]
-        self.short_codes_list.append(short_code)
+        short_link = response.json().get('short_link')
+        if short_link:
+            self.short_codes_list.append(short_link[short_link.rfind('/') + 1:])
 
     @task(2)
     def get_links_search(self):
@@ -46,6 +47,8 @@ class TestUser(HttpUser):
 
     @task(2)
     def get_links_stats(self):
+        if not self.short_codes_list:
+            return
         short_code = choice(self.short_codes_list)
         self.client.get(f'/links/{short_code}/stats', name='get_short_code_stats')
 
@@ -55,21 +58,28 @@ class TestUser(HttpUser):
 
     @task(2)
     def delete_short_code(self):
+        if not self.short_codes_list:
+            return
         short_code = choice(self.short_codes_list)
         self.short_codes_list.remove(short_code)
-        self.client.delete(f'/links/{short_code}')
+        self.client.delete(f'/links/{short_code}', name='delete_short_code')
 
     @task(2)
     def put_short_code(self):
+        if not self.short_codes_list:
+            return
         short_code = choice(self.short_codes_list)
-        response = self.client.put(f'/links/{short_code}')
-        new_short_code = response.json().get('short_link')
-        new_short_code = short_code[short_code.rfind('/') + 1:]
-        self.short_codes_list.append(short_code)
-        self.short_codes_list.remove(new_short_code)
+        response = self.client.put(f'/links/{short_code}', json={}, name='put_short_code')
+        new_short_link = response.json().get('new_short_link')
+        if new_short_link:
+            # старый алиас больше не существует, дальше используется новый
+            self.short_codes_list.remove(short_code)
+            self.short_codes_list.append(new_short_link[new_short_link.rfind('/') + 1:])
 
     @task(20)
     def get_links_short_code(self):
+        if not self.short_codes_list:
+            return
         short_code = choice(self.short_codes_list)
         self.client.get(f'/links/{short_code}', name='get_short_code')
 